@@ -0,0 +1,3 @@
+cd /d "%~dp0"
+if "%WEB_CONCURRENCY%"=="" set WEB_CONCURRENCY=4
+uvicorn app.main:app --host 0.0.0.0 --port 8000 --workers %WEB_CONCURRENCY%
@@ -0,0 +1,276 @@
+# app/archive.py
+"""Lagdelt transaksjonshistorikk.
+
+- varm: `transactions` i hoveddatabasen (siste HOT_DAYS dager)
+- kald: én SQLite-fil pr måned i ARCHIVE_DIR (`tx-YYYY-MM.db`)
+
+`archive_old_transactions()` flytter eldre rader i batcher: først skrives de
+til månedsfilen (INSERT OR IGNORE, så et avbrutt løp kan kjøres på nytt), så
+slettes de fra hoveddatabasen, og lagerbokas åpningsbalanse (ledger.py) tar
+over tallene deres. Hver DB-forbindelse får de nyeste
+månedsfilene ATTACH-et read-only og to TEMP-views:
+
+- `tx_archived` – alle vedlagte arkiv (UNION ALL)
+- `tx_all`      – `transactions` + `tx_archived`
+
+SQLite tillater maks 10 vedlagte databaser, så bare de MAX_ATTACHED nyeste
+månedene er med i viewene; `history()` leser eldre måneder direkte fra filene
+når det trengs.
+"""
+import os
+import re
+import sqlite3
+import time
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from urllib.request import pathname2url
+
+from sqlalchemy import column, event, select, table
+from sqlalchemy.orm import Session
+
+from . import ledger
+from .db import DB_PATH, engine
+from .models import Tx
+
+ARCHIVE_DIR = os.environ.get("INV_ARCHIVE_DIR") or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "tx_archive")
+HOT_DAYS = int(os.environ.get("INV_TX_HOT_DAYS", "180"))
+MAX_ATTACHED = 9  # SQLite: 10 ATTACH pr forbindelse, én holdes ledig
+BATCH = 5000
+
+TX_COLS = tuple(c.name for c in Tx.__table__.columns)
+_COLS_SQL = ", ".join(TX_COLS)
+_FILE_RE = re.compile(r"^tx-(\d{4}-\d{2})\.db$")
+_I_ITEM, _I_CO, _I_KIND, _I_QTY, _I_DELTA = (TX_COLS.index(c) for c in ("item_id", "co_id", "kind", "qty", "delta"))
+
+# Core-tabeller for viewene (TEMP, pr forbindelse – ikke en del av Base.metadata)
+tx_all = table("tx_all", *(column(c.name, c.type) for c in Tx.__table__.columns))
+tx_archived = table("tx_archived", *(column(c.name, c.type) for c in Tx.__table__.columns))
+HistRow = namedtuple("HistRow", TX_COLS)
+
+_ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY,
+    item_id INTEGER, sku VARCHAR(120), name VARCHAR(200), delta INTEGER,
+    note VARCHAR(200), ts DATETIME, user_id INTEGER, user_name VARCHAR(120),
+    unit_id INTEGER, po_id INTEGER, co_id INTEGER, kind VARCHAR(20), qty INTEGER
+);
+CREATE INDEX IF NOT EXISTS ix_arch_ts ON transactions(ts);
+CREATE INDEX IF NOT EXISTS ix_arch_item ON transactions(item_id, id);
+"""
+
+
+# ------------------------------------------------------------
+# Filer
+# ------------------------------------------------------------
+def archive_files() -> List[Tuple[str, str]]:
+    """[(YYYY-MM, sti)], nyeste først."""
+    try:
+        names = os.listdir(ARCHIVE_DIR)
+    except FileNotFoundError:
+        return []
+    out = [(m.group(1), os.path.join(ARCHIVE_DIR, n)) for n in names if (m := _FILE_RE.match(n))]
+    return sorted(out, reverse=True)
+
+
+def _generation() -> int:
+    # Katalogens mtime endres når en ny månedsfil lages – da må forbindelsene vedlegge på nytt
+    try:
+        return os.stat(ARCHIVE_DIR).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def _ro_uri(path: str) -> str:
+    return "file:" + pathname2url(os.path.abspath(path)) + "?mode=ro"
+
+
+def _select_list(have) -> str:
+    # Månedsfiler fra før migrering 009 mangler kind/qty
+    return ", ".join(c if c in have else f"NULL AS {c}" for c in TX_COLS)
+
+
+# ------------------------------------------------------------
+# ATTACH + views pr forbindelse
+# ------------------------------------------------------------
+def attach_archives(dbapi_conn) -> None:
+    cur = dbapi_conn.cursor()
+    try:
+        for _, name, _ in cur.execute("PRAGMA database_list").fetchall():
+            if name.startswith("arch_"):
+                cur.execute(f"DETACH DATABASE {name}")
+        parts = []
+        for month, path in archive_files()[:MAX_ATTACHED]:
+            alias = "arch_" + month.replace("-", "_")
+            cur.execute(f"ATTACH DATABASE ? AS {alias}", (_ro_uri(path),))
+            have = {r[1] for r in cur.execute(f"PRAGMA {alias}.table_info(transactions)").fetchall()}
+            parts.append(f"SELECT {_select_list(have)} FROM {alias}.transactions")
+        if not parts:  # tomt view med riktige kolonner
+            parts.append(f"SELECT {_COLS_SQL} FROM main.transactions WHERE 0")
+        cur.execute("DROP VIEW IF EXISTS temp.tx_archived")
+        cur.execute("DROP VIEW IF EXISTS temp.tx_all")
+        cur.execute("CREATE TEMP VIEW tx_archived AS " + " UNION ALL ".join(parts))
+        cur.execute(f"CREATE TEMP VIEW tx_all AS SELECT {_COLS_SQL} FROM main.transactions UNION ALL SELECT {_COLS_SQL} FROM tx_archived")
+    finally:
+        cur.close()
+
+
+def _on_connect(dbapi_conn, record):
+    record.info["arch_gen"] = _generation()
+    attach_archives(dbapi_conn)
+
+
+def _on_checkout(dbapi_conn, record, proxy):
+    gen = _generation()
+    if record.info.get("arch_gen") != gen:
+        attach_archives(dbapi_conn)
+        record.info["arch_gen"] = gen
+
+
+def install(eng) -> None:
+    """Gir alle forbindelser fra `eng` arkivene og viewene (hovedmotoren og rapportmotoren)."""
+    event.listen(eng, "connect", _on_connect)
+    event.listen(eng, "checkout", _on_checkout)
+
+
+install(engine)
+
+
+# ------------------------------------------------------------
+# Lesing på tvers av lagene
+# ------------------------------------------------------------
+def _from_file(path: str, item_id: Optional[int], limit: int, order: str) -> List[HistRow]:
+    conn = sqlite3.connect(_ro_uri(path), uri=True)
+    try:
+        where, params = ("WHERE item_id = ?", [item_id]) if item_id is not None else ("", [])
+        have = {r[1] for r in conn.execute("PRAGMA table_info(transactions)").fetchall()}
+        rows = conn.execute(f"SELECT {_select_list(have)} FROM transactions {where} ORDER BY {order} DESC LIMIT ?",
+                            params + [limit]).fetchall()
+    finally:
+        conn.close()
+    ts_i = TX_COLS.index("ts")
+    out = []
+    for r in rows:
+        r = list(r)
+        if isinstance(r[ts_i], str):
+            r[ts_i] = datetime.fromisoformat(r[ts_i])
+        out.append(HistRow(*r))
+    return out
+
+
+def history(db: Session, limit: int = 500, item_id: Optional[int] = None, order: str = "ts") -> list:
+    """Nyeste transaksjoner (evt. for én vare), varm del først.
+
+    Arkivene holder bare eldre rader enn `transactions`, så vi leser kun
+    videre ned i lagene når den varme delen gir færre enn `limit` rader.
+    """
+    hot = Tx.__table__
+    stmt = select(hot)
+    if item_id is not None:
+        stmt = stmt.where(hot.c.item_id == item_id)
+    rows = list(db.execute(stmt.order_by(hot.c[order].desc()).limit(limit)).all())
+    if len(rows) >= limit:
+        return rows
+
+    stmt = select(tx_archived)
+    if item_id is not None:
+        stmt = stmt.where(tx_archived.c.item_id == item_id)
+    rows += db.execute(stmt.order_by(tx_archived.c[order].desc()).limit(limit - len(rows))).all()
+
+    for _, path in archive_files()[MAX_ATTACHED:]:
+        if len(rows) >= limit:
+            break
+        rows += _from_file(path, item_id, limit - len(rows), order)
+    return rows
+
+
+# ------------------------------------------------------------
+# Arkivering
+# ------------------------------------------------------------
+def _open_archive(month: str) -> sqlite3.Connection:
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(ARCHIVE_DIR, f"tx-{month}.db"), timeout=30)
+    conn.executescript(_ARCHIVE_SCHEMA)
+    have = {r[1] for r in conn.execute("PRAGMA table_info(transactions)").fetchall()}
+    for col, typ in (("kind", "VARCHAR(20)"), ("qty", "INTEGER")):
+        if col not in have:
+            conn.execute(f"ALTER TABLE transactions ADD COLUMN {col} {typ}")
+    return conn
+
+
+def archive_old_transactions(older_than_days: int = HOT_DAYS, batch: int = BATCH, progress=print) -> int:
+    """Flytter transaksjoner eldre enn `older_than_days` til månedsfiler. Returnerer antall rader."""
+    cutoff = (datetime.utcnow() - timedelta(days=older_than_days)).strftime("%Y-%m-%d %H:%M:%S.%f")
+    src = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    moved = 0
+    try:
+        while True:
+            rows = src.execute(
+                f"SELECT {_COLS_SQL} FROM transactions WHERE ts < ? ORDER BY ts, id LIMIT ?", (cutoff, batch)
+            ).fetchall()
+            if not rows:
+                break
+            by_month = defaultdict(list)
+            for r in rows:
+                by_month[str(r[TX_COLS.index("ts")])[:7]].append(r)
+            for month, month_rows in by_month.items():
+                dst = _open_archive(month)
+                try:
+                    with dst:
+                        dst.executemany(
+                            f"INSERT OR IGNORE INTO transactions ({_COLS_SQL}) VALUES ({', '.join('?' for _ in TX_COLS)})",
+                            month_rows,
+                        )
+                finally:
+                    dst.close()
+            # Først når arkivet er committet fjernes radene fra den varme tabellen – og
+            # lagerbokas åpningsbalanse tar over tallene deres i samme transaksjon
+            src.execute("BEGIN IMMEDIATE")
+            try:
+                ledger.fold(src.execute, ((r[_I_ITEM], r[_I_CO], r[_I_KIND], r[_I_QTY], r[_I_DELTA]) for r in rows))
+                src.executemany("DELETE FROM transactions WHERE id = ?", ((r[0],) for r in rows))
+                src.execute("COMMIT")
+            except Exception:
+                src.execute("ROLLBACK")
+                raise
+            moved += len(rows)
+            progress(f"  arkivert {moved} transaksjoner (til og med {rows[-1][TX_COLS.index('ts')]})")
+    finally:
+        src.close()
+    return moved
+
+
+def status() -> dict:
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        hot, oldest = conn.execute("SELECT COUNT(*), MIN(ts) FROM transactions").fetchone()
+    finally:
+        conn.close()
+    months = []
+    for month, path in archive_files():
+        c = sqlite3.connect(_ro_uri(path), uri=True)
+        try:
+            months.append((month, c.execute("SELECT COUNT(*) FROM transactions").fetchone()[0], os.path.getsize(path)))
+        finally:
+            c.close()
+    return {"hot": hot, "hot_oldest": oldest, "archive_dir": ARCHIVE_DIR, "months": months}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Arkiver gamle transaksjoner til månedsfiler.")
+    ap.add_argument("cmd", choices=("status", "run"))
+    ap.add_argument("--days", type=int, default=HOT_DAYS, help="behold så mange dager i hoveddatabasen")
+    ap.add_argument("--batch", type=int, default=BATCH)
+    args = ap.parse_args()
+
+    if args.cmd == "run":
+        t = time.perf_counter()
+        n = archive_old_transactions(args.days, args.batch)
+        print(f"✅ {n} transaksjoner arkivert på {time.perf_counter() - t:.1f} s")
+    st = status()
+    print(f"Varm: {st['hot']} transaksjoner (eldste {st['hot_oldest']})\nArkiv: {st['archive_dir']}")
+    for i, (month, n, size) in enumerate(st["months"]):
+        flag = "" if i < MAX_ATTACHED else "  (ikke i tx_all – leses direkte)"
+        print(f"  {month}: {n:>8} rader, {size / 1024:>8.0f} KiB{flag}")
@@ -0,0 +1,208 @@
+# app/assets.py
+"""Statiske filer: lokale kopier, fingerprint og ferdigkomprimerte varianter.
+
+`build()` går gjennom js/, css/ og vendor/ under app/static, minifiserer CSS og
+skriver `dist/<navn>.<hash>.<ext>` pluss `.gz` (og `.br` når brotli er
+installert) og `dist/manifest.json`. Malene lenker med `asset_url()`, og
+AssetFiles serverer /static/dist/ med `Cache-Control: immutable` og den
+varianten klienten støtter – innholdet endrer aldri navn uten å endre hash.
+Bygget kjøres ved oppstart og skriver bare filer som mangler.
+
+Tredjepartsfilene (htmx, ZXing) og Tailwind-CSS-en ligger lokalt når de er
+hentet/bygget; til da lenker malene til CDN som før:
+
+    python -m app.assets vendor     # htmx og ZXing (låste versjoner) til static/vendor/
+    python -m app.assets tailwind   # static/css/tailwind.css fra malene (npx tailwindcss)
+    python -m app.assets build
+"""
+import argparse
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import subprocess
+import urllib.request
+from typing import Dict, Optional
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+
+from . import compress
+
+STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
+DIST = "dist"
+SOURCES = ("js", "css", "vendor")
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# Lokal fil -> låst kilde (vendor) og CDN-adressen malene brukte før filen fantes lokalt
+VENDOR = {
+    "vendor/htmx.min.js": "https://unpkg.com/htmx.org@1.9.12/dist/htmx.min.js",
+    "vendor/zxing.min.js": "https://unpkg.com/@zxing/library@0.21.3/umd/index.min.js",
+}
+CDN = {**VENDOR, "css/tailwind.css": "https://cdn.tailwindcss.com"}
+TAILWIND = "tailwindcss@3.4.17"
+
+_manifest: Optional[Dict[str, str]] = None
+
+
+# ------------------------------------------------------------
+# Bygging
+# ------------------------------------------------------------
+def _minify_css(src: str) -> str:
+    src = re.sub(r"/\*.*?\*/", "", src, flags=re.S)
+    src = re.sub(r"\s+", " ", src)
+    src = re.sub(r"\s*([{};,>])\s*", r"\1", src)
+    # ':' bare i deklarasjoner (verdien slutter på ; eller } før neste {) – i en selektor
+    # er ".a :hover" (etterkommer) noe annet enn ".a:hover"
+    src = re.sub(r"([{;])([-\w]+)\s*:\s*(?=[^{};]*[;}])", r"\1\2:", src)
+    return src.replace(";}", "}").strip()
+
+
+def _write(path: str, data: bytes) -> None:
+    # Via midlertidig fil: flere workers kan bygge samtidig, og ingen skal se en halv fil
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def build(progress=None) -> Dict[str, str]:
+    """Bygger dist/ og returnerer manifestet (logisk sti -> sti under /static)."""
+    global _manifest
+    out_dir = os.path.join(STATIC_DIR, DIST)
+    os.makedirs(out_dir, exist_ok=True)
+    manifest: Dict[str, str] = {}
+    for top in SOURCES:
+        for root, _, files in os.walk(os.path.join(STATIC_DIR, top)):
+            for fn in sorted(files):
+                src = os.path.join(root, fn)
+                logical = os.path.relpath(src, STATIC_DIR).replace(os.sep, "/")
+                with open(src, "rb") as f:
+                    data = f.read()
+                if fn.endswith(".css") and not fn.endswith(".min.css"):
+                    data = _minify_css(data.decode("utf-8")).encode("utf-8")
+                stem, ext = os.path.splitext(logical.replace("/", "."))
+                name = f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+                manifest[logical] = f"{DIST}/{name}"
+                target = os.path.join(out_dir, name)
+                if os.path.exists(target):
+                    continue
+                variants = {"gzip": ".gz"} if compress.brotli is None else {"br": ".br", "gzip": ".gz"}
+                for enc, suffix in variants.items():
+                    packed = compress.compress(data, enc, best=True)
+                    if len(packed) < len(data):
+                        _write(target + suffix, packed)
+                _write(target, data)
+                if progress:
+                    progress(f"  {logical} -> {name} ({len(data)} B)")
+    # Rydd bort bygg som ikke lenger er i bruk
+    keep = {os.path.basename(p) for p in manifest.values()}
+    for fn in os.listdir(out_dir):
+        base = fn[:-3] if fn.endswith((".gz", ".br")) else fn
+        if fn != "manifest.json" and not fn.endswith(".tmp") and base not in keep:
+            os.remove(os.path.join(out_dir, fn))
+    _write(os.path.join(out_dir, "manifest.json"), json.dumps(manifest, indent=1, sort_keys=True).encode())
+    _manifest = manifest
+    return manifest
+
+
+def manifest() -> Dict[str, str]:
+    global _manifest
+    if _manifest is None:
+        try:
+            with open(os.path.join(STATIC_DIR, DIST, "manifest.json"), encoding="utf-8") as f:
+                _manifest = json.load(f)
+        except (OSError, ValueError):
+            _manifest = {}
+    return _manifest
+
+
+# ------------------------------------------------------------
+# Maler
+# ------------------------------------------------------------
+def has_asset(path: str) -> bool:
+    return path in manifest() or os.path.exists(os.path.join(STATIC_DIR, path))
+
+
+def asset_url(path: str) -> str:
+    """Fingerprintet URL for en fil under app/static (CDN-adressen hvis den ikke er hentet ennå)."""
+    built = manifest().get(path)
+    if built:
+        return f"/static/{built}"
+    if path in CDN and not os.path.exists(os.path.join(STATIC_DIR, path)):
+        return CDN[path]
+    return f"/static/{path}"
+
+
+def install(*envs) -> None:
+    for env in envs:
+        env.globals.update(asset_url=asset_url, has_asset=has_asset)
+
+
+# ------------------------------------------------------------
+# Servering
+# ------------------------------------------------------------
+class AssetFiles(StaticFiles):
+    """StaticFiles som gir /static/dist/ lang cache og ferdigkomprimerte varianter."""
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if not path.startswith(DIST + "/") or path.endswith("manifest.json"):
+            return await super().get_response(path, scope)
+        accept = Headers(scope=scope).get("accept-encoding", "")
+        response = None
+        for enc, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if not compress.accepts(accept, enc):
+                continue
+            full, stat = self.lookup_path(path + suffix)
+            if stat is not None:
+                response = FileResponse(full, stat_result=stat, media_type=mimetypes.guess_type(path)[0],
+                                        headers={"Content-Encoding": enc})
+                break
+        if response is None:
+            response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            response.headers["Cache-Control"] = IMMUTABLE
+            response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+
+# ------------------------------------------------------------
+# CLI
+# ------------------------------------------------------------
+def vendor() -> None:
+    for path, url in VENDOR.items():
+        dst = os.path.join(STATIC_DIR, path)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        with urllib.request.urlopen(url, timeout=60) as r:
+            data = r.read()
+        _write(dst, data)
+        print(f"  {path}: {len(data)} B fra {url}")
+
+
+def tailwind() -> None:
+    # Samme klasser som Play-CDN-en genererer i nettleseren, men bare de malene faktisk bruker
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = os.path.join(STATIC_DIR, "css", "tailwind.css")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    subprocess.run(["npx", "--yes", TAILWIND, "--content", "app/templates/**/*.html,app/static/js/**/*.js",
+                    "-o", out, "--minify"], cwd=root, check=True)
+    print(f"  css/tailwind.css: {os.path.getsize(out)} B")
+
+
+def _main() -> None:
+    ap = argparse.ArgumentParser(prog="python -m app.assets", description="Statiske filer: hent, bygg og fingerprint")
+    ap.add_argument("cmd", choices=("vendor", "tailwind", "build"))
+    args = ap.parse_args()
+    if args.cmd == "vendor":
+        vendor()
+    elif args.cmd == "tailwind":
+        tailwind()
+    m = build(progress=print)
+    print(f"✅ {len(m)} fil(er) i static/{DIST}/")
+
+
+if __name__ == "__main__":
+    _main()
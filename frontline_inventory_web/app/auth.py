@@ -1,5 +1,6 @@
 # app/auth.py
 import os
+from functools import lru_cache
 from datetime import datetime
 from typing import Optional
 from fastapi import APIRouter, Request, Form, Depends, HTTPException
@@ -7,13 +8,16 @@ from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy import select, func
 from sqlalchemy.orm import Session
-from passlib.context import CryptContext
 
-from .db import SessionLocal
+from .db import DB_PATH, SessionLocal
 from .models import User
 from .db import Base, engine
 
-pwd = CryptContext(schemes=["bcrypt"], deprecated="auto")
+@lru_cache(maxsize=1)
+def _pwd():
+    # passlib/bcrypt lastes først ved første innlogging – ikke ved oppstart
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 router = APIRouter()
 templates = Jinja2Templates(directory=os.path.join(os.path.dirname(__file__), "templates"))
@@ -26,23 +30,56 @@ def get_db():
     finally:
         db.close()
 
+# ---------- Session-nøkkel ----------
+def session_secret() -> str:
+    """SECRET_KEY fra miljøet, ellers en tilfeldig nøkkel lagret ved siden av databasen.
+
+    Alle worker-prosesser må signere session-cookies med samme nøkkel; filen
+    lages atomisk (O_EXCL) av den første som starter, de andre leser den.
+    """
+    key = os.environ.get("SECRET_KEY")
+    if key:
+        return key
+    path = os.environ.get("INV_SECRET_FILE") or DB_PATH + ".secret"
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        for _ in range(100):  # en annen prosess kan være midt i skrivingen
+            with open(path, encoding="utf-8") as f:
+                key = f.read().strip()
+            if key:
+                return key
+            import time
+            time.sleep(0.05)
+        raise RuntimeError(f"Tom nøkkelfil: {path}")
+    import secrets
+    key = secrets.token_urlsafe(48)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(key)
+    return key
+
 # ---------- Helpers ----------
 def hash_password(pw: str) -> str:
-    return pwd.hash(pw)
+    return _pwd().hash(pw)
 
 def verify_password(pw: str, pw_hash: str) -> bool:
     try:
-        return pwd.verify(pw, pw_hash)
+        return _pwd().verify(pw, pw_hash)
     except Exception:
         return False
 
 # Guards
-async def require_user(request: Request, db: Session = Depends(get_db)) -> User:
+# Vanlig def: FastAPI kjører den i trådpoolen. Som async gjorde db.get() utsjekken fra poolen på
+# event-løkken, og med tom pool sto hele workeren stille til en forbindelse ble ledig
+def require_user(request: Request, db: Session = Depends(get_db)) -> User:
     uid = request.session.get("uid")
     if not uid:
         # hard redirect
         raise HTTPException(status_code=303, headers={"Location": "/auth/login"})
     user = db.get(User, uid)
+    # Forbindelsen tilbake til poolen straks (brukeren er lastet og kan leses frakoblet): ellers
+    # holder hver request én her mens ruten venter på sin egen, og fulle pooler låser hverandre
+    db.close()
     if not user:
         request.session.clear()
         raise HTTPException(status_code=303, headers={"Location": "/auth/login"})
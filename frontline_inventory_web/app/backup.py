@@ -0,0 +1,601 @@
+# app/backup.py
+"""Sikkerhetskopi mens appen kjører, og gjenoppretting til et tidspunkt.
+
+Full kopi: SQLites backup-API i steg på STEP_PAGES sider med en liten pause
+imellom. Alle stegene leser fra én lesetransaksjon – i WAL venter ikke
+skrivere på lesere, og kopien starter ikke på nytt når appen skriver. Kopien
+gzip-es til BACKUP_DIR/inventory-<tid>.db.gz med en .json ved siden av
+(sha256, størrelse, WAL-posisjon). De KEEP nyeste beholdes.
+
+WAL-arkiv (INV_BACKUP_WAL=1): en tråd holder en lesetransaksjon åpen, så
+WAL-filen bare vokser, og kopierer nye, committede frames til
+BACKUP_DIR/wal/<generasjon>/ hvert WAL_S sekund. Når WAL-en er større enn
+INV_BACKUP_WAL_MB, checkpointes den; skrivelåsen holdes bare mens de siste
+framene kopieres. Hver gang arkiveringen starter, begynner en ny generasjon
+med en full kopi. Gjenoppretting = kopi + frames fram til ønsket tidspunkt
+(oppløsning WAL_S).
+
+Bare én prosess (den som får BACKUP_DIR/.leader.lock) tar kopier og arkiverer.
+
+    python -m app.backup take
+    python -m app.backup list
+    python -m app.backup verify [navn]
+    python -m app.backup restore [navn] --to ny.db [--at "2026-10-19 14:30"]
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import struct
+import threading
+import time
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+from .db import DB_PATH
+
+BACKUP_DIR = os.environ.get("INV_BACKUP_DIR") or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "backups")
+WAL_DIR = os.path.join(BACKUP_DIR, "wal")
+WORK_PATH = os.path.join(BACKUP_DIR, ".work.db")
+INTERVAL_H = float(os.environ.get("INV_BACKUP_HOURS", "24"))
+KEEP = int(os.environ.get("INV_BACKUP_KEEP", "7"))
+WAL_ARCHIVE = os.environ.get("INV_BACKUP_WAL", "0") == "1"
+WAL_S = float(os.environ.get("INV_BACKUP_WAL_S", "10"))
+WAL_ROTATE_BYTES = int(float(os.environ.get("INV_BACKUP_WAL_MB", "16")) * 1024 * 1024)
+STEP_PAGES = 1024
+STEP_PAUSE_S = 0.002
+GZIP_LEVEL = 3
+DISCARD_CHUNK = 4 * 1024 * 1024
+DISCARD_PAUSE_S = 0.05
+
+_NAME_RE = re.compile(r"^inventory-(\d{8}-\d{6}-\d{3})\.db\.gz$")
+_SEG_RE = re.compile(r"^(\d{8})-(\d{8}-\d{6}-\d{3})\.wal\.gz$")
+
+Progress = Callable[[int, int], None]
+
+
+def _stamp(dt: datetime) -> str:
+    return dt.strftime("%Y%m%d-%H%M%S-%f")[:-3]
+
+
+def _parse_stamp(s: str) -> datetime:
+    return datetime.strptime(s + "000", "%Y%m%d-%H%M%S-%f")
+
+
+def _gzip_file(src: str, dest: str, reuse: Optional[str] = None) -> str:
+    """Komprimerer `src` til `dest` og returnerer sha256 av det ukomprimerte innholdet.
+
+    Med `reuse` skrives det over en gammel fil i stedet for å lage en ny og
+    slette den gamle (se _discard).
+    """
+    h = hashlib.sha256()
+    tmp = dest + ".tmp"
+    if reuse and os.path.exists(reuse):
+        os.replace(reuse, tmp)
+    with open(tmp, "r+b" if os.path.exists(tmp) else "wb") as raw:
+        with gzip.GzipFile(filename=os.path.basename(dest)[:-3], mode="wb", compresslevel=GZIP_LEVEL, fileobj=raw) as out, \
+                open(src, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+                out.write(chunk)
+        raw.truncate()
+    os.replace(tmp, dest)
+    return h.hexdigest()
+
+
+def _gunzip_file(src: str, dest: str) -> str:
+    h = hashlib.sha256()
+    with gzip.open(src, "rb") as f, open(dest, "wb") as out:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+            out.write(chunk)
+    return h.hexdigest()
+
+
+def _discard(path: str) -> None:
+    """Sletter en stor fil i biter. Å frigjøre mange blokker på én gang kan holde
+    filsystemjournalen – og dermed appens commits – i flere sekunder."""
+    try:
+        size = os.path.getsize(path)
+        with open(path, "r+b") as f:
+            while size > 0:
+                size = max(0, size - DISCARD_CHUNK)
+                f.truncate(size)
+                time.sleep(DISCARD_PAUSE_S)
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _try_lock(path: str) -> Optional[int]:
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if os.name == "nt":
+            import msvcrt
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return fd
+    except OSError:
+        os.close(fd)
+        return None
+
+
+# ------------------------------------------------------------
+# Full kopi
+# ------------------------------------------------------------
+def copy_db(dest: str, progress: Optional[Progress] = None) -> Tuple[int, int]:
+    """Konsistent kopi av databasen til `dest` (ukomprimert). Returnerer (page_size, sider)."""
+    src = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    dst = sqlite3.connect(dest)
+    try:
+        # Arbeidskopien komprimeres etterpå: ingen journal og ingen fsync som konkurrerer med appens commits
+        dst.execute("PRAGMA journal_mode=OFF")
+        dst.execute("PRAGMA synchronous=OFF")
+        # Lesetransaksjonen holdes over alle stegene: ett øyeblikksbilde, ingen omstart
+        src.execute("BEGIN")
+        src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+
+        def step(status, remaining, total):
+            if progress:
+                progress(total - remaining, total)
+            time.sleep(STEP_PAUSE_S)  # slipper til skrivere/GIL mellom stegene
+
+        src.backup(dst, pages=STEP_PAGES, progress=step)
+        src.execute("COMMIT")
+        # WAL-en har vokst mens vi leste; checkpoint den her i stedet for i neste requests commit
+        src.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+        dst.execute("PRAGMA journal_mode=DELETE")  # kopien skal stå alene, uten -wal/-shm
+        page_size, pages = dst.execute("PRAGMA page_size").fetchone()[0], dst.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        dst.close()
+        src.close()
+    return page_size, pages
+
+
+def backups() -> List[dict]:
+    """Metadata for kopiene, nyeste først."""
+    try:
+        names = sorted((n for n in os.listdir(BACKUP_DIR) if _NAME_RE.match(n)), reverse=True)
+    except FileNotFoundError:
+        return []
+    out = []
+    for n in names:
+        try:
+            with open(os.path.join(BACKUP_DIR, n + ".json"), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {"file": n, "taken_at": _parse_stamp(_NAME_RE.match(n).group(1)).isoformat()}
+        meta["path"] = os.path.join(BACKUP_DIR, n)
+        out.append(meta)
+    return out
+
+
+def find(name: str) -> dict:
+    for meta in backups():
+        if name in (meta["file"], os.path.basename(meta["path"]), meta["file"][len("inventory-"):-len(".db.gz")]):
+            return meta
+    raise FileNotFoundError(f"fant ingen kopi {name!r} i {BACKUP_DIR}")
+
+
+def take(progress: Optional[Progress] = None) -> dict:
+    """Tar en full, komprimert kopi nå."""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    t0 = time.perf_counter()
+    now = datetime.utcnow()
+    name = f"inventory-{_stamp(now)}.db.gz"
+    # Arbeidskopien og den eldste kopien som roteres ut skrives over i stedet for å slettes (se _discard)
+    lock = _try_lock(WORK_PATH + ".lock")
+    if lock is None:
+        raise RuntimeError("en annen kopi pågår")
+    try:
+        metas = backups()
+        reuse = metas[KEEP - 1]["path"] if 0 < KEEP <= len(metas) else None
+        if reuse and os.path.exists(reuse + ".json"):
+            os.remove(reuse + ".json")
+        generation, wal_seq = archiver.mark()
+        page_size, pages = copy_db(WORK_PATH, progress)
+        size = os.path.getsize(WORK_PATH)
+        sha = _gzip_file(WORK_PATH, os.path.join(BACKUP_DIR, name), reuse=reuse)
+    finally:
+        os.close(lock)
+    meta = {
+        "file": name, "taken_at": now.isoformat(), "db_size": size, "page_size": page_size, "pages": pages,
+        "gz_size": os.path.getsize(os.path.join(BACKUP_DIR, name)), "sha256": sha,
+        "generation": generation, "wal_seq": wal_seq, "seconds": round(time.perf_counter() - t0, 2),
+    }
+    with open(os.path.join(BACKUP_DIR, name + ".json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=1)
+    rotate()
+    meta["path"] = os.path.join(BACKUP_DIR, name)
+    return meta
+
+
+def rotate(keep: int = KEEP) -> int:
+    """Sletter kopier utover de `keep` nyeste, og WAL-segmenter ingen gjenværende kopi trenger."""
+    removed = 0
+    metas = backups()
+    for meta in metas[keep:]:
+        if os.path.exists(meta["path"] + ".json"):
+            os.remove(meta["path"] + ".json")
+        _discard(meta["path"])
+        removed += 1
+    kept = metas[:keep]
+    gens = generations()
+    for gen in gens:
+        starts = [m["wal_seq"] for m in kept if m.get("generation") == gen and m.get("wal_seq") is not None]
+        if not starts and gen not in (archiver.generation, gens[-1]):  # den nyeste kan være i bruk i en annen prosess
+            shutil.rmtree(os.path.join(WAL_DIR, gen), ignore_errors=True)
+            continue
+        first = min(starts) if starts else 0
+        for seq, _, path in segments(gen):
+            if seq < first:
+                os.remove(path)
+    return removed
+
+
+# ------------------------------------------------------------
+# WAL-arkiv
+# ------------------------------------------------------------
+def generations() -> List[str]:
+    try:
+        return sorted(n for n in os.listdir(WAL_DIR) if os.path.isdir(os.path.join(WAL_DIR, n)))
+    except FileNotFoundError:
+        return []
+
+
+def segments(generation: str) -> List[Tuple[int, datetime, str]]:
+    """[(løpenr, tatt, sti)] i rekkefølge."""
+    d = os.path.join(WAL_DIR, generation)
+    try:
+        names = os.listdir(d)
+    except FileNotFoundError:
+        return []
+    out = [(int(m.group(1)), _parse_stamp(m.group(2)), os.path.join(d, n)) for n in names if (m := _SEG_RE.match(n))]
+    return sorted(out)
+
+
+def _frame_size(wal_header: bytes) -> int:
+    return 24 + struct.unpack(">I", wal_header[8:12])[0]
+
+
+class WalArchiver:
+    """Kopierer committede WAL-frames til segmentfiler (se modul-docstring).
+
+    `_hold` har en lesetransaksjon åpen hele tiden. Da kan ikke WAL-en starte
+    på nytt fra begynnelsen (og overskrive frames vi ikke har kopiert) før vi
+    slipper den i `_rotate()`, etter at alt er kopiert. Antall committede
+    frames leses fra `PRAGMA wal_checkpoint(PASSIVE)`, så vi aldri kopierer en
+    halvskrevet transaksjon.
+    """
+
+    def __init__(self):
+        self.generation: Optional[str] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._hold: Optional[sqlite3.Connection] = None
+        self._ckpt: Optional[sqlite3.Connection] = None
+        self._salt: Optional[bytes] = None
+        self._frames = 0  # frames i gjeldende WAL som er kopiert
+        self._frame_size = 0
+        self._seq = 0
+
+    def start(self) -> None:
+        if self._thread:
+            return
+        self._hold = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None, check_same_thread=False)
+        self._ckpt = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None, check_same_thread=False)
+        with self._lock:
+            self._pin()
+            # Alt som ligger i WAL-en nå kommer med i generasjonens første kopi
+            self._salt, self._frames = self._header()[16:24], self._committed()
+            self.generation, self._seq = _stamp(datetime.utcnow()), 0
+            os.makedirs(os.path.join(WAL_DIR, self.generation), exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="wal-archive", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(10)
+        self._thread = None
+        with self._lock:
+            if self._hold is not None:
+                try:
+                    self._sync()
+                except (sqlite3.Error, OSError) as e:
+                    print(f"[backup] siste WAL-kopi feilet: {e!r}")
+                self._hold.close()
+                self._ckpt.close()
+                self._hold = self._ckpt = None
+
+    def mark(self) -> Tuple[Optional[str], Optional[int]]:
+        """Kopierer det som ligger i WAL-en og gir (generasjon, neste løpenr) for en ny full kopi."""
+        with self._lock:
+            if self._hold is None:
+                return None, None
+            self._sync()
+            return self.generation, self._seq
+
+    def sync(self) -> int:
+        with self._lock:
+            return self._sync() if self._hold is not None else 0
+
+    # -- internt (kalles med _lock) --
+    def _pin(self) -> None:
+        self._hold.execute("BEGIN")
+        self._hold.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+
+    def _header(self) -> bytes:
+        try:
+            with open(DB_PATH + "-wal", "rb") as f:
+                return f.read(32)
+        except FileNotFoundError:
+            return b""
+
+    def _committed(self) -> int:
+        return max(0, self._ckpt.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()[1])
+
+    def _sync(self) -> int:
+        try:
+            f = open(DB_PATH + "-wal", "rb")
+        except FileNotFoundError:
+            return 0
+        with f:
+            header = f.read(32)
+            if len(header) < 32:
+                return 0
+            committed = self._committed()
+            if header[16:24] != self._salt:  # WAL-en startet på nytt; alt fra forrige runde er kopiert
+                self._salt, self._frames = header[16:24], 0
+            if committed <= self._frames:
+                return 0
+            size = self._frame_size = _frame_size(header)
+            f.seek(32 + self._frames * size)
+            data = f.read((committed - self._frames) * size)
+        # Bare frames med samme salt som headeren, og bare til siste commit-frame
+        n = 0
+        for i in range(len(data) // size):
+            frame = data[i * size:i * size + 24]
+            if frame[8:16] != self._salt:
+                break
+            if frame[4:8] != b"\0\0\0\0":
+                n = i + 1
+        if not n:
+            return 0
+        name = f"{self._seq:08d}-{_stamp(datetime.utcnow())}.wal.gz"
+        path = os.path.join(WAL_DIR, self.generation, name)
+        with gzip.open(path + ".tmp", "wb", compresslevel=GZIP_LEVEL) as out:
+            out.write(header)
+            out.write(data[:n * size])
+        os.replace(path + ".tmp", path)
+        self._seq += 1
+        self._frames += n
+        return n
+
+    def _rotate(self) -> None:
+        """Lar WAL-en checkpointes og starte på nytt uten å miste frames."""
+        self._sync()
+        # Ny lesetransaksjon på dagens slutt, så checkpointen kan skrive alt vi har kopiert
+        self._hold.execute("COMMIT")
+        self._pin()
+        self._ckpt.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+        # Kort skrivelås: kopier de siste framene, checkpoint resten og lås på nytt i en tom WAL
+        w = sqlite3.connect(DB_PATH, timeout=5, isolation_level=None)
+        try:
+            w.execute("BEGIN IMMEDIATE")
+            try:
+                self._sync()
+                self._hold.execute("COMMIT")
+                self._ckpt.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+                self._pin()
+            finally:
+                w.execute("ROLLBACK")
+        finally:
+            w.close()
+
+    def _loop(self) -> None:
+        try:
+            take()  # generasjonen starter med en full kopi
+        except Exception as e:
+            print(f"[backup] første kopi i generasjon {self.generation} feilet: {e!r}")
+        while not self._stop.wait(WAL_S):
+            try:
+                with self._lock:
+                    self._sync()
+                    if self._frames * self._frame_size > WAL_ROTATE_BYTES:
+                        self._rotate()
+            except (sqlite3.Error, OSError) as e:
+                print(f"[backup] WAL-arkiv: {e!r}")
+
+
+archiver = WalArchiver()
+_leader_fd: Optional[int] = None
+
+
+def start() -> bool:
+    """Gjør denne prosessen til den som tar kopier (hvis ingen andre er det) og starter WAL-arkivet."""
+    global _leader_fd
+    if INTERVAL_H <= 0 and not WAL_ARCHIVE:
+        return False
+    if _leader_fd is None:
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        _leader_fd = _try_lock(os.path.join(BACKUP_DIR, ".leader.lock"))
+        if _leader_fd is not None and WAL_ARCHIVE:
+            archiver.start()
+    return _leader_fd is not None
+
+
+def stop() -> None:
+    archiver.stop()
+
+
+def run_due() -> Optional[dict]:
+    """Tar en kopi hvis den nyeste er eldre enn INTERVAL_H. Trygt å kalle ofte."""
+    if not start() or INTERVAL_H <= 0:
+        return None
+    latest = backups()[:1]
+    if latest and (datetime.utcnow() - datetime.fromisoformat(latest[0]["taken_at"])).total_seconds() < INTERVAL_H * 3600 * 0.95:
+        return None
+    meta = take()
+    print(f"[backup] {meta['file']} ({meta['gz_size'] / 1024 / 1024:.1f} MiB, {meta['seconds']} s)")
+    return meta
+
+
+# ------------------------------------------------------------
+# Kontroll og gjenoppretting
+# ------------------------------------------------------------
+def _integrity(path: str) -> str:
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _read_segment(path: str) -> Tuple[bytes, bytes, int]:
+    with gzip.open(path, "rb") as f:
+        data = f.read()
+    if len(data) < 32 or struct.unpack(">I", data[:4])[0] not in (0x377F0682, 0x377F0683):
+        raise ValueError(f"{os.path.basename(path)}: ikke en WAL-header")
+    size = _frame_size(data[:32])
+    if (len(data) - 32) % size:
+        raise ValueError(f"{os.path.basename(path)}: avkuttet frame")
+    return data[:32], data[32:], size
+
+
+def _apply_segment(db_path: str, path: str, page_size: int) -> int:
+    """Skriver sidene fra hver komplette transaksjon i segmentet inn i databasefilen."""
+    header, frames, size = _read_segment(path)
+    if size - 24 != page_size:
+        raise ValueError(f"{os.path.basename(path)}: sidestørrelse {size - 24} ≠ {page_size}")
+    commits, pending = 0, {}
+    with open(db_path, "r+b") as db:
+        for off in range(0, len(frames), size):
+            pgno, db_pages = struct.unpack(">II", frames[off:off + 8])
+            pending[pgno] = off + 24
+            if db_pages:
+                for pgno, p in sorted(pending.items()):
+                    db.seek((pgno - 1) * page_size)
+                    db.write(frames[p:p + page_size])
+                db.truncate(db_pages * page_size)
+                pending.clear()
+                commits += 1
+    return commits
+
+
+def verify(name: Optional[str] = None) -> List[Tuple[str, bool, str]]:
+    """Pakker ut hver kopi (eller bare `name`), sjekker sha256 og integrity_check, og leser WAL-segmentene."""
+    out = []
+    for meta in ([find(name)] if name else backups()):
+        tmp = os.path.join(BACKUP_DIR, f".verify-{os.getpid()}.db")
+        try:
+            sha = _gunzip_file(meta["path"], tmp)
+            if meta.get("sha256") and sha != meta["sha256"]:
+                out.append((meta["file"], False, "sha256 stemmer ikke"))
+                continue
+            res = _integrity(tmp)
+            out.append((meta["file"], res == "ok", "ok" if res == "ok" else f"integrity_check: {res}"))
+        except (OSError, EOFError, sqlite3.Error) as e:
+            out.append((meta["file"], False, repr(e)))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    for gen in generations():
+        expected, errors, segs = None, [], segments(gen)
+        for seq, _, path in segs:
+            if expected is not None and seq != expected:
+                errors.append(f"mangler segment {expected:08d}–{seq - 1:08d}")
+            expected = seq + 1
+            try:
+                _read_segment(path)
+            except (OSError, EOFError, ValueError) as e:
+                errors.append(str(e))
+        out.append((f"wal/{gen}", not errors, "; ".join(errors) or f"{len(segs)} segmenter ok"))
+    return out
+
+
+def restore(to: str, name: Optional[str] = None, at: Optional[datetime] = None, progress=print) -> dict:
+    """Gjenoppretter til filen `to`: kopi (`name`, ellers nyeste før `at`) + WAL-segmenter fram til `at`."""
+    if os.path.exists(to):
+        raise FileExistsError(f"{to} finnes allerede")
+    if name:
+        meta = find(name)
+    else:
+        candidates = [m for m in backups() if at is None or datetime.fromisoformat(m["taken_at"]) <= at]
+        if not candidates:
+            raise FileNotFoundError("ingen kopi er eldre enn tidspunktet")
+        meta = candidates[0]
+    if at is not None and at < datetime.fromisoformat(meta["taken_at"]):
+        raise ValueError(f"{meta['file']} er tatt etter {at:%Y-%m-%d %H:%M:%S}")
+    tmp = to + ".tmp"
+    try:
+        sha = _gunzip_file(meta["path"], tmp)
+        if meta.get("sha256") and sha != meta["sha256"]:
+            raise ValueError(f"{meta['file']}: sha256 stemmer ikke")
+        progress(f"  kopi {meta['file']} (tatt {meta['taken_at']})")
+        commits, last = 0, None
+        if meta.get("generation") and meta.get("wal_seq") is not None:
+            page_size = meta.get("page_size") or 4096
+            for seq, taken, path in segments(meta["generation"]):
+                if seq < meta["wal_seq"]:
+                    continue
+                if at is not None and taken > at:
+                    break
+                commits += _apply_segment(tmp, path, page_size)
+                last = taken
+            progress(f"  {commits} transaksjoner fra WAL-arkivet (til {last.isoformat() if last else '–'})")
+        elif at is not None:
+            progress("  kopien har ikke WAL-arkiv – gjenoppretter til tidspunktet kopien ble tatt")
+        res = _integrity(tmp)
+        if res != "ok":
+            raise ValueError(f"integrity_check: {res}")
+        os.replace(tmp, to)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return {"file": meta["file"], "to": to, "commits": commits, "until": (last or datetime.fromisoformat(meta["taken_at"])).isoformat()}
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    ap = argparse.ArgumentParser(description="Sikkerhetskopi og gjenoppretting av inventory-databasen.")
+    ap.add_argument("cmd", choices=("take", "list", "verify", "restore"))
+    ap.add_argument("name", nargs="?", help="kopi (filnavn eller tidsstempel); default nyeste")
+    ap.add_argument("--to", help="restore: ny databasefil (skrives ikke over)")
+    ap.add_argument("--at", help="restore: tidspunkt (UTC), f.eks. '2026-10-19 14:30'")
+    args = ap.parse_args()
+
+    if args.cmd == "take":
+        t = time.perf_counter()
+        meta = take(progress=lambda done, total: print(f"\r  {done}/{total} sider", end="", flush=True))
+        print(f"\n✅ {meta['path']} ({meta['db_size'] / 1024 / 1024:.1f} → {meta['gz_size'] / 1024 / 1024:.1f} MiB) på {time.perf_counter() - t:.1f} s")
+    elif args.cmd == "list":
+        print(f"Kopier i {BACKUP_DIR}:")
+        for meta in backups():
+            gen = f"  WAL-generasjon {meta['generation']}" if meta.get("generation") else ""
+            print(f"  {meta['file']}  {meta.get('gz_size', 0) / 1024 / 1024:>8.1f} MiB{gen}")
+        for gen in generations():
+            segs = segments(gen)
+            span = f"{segs[0][1]:%Y-%m-%d %H:%M:%S} – {segs[-1][1]:%Y-%m-%d %H:%M:%S}" if segs else "tom"
+            print(f"  wal/{gen}: {len(segs)} segmenter, {span}")
+    elif args.cmd == "verify":
+        results = verify(args.name)
+        for what, ok, msg in results:
+            print(f"  {'✅' if ok else '❌'} {what}: {msg}")
+        sys.exit(0 if all(ok for _, ok, _ in results) else 1)
+    else:
+        if not args.to:
+            ap.error("restore krever --to")
+        at = datetime.fromisoformat(args.at) if args.at else None
+        res = restore(args.to, args.name, at)
+        print(f"✅ {res['to']} (til {res['until']}). Stopp appen og bytt inventory.db med denne filen "
+              f"(fjern inventory.db-wal/-shm); tx_archive/ gjenopprettes separat.")
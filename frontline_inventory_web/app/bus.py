@@ -0,0 +1,114 @@
+# app/bus.py
+"""Prosessbuss: holder cacher og SSE i takt når appen kjører i flere prosesser.
+
+En tråd pr prosess spør SQLite om `PRAGMA data_version` hvert POLL_S
+sekund. Verdien endres bare når en *annen* forbindelse har committet, så i
+ro koster det ingenting. Ved endring leses `change_versions`, og tabeller
+som er endret et annet sted varsles via changes.sync() (sku-indeks, refdata
+og KPI-er lastes da på nytt).
+
+Med flere workers (WEB_CONCURRENCY > 1) skrives også SSE-hendelser til
+`bus_events`, og de andre prosessene leverer dem til sine lyttere.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from . import changes
+from .db import DB_PATH
+from .events import bcast
+
+MULTI = int(os.environ.get("WEB_CONCURRENCY", "1") or 1) > 1
+POLL_S = float(os.environ.get("INV_BUS_POLL_MS", "250")) / 1000
+EVENT_TTL_S = 300
+
+
+class Bus:
+    def __init__(self):
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._data_version = None
+        self._last_event = 0
+        self._last_prune = 0.0
+        self.pid = os.getpid()
+
+    def start(self, relay_events: bool = MULTI) -> None:
+        if self._thread:
+            return
+        self.pid = os.getpid()  # etter fork
+        self._conn = sqlite3.connect(DB_PATH, timeout=5, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            changes.prime(dict(self._conn.execute("SELECT table_name, version FROM change_versions").fetchall()))
+            self._last_event = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM bus_events").fetchone()[0]
+        if relay_events:
+            bcast.relay = self.publish
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="change-bus", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(2)
+        self._thread = None
+        if bcast.relay == self.publish:
+            bcast.relay = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def publish(self, event: dict) -> None:
+        conn = self._conn
+        if conn is None:
+            return
+        try:
+            with self._lock:
+                conn.execute("INSERT INTO bus_events (pid, payload, created_at) VALUES (?, ?, ?)",
+                             (self.pid, json.dumps(event, default=str), datetime.utcnow()))
+        except sqlite3.Error as e:  # en tapt hendelse skal ikke velte requesten
+            print(f"[bus] kunne ikke sende hendelse: {e!r}")
+
+    def poll_once(self) -> list:
+        with self._lock:
+            dv = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if dv == self._data_version:
+                return []
+            self._data_version = dv
+            versions = dict(self._conn.execute("SELECT table_name, version FROM change_versions").fetchall())
+            events = []
+            if bcast.relay is not None:
+                events = self._conn.execute(
+                    "SELECT id, payload FROM bus_events WHERE id > ? AND pid != ? ORDER BY id", (self._last_event, self.pid)
+                ).fetchall()
+                self._last_event = max([self._last_event] + [r[0] for r in events])
+        for _, payload in events:
+            try:
+                bcast.deliver_threadsafe(json.loads(payload))
+            except ValueError:
+                pass
+        return changes.sync(versions)
+
+    def _prune(self) -> None:
+        cutoff = datetime.utcnow() - timedelta(seconds=EVENT_TTL_S)
+        with self._lock:
+            self._conn.execute("DELETE FROM bus_events WHERE created_at < ?", (cutoff,))
+
+    def _loop(self) -> None:
+        while not self._stop.wait(POLL_S):
+            try:
+                self.poll_once()
+                if bcast.relay is not None and time.monotonic() - self._last_prune > 60:
+                    self._last_prune = time.monotonic()
+                    self._prune()
+            except sqlite3.Error as e:
+                print(f"[bus] {e!r}")
+
+
+bus = Bus()
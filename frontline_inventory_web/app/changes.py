@@ -0,0 +1,152 @@
+# app/changes.py
+"""Endringsvarsler for mutasjoner gjort via en Session.
+
+Alle crud-funksjoner (og rutene) skriver via SQLAlchemy-sesjoner. Vi samler
+opp hvilke rader som ble lagt til/endret/slettet i flush, og varsler lyttere
+pr tabell *etter* commit. Bulk-setninger (update()/delete() uten objekter)
+rapporteres som `bulk=True` – lytteren må da laste alt på nytt.
+
+Med flere prosesser: hver transaksjon som endrer en tabell teller også opp
+tabellens rad i `change_versions` (i samme transaksjon). bus.py ser når andre
+prosesser har committet og kaller `sync()`, som varsler lokale lyttere med
+`bulk=True` for tabellene som er endret et annet sted.
+"""
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+
+@dataclass
+class ChangeSet:
+    table: str
+    rows: List[dict] = field(default_factory=list)  # {"op": insert|update|delete, "id": pk, <kolonner som var lastet>}
+    bulk: bool = False
+
+
+_listeners: Dict[str, List[Callable[[ChangeSet], None]]] = defaultdict(list)
+_versions: Dict[str, int] = defaultdict(int)
+_seen: Dict[str, int] = {}  # siste kjente verdi i change_versions pr tabell
+_lock = threading.Lock()
+
+_UNTRACKED = {"change_versions", "bus_events"}
+_BUMP = text(
+    "INSERT INTO change_versions (table_name, version) VALUES (:t, 1) "
+    "ON CONFLICT(table_name) DO UPDATE SET version = version + 1 RETURNING version"
+)
+
+
+def on_change(table: str, fn: Callable[[ChangeSet], None]) -> None:
+    _listeners[table].append(fn)
+
+
+def version(table: str) -> int:
+    return _versions[table]
+
+
+def notify(changes: Dict[str, ChangeSet]) -> None:
+    with _lock:
+        for table in changes:
+            _versions[table] += 1
+    for table, cs in changes.items():
+        for fn in list(_listeners.get(table, ())):
+            try:
+                fn(cs)
+            except Exception as e:  # en lytter skal aldri velte en request som allerede er committet
+                print(f"[changes] lytter for {table} feilet: {e!r}")
+
+
+def prime(versions: Dict[str, int]) -> None:
+    """Utgangspunkt for sync() – det som alt står i change_versions er ikke nytt."""
+    with _lock:
+        _seen.update(versions)
+
+
+def sync(versions: Dict[str, int]) -> List[str]:
+    """Varsler (bulk) for tabeller der change_versions er foran det denne prosessen har sett."""
+    stale = {}
+    with _lock:
+        for table, v in versions.items():
+            if v > _seen.get(table, 0):
+                _seen[table] = v
+                stale[table] = ChangeSet(table, bulk=True)
+    if stale:
+        notify(stale)
+    return list(stale)
+
+
+def _pending(session: Session) -> Dict[str, ChangeSet]:
+    return session.info.setdefault("_changes", {})
+
+
+def _bump(session: Session, table: str) -> None:
+    # Én gang pr tabell pr transaksjon; skrivelåsen holdes til commit, så verdien vi får er vår
+    bumped = session.info.setdefault("_bumped", {})
+    if table in bumped or table in _UNTRACKED:
+        return
+    try:
+        bumped[table] = session.connection().execute(_BUMP, {"t": table}).scalar()
+    except OperationalError:  # change_versions finnes ikke ennå (før migrering 006)
+        bumped[table] = None
+
+
+def _snapshot(obj, op: str) -> tuple[str, dict]:
+    state = inspect(obj)
+    mapper = state.mapper
+    # Bare verdier som allerede er lastet – aldri SQL herfra
+    row = {a.key: state.dict[a.key] for a in mapper.column_attrs if a.key in state.dict}
+    row["op"] = op
+    ident = state.identity
+    row["id"] = ident[0] if ident else row.get("id")
+    return mapper.persist_selectable.name, row
+
+
+@event.listens_for(Session, "after_flush")
+def _collect(session, flush_context):
+    pending = _pending(session)
+    for op, objs in (("insert", session.new), ("update", session.dirty), ("delete", session.deleted)):
+        for obj in objs:
+            if op == "update" and not session.is_modified(obj, include_collections=False):
+                continue
+            table, row = _snapshot(obj, op)
+            pending.setdefault(table, ChangeSet(table)).rows.append(row)
+    for table in pending:
+        _bump(session, table)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_bulk(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    table = getattr(orm_execute_state.statement, "table", None)
+    if table is None:
+        return
+    pending = _pending(orm_execute_state.session)
+    pending.setdefault(table.name, ChangeSet(table.name)).bulk = True
+    _bump(orm_execute_state.session, table.name)
+
+
+@event.listens_for(Session, "after_commit")
+def _fire(session):
+    changes = session.info.pop("_changes", None)
+    bumped = session.info.pop("_bumped", None) or {}
+    with _lock:
+        for table, v in bumped.items():
+            if v is None:
+                continue
+            # Hoppet versjonen over noen? Da skrev en annen prosess imellom – last alt på nytt
+            if v > _seen.get(table, 0) + 1 and changes and table in changes:
+                changes[table].bulk = True
+            _seen[table] = max(_seen.get(table, 0), v)
+    if changes:
+        notify(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session):
+    session.info.pop("_changes", None)
+    session.info.pop("_bumped", None)
@@ -0,0 +1,94 @@
+# app/compress.py
+"""Komprimering av svar (HTML fra malene, JSON, CSV).
+
+Svar med én body på minst MIN_SIZE byte komprimeres med brotli når klienten
+støtter det og `brotli` er installert (valgfri), ellers med gzip. Strømmede
+svar (SSE, eksport i biter) og svar som alt har Content-Encoding (de
+ferdigkomprimerte filene under /static/dist, se assets.py) sendes som de er.
+"""
+import gzip
+import os
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pip install brotli for br; gzip dekker alle nettlesere
+    brotli = None
+
+MIN_SIZE = int(os.environ.get("INV_COMPRESS_MIN", "1024"))
+_TYPES = ("text/", "application/json", "application/javascript", "application/x-ndjson", "image/svg+xml")
+
+
+def accepts(header: str, encoding: str) -> bool:
+    """Står `encoding` i Accept-Encoding (og ikke med q=0)?"""
+    for part in header.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        if name.strip() == encoding:
+            q = params.strip()
+            if q.startswith("q="):
+                try:
+                    return float(q[2:]) > 0
+                except ValueError:
+                    return False
+            return True
+    return False
+
+
+def choose(header: str) -> Optional[str]:
+    if brotli is not None and accepts(header, "br"):
+        return "br"
+    if accepts(header, "gzip"):
+        return "gzip"
+    return None
+
+
+def compress(data: bytes, encoding: str, best: bool = False) -> bytes:
+    # Pr request: raske nivåer. Ferdigkomprimerte filer (best=True) lages én gang og kan ta tid
+    if encoding == "br":
+        return brotli.compress(data, quality=11 if best else 5)
+    return gzip.compress(data, compresslevel=9 if best else 6, mtime=0)
+
+
+class CompressMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = MIN_SIZE) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        encoding = choose(Headers(scope=scope).get("accept-encoding", "")) if scope["type"] == "http" else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        passthrough = False
+
+        async def wrapped(message: Message) -> None:
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if passthrough or start is None:
+                await send(message)
+                return
+            # Første body-melding: nå vet vi om hele svaret er her
+            first, start = start, None
+            headers = MutableHeaders(raw=first["headers"])
+            body = message.get("body", b"")
+            if (message.get("more_body") or "content-encoding" in headers or len(body) < self.minimum_size
+                    or not headers.get("content-type", "").startswith(_TYPES)):
+                passthrough = True
+                await send(first)
+                await send(message)
+                return
+            data = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(data))
+            headers.add_vary_header("Accept-Encoding")
+            await send(first)
+            await send({"type": "http.response.body", "body": data})
+
+        await self.app(scope, receive, wrapped)
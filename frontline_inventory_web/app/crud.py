@@ -1,17 +1,24 @@
 # app/crud.py
-from sqlalchemy import select, func, update
+# Funksjonene her flusher, men committer ikke: kalleren eier transaksjonen. For
+# ruter er det get_db() i main.py (én commit pr request, rollback ved feil), for
+# bakgrunnsjobber handleren/jobs.py.
+from sqlalchemy import select, func, update, insert
 from sqlalchemy.orm import Session
 from datetime import datetime
 from typing import Optional, Tuple, List, Iterable, Dict
 from collections import defaultdict
+import json
 from fastapi import HTTPException
 from sqlalchemy import select, func, update
 
-from .models import Item, Category, Location, Tx, User, ItemUnit, PurchaseOrder, PurchaseOrderLine, CustomerOrder, CustomerOrderLine, Customer
+from .sku_index import index as sku_index
+from . import refdata
+from . import ledger, lots, unitcodes
+from .models import Item, Category, Location, Tx, User, ItemUnit, PurchaseOrder, PurchaseOrderLine, CustomerOrder, CustomerOrderLine, Customer, AppliedOp
 
 def create_customer(db: Session, name: str, email: str = "", phone: str = "", notes: str = "") -> Customer:
     c = Customer(name=name.strip(), email=email.strip(), phone=phone.strip(), notes=notes.strip())
-    db.add(c); db.commit(); db.refresh(c)
+    db.add(c); db.flush()
     return c
 
 def create_customer_order(db: Session, customer: Customer, code: str, notes: str = "") -> CustomerOrder:
@@ -20,7 +27,7 @@ def create_customer_order(db: Session, customer: Customer, code: str, notes: str
     if co:
         return co
     co = CustomerOrder(customer_id=customer.id, code=code, notes=notes.strip(), status="open")
-    db.add(co); db.commit(); db.refresh(co)
+    db.add(co); db.flush()
     return co
 
 def _gen_co_code(db: Session) -> str:
@@ -51,8 +58,7 @@ def get_or_create_open_co_for_customer(db: Session, customer_id: int) -> Custome
     code = _gen_co_code(db)
     co = CustomerOrder(customer_id=customer_id, code=code, status="open", created_at=datetime.utcnow())
     db.add(co)
-    db.commit()
-    db.refresh(co)
+    db.flush()
     return co
 
 def reserve_qty_for_customer(
@@ -99,58 +105,27 @@ def reserve_qty_for_customer(
         .limit(qty)
     ).scalars().all()
 
-    take = min(qty, len(units))
+    take = min(qty, lots.total(units))
     if take == 0:
         raise HTTPException(400, "Ingen ledige enheter å reservere.")
 
-    # Marker enheter + logg transaksjoner pr enhet
-    reserved_now = 0
-    for u in units[:take]:
-        u.status = "reserved"
-        u.reserved_co_id = co.id
-        tx = Tx(
-            item_id=item.id,
-            sku=item.sku,
-            name=item.name,
-            delta=0,
-            note=note or f"Reservert til CO {co.code}",
-            ts=datetime.utcnow(),
-            user_id=getattr(actor, "id", None),
-            user_name=getattr(actor, "name", None),
-            unit_id=u.id,
-            co_id=co.id,
-        )
-        db.add(tx)
-        reserved_now += 1
-
-    # Summer/oppdater ordrelinje for varen (NB: uten unit_id)
-    line = db.execute(
-        select(CustomerOrderLine)
-        .where(CustomerOrderLine.co_id == co.id)
-        .where(CustomerOrderLine.item_id == item.id)
-    ).scalar_one_or_none()
+    # Marker enhetene (pr parti for partivarer)
+    lots.move(db, units, take, lots.is_lot(item), status="reserved", reserved_co_id=co.id)
 
+    # Ordrelinje for varen – 'bestilt' økes ikke ved reservasjon, reservert følger hendelsen
+    line = find_line(db, co, item)
     if line:
-        line.qty = (line.qty or 0) + 0               # don't increase ordered on reservation
-        line.qty_reserved = (line.qty_reserved or 0) + reserved_now
-        # line.qty_fulfilled lar vi være som er (0 til varer plukkes/leveres)
         if note:
             existing = (line.notes or "")
             if note not in existing:
                 line.notes = (existing + (" | " if existing else "") + note)
     else:
-        db.add(CustomerOrderLine(
-            co_id=co.id,
-            item_id=item.id,
-            qty=0,            # don't set ordered via reservation
-            qty_reserved=reserved_now,   # viktig nå som NOT NULL
-            # qty_fulfilled = 0  # trenger ikke settes; default i ORM/DB
-            notes=note or "",
-            created_at=datetime.utcnow(),
-        ))
-
-    db.commit()
-    return co, reserved_now
+        line = CustomerOrderLine(co_id=co.id, item_id=item.id, qty=0, qty_reserved=0, qty_fulfilled=0,
+                                 notes=note or "", created_at=datetime.utcnow())
+        db.add(line)
+    ledger.record(db, "reserve", item, take, note=note or f"Reservert til CO {co.code}", actor=actor, co=co, line=line)
+    db.flush()
+    return co, take
 
 def get_or_create_co_by_code(db: Session, code: str, customer: Customer | None = None) -> CustomerOrder:
     code = code.strip()
@@ -164,14 +139,17 @@ def get_or_create_co_by_code(db: Session, code: str, customer: Customer | None =
             customer = create_customer(db, "Ukjent")
     return create_customer_order(db, customer, code)
 
-def ensure_line(db: Session, co: CustomerOrder, item: Item) -> CustomerOrderLine:
-    line = db.execute(
+def find_line(db: Session, co: CustomerOrder, item: Item) -> Optional[CustomerOrderLine]:
+    return db.execute(
         select(CustomerOrderLine).where(CustomerOrderLine.co_id == co.id, CustomerOrderLine.item_id == item.id)
     ).scalar_one_or_none()
+
+def ensure_line(db: Session, co: CustomerOrder, item: Item) -> CustomerOrderLine:
+    line = find_line(db, co, item)
     if not line:
         # Bruk ORM-feltet 'qty' (mapper til kolonnen 'qty_ordered')
         line = CustomerOrderLine(co_id=co.id, item_id=item.id, qty=0, qty_reserved=0, qty_fulfilled=0)
-        db.add(line); db.commit(); db.refresh(line)
+        db.add(line); db.flush()
     return line
 
 def reduce_ordered_on_co_line(db: Session, co: CustomerOrder, item: Item, qty: int, note: str = "") -> int:
@@ -187,14 +165,8 @@ def reduce_ordered_on_co_line(db: Session, co: CustomerOrder, item: Item, qty: i
     if take > 0:
         line.qty = max(0, before - take)
         # Optional audit row so it's visible in history
-        db.add(Tx(
-            item_id=item.id,
-            sku=item.sku,
-            name=item.name,
-            delta=0,
-            note=(note or "Redusert bestilt") + f" {take} stk (CO {co.code})",
-        ))
-        db.commit()
+        ledger.record(db, "note", item, note=(note or "Redusert bestilt") + f" {take} stk (CO {co.code})")
+        db.flush()
     return take
 
 def reserve_units(db: Session, item: Item, co: CustomerOrder, qty: int, note: str = "", actor: User | None = None):
@@ -207,27 +179,14 @@ def reserve_units(db: Session, item: Item, co: CustomerOrder, qty: int, note: st
         select(ItemUnit).where(ItemUnit.item_id == item.id, ItemUnit.status == "available").limit(qty)
     ).scalars().all()
 
-    if len(units) < qty:
-        raise HTTPException(status_code=400, detail=f"For få ledige enheter. Ledig: {len(units)}, ønsket: {qty}")
-
-    # Marker som reservert
-    now = datetime.utcnow()
-    for u in units:
-        u.status = "reserved"
-        u.reserved_co_id = co.id
+    if lots.total(units) < qty:
+        raise HTTPException(status_code=400, detail=f"For få ledige enheter. Ledig: {lots.total(units)}, ønsket: {qty}")
 
-    # Oppdater ordrelinje
+    # Marker som reservert; ordrelinja følger hendelsen
+    lots.move(db, units, qty, lots.is_lot(item), status="reserved", reserved_co_id=co.id)
     line = ensure_line(db, co, item)
-    line.qty_reserved = (line.qty_reserved or 0) + qty
-
-    # Logg (delta=0)
-    db.add(Tx(
-        item_id=item.id, sku=item.sku, name=item.name, delta=0,
-        note=note or f"Reservert {qty} stk til {co.code}",
-        user_id=(actor.id if actor else None), user_name=(actor.name if actor else None),
-        co_id=co.id
-    ))
-    db.commit()
+    ledger.record(db, "reserve", item, qty, note=note or f"Reservert {qty} stk til {co.code}", actor=actor, co=co, line=line)
+    db.flush()
 
 def release_units(db: Session, item: Item, co: CustomerOrder, qty: int, note: str = "", actor: User | None = None):
     qty = max(0, int(qty))
@@ -241,23 +200,13 @@ def release_units(db: Session, item: Item, co: CustomerOrder, qty: int, note: st
             ItemUnit.reserved_co_id == co.id
         ).limit(qty)
     ).scalars().all()
-    if len(units) < qty:
-        raise HTTPException(status_code=400, detail=f"For få reserverte å frigi. Reservert: {len(units)}, ønsket: {qty}")
-
-    for u in units:
-        u.status = "available"
-        u.reserved_co_id = None
+    if lots.total(units) < qty:
+        raise HTTPException(status_code=400, detail=f"For få reserverte å frigi. Reservert: {lots.total(units)}, ønsket: {qty}")
 
+    lots.move(db, units, qty, lots.is_lot(item), status="available", reserved_co_id=None)
     line = ensure_line(db, co, item)
-    line.qty_reserved = max(0, (line.qty_reserved or 0) - qty)
-
-    db.add(Tx(
-        item_id=item.id, sku=item.sku, name=item.name, delta=0,
-        note=note or f"Frigitt {qty} stk fra {co.code}",
-        user_id=(actor.id if actor else None), user_name=(actor.name if actor else None),
-        co_id=co.id
-    ))
-    db.commit()
+    ledger.record(db, "release", item, qty, note=note or f"Frigitt {qty} stk fra {co.code}", actor=actor, co=co, line=line)
+    db.flush()
 
 def fulfill_units(db: Session, item: Item, co: CustomerOrder, qty: int, note: str = "", actor: User | None = None) -> Tx:
     qty = max(0, int(qty))
@@ -272,52 +221,41 @@ def fulfill_units(db: Session, item: Item, co: CustomerOrder, qty: int, note: st
             ItemUnit.reserved_co_id == co.id
         ).limit(qty)
     ).scalars().all()
-    if len(reserved) < qty:
-        raise HTTPException(status_code=400, detail=f"Mangler reserverte enheter. Reservert: {len(reserved)}, ønsket: {qty}")
+    if lots.total(reserved) < qty:
+        raise HTTPException(status_code=400, detail=f"Mangler reserverte enheter. Reservert: {lots.total(reserved)}, ønsket: {qty}")
 
-    now = datetime.utcnow()
-    for u in reserved:
-        u.status = "used"
-        u.used_at = now
+    lots.move(db, reserved, qty, lots.is_lot(item), status="used", used_at=datetime.utcnow())
 
+    # Lageruttak: reservert -> utlevert på linja, beholdningen ned
     line = ensure_line(db, co, item)
-    take = len(reserved)
-    line.qty_reserved = max(0, (line.qty_reserved or 0) - take)
-    line.qty_fulfilled = (line.qty_fulfilled or 0) + take
-
-    # Lageruttak
-    tx = adjust_stock(db, item, delta=-take, note=note or f"Utlevert {take} stk til {co.code}", actor=actor, co=co)
-    db.commit(); db.refresh(tx)
+    tx = ledger.record(db, "fulfill", item, qty, note=note or f"Utlevert {qty} stk til {co.code}", actor=actor, co=co, line=line)
+    db.flush()
     return tx
 
-def get_or_create_category(db: Session, name: str | None) -> Optional[Category]:
+def _named_id(db: Session, model, name: str | None) -> Optional[int]:
+    """Id for kategori/lokasjon med navnet – fra refdata-cachen, opprettes ved behov."""
+    name = (name or "").strip()
     if not name:
         return None
-    name = name.strip()
-    if not name:
-        return None
-    cat = db.execute(select(Category).where(Category.name == name)).scalar_one_or_none()
-    if not cat:
-        cat = Category(name=name)
-        db.add(cat)
-        db.commit()
-        db.refresh(cat)
-    return cat
+    ref = refdata.get(model.__tablename__).by_name.get(name)
+    if ref:
+        return ref.id
+    obj = db.execute(select(model).where(model.name == name)).scalar_one_or_none()
+    if not obj:
+        obj = model(name=name)
+        db.add(obj)
+        db.flush()
+    return obj.id
+
+
+def get_or_create_category(db: Session, name: str | None) -> Optional[Category]:
+    cid = _named_id(db, Category, name)
+    return db.get(Category, cid) if cid else None
 
 
 def get_or_create_location(db: Session, name: str | None) -> Optional[Location]:
-    if not name:
-        return None
-    name = name.strip()
-    if not name:
-        return None
-    loc = db.execute(select(Location).where(Location.name == name)).scalar_one_or_none()
-    if not loc:
-        loc = Location(name=name)
-        db.add(loc)
-        db.commit()
-        db.refresh(loc)
-    return loc
+    lid = _named_id(db, Location, name)
+    return db.get(Location, lid) if lid else None
 
 
 def unfulfill_units(db: Session, item: Item, co: CustomerOrder, qty: int, note: str = "", actor: User | None = None) -> Tx:
@@ -332,33 +270,15 @@ def unfulfill_units(db: Session, item: Item, co: CustomerOrder, qty: int, note:
             ItemUnit.reserved_co_id == co.id,
         ).limit(qty)
     ).scalars().all()
-    if len(used) < qty:
-        raise HTTPException(status_code=400, detail=f"Finner ikke nok utleverte enheter å trekke. Utlevert: {len(used)}, ønsket: {qty}")
+    if lots.total(used) < qty:
+        raise HTTPException(status_code=400, detail=f"Finner ikke nok utleverte enheter å trekke. Utlevert: {lots.total(used)}, ønsket: {qty}")
 
-    for u in used:
-        u.status = "available"
-        u.used_at = None
-
-    line = ensure_line(db, co, item)
-    take = len(used)
-    line.qty_fulfilled = max(0, (line.qty_fulfilled or 0) - take)
+    lots.move(db, used, qty, lots.is_lot(item), status="available", used_at=None)
 
     # Legg tilbake på lager
-    item.qty = (item.qty or 0) + take
-    item.last_updated = datetime.utcnow()
-
-    tx = Tx(
-        item_id=item.id,
-        sku=item.sku,
-        name=item.name,
-        delta=take,
-        note=note or f"Tilbakeført {take} stk (CO {co.code})",
-        co_id=co.id,
-        user_id=(actor.id if actor else None),
-        user_name=(actor.name if actor else None),
-    )
-    db.add_all([item, tx])
-    db.commit(); db.refresh(tx)
+    line = ensure_line(db, co, item)
+    tx = ledger.record(db, "return", item, qty, note=note or f"Tilbakeført {qty} stk (CO {co.code})", actor=actor, co=co, line=line)
+    db.flush()
     return tx
 
 def delete_co_line(db: Session, co: CustomerOrder, item: Item, actor: User | None = None) -> None:
@@ -373,13 +293,14 @@ def delete_co_line(db: Session, co: CustomerOrder, item: Item, actor: User | Non
             ItemUnit.reserved_co_id == co.id,
         )
     ).scalars().all()
-    for u in units:
-        u.status = "available"
-        u.reserved_co_id = None
+    n = lots.total(units)
+    if n:
+        lots.move(db, units, n, lots.is_lot(item), status="available", reserved_co_id=None)
+        ledger.record(db, "release", item, n, note=f"Frigitt {n} stk – linje slettet (CO {co.code})", actor=actor, co=co)
     # Nullstill linje og slett
     line.qty = 0; line.qty_reserved = 0; line.qty_fulfilled = 0
     db.delete(line)
-    db.commit()
+    db.flush()
 
 def create_item(db: Session, actor: Optional[User] = None, **data) -> Item:
     """
@@ -390,32 +311,26 @@ def create_item(db: Session, actor: Optional[User] = None, **data) -> Item:
     category_name = data.pop("category", None)
     location_name = data.pop("location", None)
     data.pop("actor", None)  # paranoid cleanup i tilfelle noen kaller med actor i **data
+    # Beholdningen settes via lagerboka, ikke direkte
+    qty = int(data.pop("qty", 0) or 0)
 
     # Default-felt for Item som kan mangle
-    data.setdefault("qty", 0)
     data.setdefault("min_qty", 0)
     data.setdefault("price", 0.0)
     data.setdefault("currency", "NOK")
     data.setdefault("notes", "")
     data.setdefault("image_path", "")
 
-    # Slå opp/lag kategori og lokasjon
-    cat = get_or_create_category(db, category_name)
-    loc = get_or_create_location(db, location_name)
-
-    item = Item(**data)
-    item.category_obj = cat
-    item.location_obj = loc
+    # Slå opp/lag kategori og lokasjon (id fra refdata-cachen – ingen oppslag på navn)
+    item = Item(**data, qty=0)
+    item.category_id = _named_id(db, Category, category_name)
+    item.location_id = _named_id(db, Location, location_name)
     db.add(item)
-    db.commit()
-    db.refresh(item)
-
-    # Audit (delta=0)
-    db.add(Tx(
-        item_id=item.id, sku=item.sku, name=item.name, delta=0, note="Opprettet vare",
-        user_id=(actor.id if actor else None), user_name=(actor.name if actor else None),
-    ))
-    db.commit()
+    db.flush()
+
+    # Audit – med startbeholdning som justering
+    ledger.record(db, "adjust" if qty else "note", item, note="Opprettet vare", actor=actor, delta=qty)
+    db.flush()
     return item
 
 
@@ -424,39 +339,36 @@ def update_item(db: Session, item: Item, actor: Optional[User] = None, **data) -
     category_name = data.pop("category", None)
     location_name = data.pop("location", None)
     data.pop("actor", None)
+    new_qty = data.pop("qty", None)
+
+    to_lot = data.get("tracking") == "lot" and not lots.is_lot(item)
 
     # Oppdater primitive felter på Item
     for k, v in data.items():
         setattr(item, k, v)
 
     # Oppdater relasjoner
-    cat = get_or_create_category(db, category_name)
-    loc = get_or_create_location(db, location_name)
-    if cat is not None:
-        item.category_obj = cat
-    if loc is not None:
-        item.location_obj = loc
+    cat_id = _named_id(db, Category, category_name)
+    loc_id = _named_id(db, Location, location_name)
+    if cat_id is not None:
+        item.category_id = cat_id
+    if loc_id is not None:
+        item.location_id = loc_id
 
     item.last_updated = datetime.utcnow()
     db.add(item)
-    db.commit()
-    db.refresh(item)
-
-    # Audit (delta=0)
-    db.add(Tx(
-        item_id=item.id, sku=item.sku, name=item.name, delta=0, note="Oppdatert vare",
-        user_id=(actor.id if actor else None), user_name=(actor.name if actor else None),
-    ))
-    db.commit()
+    # Audit – endret antall i skjemaet blir en justering i lagerboka
+    delta = int(new_qty) - (item.qty or 0) if new_qty is not None else 0
+    ledger.record(db, "adjust" if delta else "note", item, note="Oppdatert vare", actor=actor, delta=delta)
+    db.flush()
+    if to_lot:
+        # Eksisterende enhetsrader slås sammen til partier
+        lots.compact(db.connection().exec_driver_sql, item.id)
     return item
 
 
-from sqlalchemy import select, func, update  # ← legg til update her
-# ...
-
-
 def delete_item(db: Session, item: Item, actor: Optional[User] = None, confirm_code: str | None = None) -> None:
-    units_cnt = db.execute(select(func.count(ItemUnit.id)).where(ItemUnit.item_id == item.id)).scalar() or 0
+    units_cnt = db.execute(select(func.sum(ItemUnit.qty)).where(ItemUnit.item_id == item.id)).scalar() or 0
     pol_cnt   = db.execute(select(func.count(PurchaseOrderLine.id)).where(PurchaseOrderLine.item_id == item.id)).scalar() or 0
 
     # Krev kode hvis noe refererer til varen
@@ -467,20 +379,17 @@ def delete_item(db: Session, item: Item, actor: Optional[User] = None, confirm_c
         )
 
     # Audit
-    db.add(Tx(
-        item_id=item.id, sku=item.sku, name=item.name, delta=0, note="Slettet vare",
-        user_id=(actor.id if actor else None), user_name=(actor.name if actor else None),
-    ))
-    db.commit()
+    ledger.record(db, "note", item, note="Slettet vare", actor=actor)
+    db.flush()
 
     # Frikoble referanser (vi har satt FK til SET NULL i migreringen)
     db.execute(update(Tx).where(Tx.item_id == item.id).values(item_id=None))
     db.execute(update(ItemUnit).where(ItemUnit.item_id == item.id).values(item_id=None))
     db.execute(update(PurchaseOrderLine).where(PurchaseOrderLine.item_id == item.id).values(item_id=None))
-    db.commit()
+    ledger.forget_item(db, item.id)
 
     db.delete(item)
-    db.commit()
+    db.flush()
 
 
 
@@ -494,23 +403,10 @@ def adjust_stock(
     po: Optional[PurchaseOrder] = None,
     unit: Optional[ItemUnit] = None,
 ) -> Tx:
-    item.qty = max(0, (item.qty or 0) + int(delta))
-    item.last_updated = datetime.utcnow()
-    tx = Tx(
-        item_id=item.id,
-        sku=item.sku,
-        name=item.name,
-        delta=int(delta),
-        note=note,
-        user_id=(actor.id if actor else None),
-        user_name=(actor.name if actor else None),
-        co_id=(co.id if co else None),
-        po_id=(po.id if po else None),
-        unit_id=(unit.id if unit else None),
-    )
-    db.add_all([item, tx])
-    db.commit()
-    db.refresh(tx)
+    # Beholdningen går ikke under 0 – hendelsen viser det som faktisk ble trukket
+    delta = max(int(delta), -(item.qty or 0))
+    tx = ledger.record(db, "adjust", item, note=note, actor=actor, co=co, po=po, unit=unit, delta=delta)
+    db.flush()
     return tx
 
 def undo_receive_units(
@@ -533,7 +429,7 @@ def undo_receive_units(
     units = db.execute(q.order_by(ItemUnit.id.desc()).limit(qty)).scalars().all()
     if not units:
         raise HTTPException(status_code=400, detail="Fant ingen enheter å angre.")
-    take = len(units)
+    take = lots.remove(db, units, qty)
     # update PO line received
     if po:
         pol = db.execute(
@@ -541,34 +437,15 @@ def undo_receive_units(
         ).scalar_one_or_none()
         if pol:
             pol.qty_received = max(0, (pol.qty_received or 0) - take)
-    for u in units:
-        db.delete(u)
-    item.qty = max(0, (item.qty or 0) - take)
-    item.last_updated = datetime.utcnow()
-    tx = Tx(
-        item_id=item.id,
-        sku=item.sku,
-        name=item.name,
-        delta=-take,
-        note=note,
-        po_id=(po.id if po else None),
-        user_id=(actor.id if actor else None),
-        user_name=(actor.name if actor else None),
-    )
-    db.add_all([item, tx])
-    db.commit(); db.refresh(tx)
+    tx = ledger.record(db, "unreceive", item, take, note=note, actor=actor, po=po)
+    db.flush()
     return tx
 
 
 def inventory_stats(db: Session) -> Tuple[int, float]:
-    total_items = db.execute(select(func.count(Item.id))).scalar_one() or 0
-    # Sum up per-unit purchase_price for units not yet used
-    total_value = db.execute(
-        select(func.sum(ItemUnit.purchase_price)).where(
-            ItemUnit.status.in_(("available", "ledig", "reserved", "reservert"))
-        )
-    ).scalar() or 0.0
-    return int(total_items), float(total_value)
+    from . import kpi
+    k = kpi.get(db)
+    return k["total_items"], k["total_value"]
 
 
 def delete_customer(db: Session, customer: Customer, confirm_code: str | None = None) -> None:
@@ -586,13 +463,13 @@ def delete_customer(db: Session, customer: Customer, confirm_code: str | None =
 
     # Slett kunden
     db.delete(customer)
-    db.commit()
+    db.flush()
 
 
 def delete_customer_order(db: Session, co: CustomerOrder, confirm_code: str | None = None) -> None:
     # Finn reserverte enheter og linjer for sikkerhetsbekreftelse
     reserved_cnt = db.execute(
-        select(func.count(ItemUnit.id)).where(
+        select(func.sum(ItemUnit.qty)).where(
             ItemUnit.reserved_co_id == co.id,
             ItemUnit.status.in_(("reserved", "reservert"))
         )
@@ -605,7 +482,17 @@ def delete_customer_order(db: Session, co: CustomerOrder, confirm_code: str | No
             detail=f"Ordren har {reserved_cnt} reserverte enhet(er) og {lines_cnt} linje(r). Skriv 1234 for å bekrefte sletting."
         )
 
-    # Frigi reserverte enheter og fjern koblinger
+    # Frigi reserverte enheter (som hendelser, så lagerboka følger med) og fjern koblinger
+    for item_id, n in db.execute(
+        select(ItemUnit.item_id, func.sum(ItemUnit.qty))
+        .where(ItemUnit.reserved_co_id == co.id, ItemUnit.status.in_(("reserved", "reservert")),
+               ItemUnit.item_id.is_not(None))
+        .group_by(ItemUnit.item_id)
+    ).all():
+        item = db.get(Item, item_id)
+        if item and n:
+            ledger.record(db, "release", item, int(n), note=f"Frigitt {n} stk – CO {co.code} slettet", co=co)
+    db.flush()
     db.execute(
         update(ItemUnit)
         .where(ItemUnit.reserved_co_id == co.id, ItemUnit.status.in_(("reserved", "reservert")))
@@ -615,11 +502,13 @@ def delete_customer_order(db: Session, co: CustomerOrder, confirm_code: str | No
     db.execute(update(ItemUnit).where(ItemUnit.reserved_co_id == co.id).values(reserved_co_id=None))
     # Null ut Tx.co_id for historikk (vi beholder transaksjoner)
     db.execute(update(Tx).where(Tx.co_id == co.id).values(co_id=None))
-    db.commit()
+    ledger.forget_co(db, co.id)
+    # Frigitte partier slås sammen med ledige rader med samme nøkkel
+    lots.compact(db.connection().exec_driver_sql)
 
     # Slett ordre (linjer slettes pga cascade)
     db.delete(co)
-    db.commit()
+    db.flush()
 
 
 def delete_customer_orders_for_customer(db: Session, customer_id: int, confirm_code: str | None = None) -> int:
@@ -635,7 +524,7 @@ def get_or_create_po(db: Session, code: str, supplier: str = "") -> PurchaseOrde
     po = db.execute(select(PurchaseOrder).where(PurchaseOrder.code == code)).scalar_one_or_none()
     if not po:
         po = PurchaseOrder(code=code, supplier=supplier or "")
-        db.add(po); db.commit(); db.refresh(po)
+        db.add(po); db.flush()
     return po
 
 def get_or_create_co(db: Session, code: str, customer: Customer | None = None) -> CustomerOrder:
@@ -650,8 +539,7 @@ def get_or_create_co(db: Session, code: str, customer: Customer | None = None) -
         created_at=datetime.utcnow(),
     )
     db.add(co)
-    db.commit()
-    db.refresh(co)
+    db.flush()
     return co
 
 def create_units_for_receive(
@@ -662,8 +550,20 @@ def create_units_for_receive(
     note: str,
     actor: User | None = None,
     unit_price: float | None = None,
+    serials: Optional[List[str]] = None,
 ) -> Tx:
     qty = int(qty)
+    if qty > MAX_LINE_QTY:
+        raise HTTPException(status_code=400, detail=f"Antall {qty} er over grensen pr mottak ({MAX_LINE_QTY})")
+    serials = serials or []
+    if serials:
+        if lots.is_lot(item):
+            raise HTTPException(status_code=400, detail="Partivarer har ikke serienummer")
+        if len(serials) > qty:
+            raise HTTPException(status_code=400, detail=f"{len(serials)} serienumre, men bare {qty} enheter")
+        taken = unitcodes.taken_serials(db, serials)
+        if taken:
+            raise HTTPException(status_code=409, detail="Serienummer finnes fra før: " + ", ".join(taken[:20]))
 
     # 1) Sørg for PO
     po_code = (po_code or "").strip()
@@ -675,26 +575,17 @@ def create_units_for_receive(
         if not po:
             po = PurchaseOrder(code=po_code, supplier="")
             db.add(po)
-            db.commit()
-            db.refresh(po)
+            db.flush()
 
     # 2) Create units and update last known item price if provided
     price_val = float(unit_price or 0.0)
     if price_val > 0:
         item.price = price_val
-    for _ in range(qty):
-        db.add(ItemUnit(
-            item_id=item.id,
-            po_id=(po.id if po else None),
-            status="available",
-            purchase_price=price_val,
-            created_at=datetime.utcnow(),
-        ))
-
-    # 3) Øk lagerantall på varen
-    item.qty = (item.qty or 0) + qty
-
-    # 4) Oppdater PO-linje (qty_received)
+    for u, serial in zip(lots.add(db, item, qty, (po.id if po else None), price_val), serials):
+        u.serial = serial
+    unitcodes.label_new(db, [item.id])
+
+    # 3) Oppdater PO-linje (qty_received)
     if po:
         pol = db.execute(
             select(PurchaseOrderLine).where(
@@ -707,50 +598,357 @@ def create_units_for_receive(
             db.add(pol)
         pol.qty_received = (pol.qty_received or 0) + qty
 
-    # 5) Tx for mottaket
-    tx = Tx(
-        item_id=item.id,
-        sku=item.sku,
-        name=item.name,
-        delta=qty,
-        note=note or "Mottak",
-        user_id=(actor.id if actor else None),
-        user_name=(actor.name if actor else None),
-        po_id=(po.id if po else None),
-    )
-    db.add(tx)
-
-    db.commit()
-    db.refresh(tx)
+    # 4) Hendelse for mottaket (øker beholdningen)
+    tx = ledger.record(db, "receive", item, qty, note=note or "Mottak", actor=actor, po=po)
+    db.flush()
     return tx
 
-def reserve_units_by_ids(db: Session, unit_ids: Iterable[int], co_code: str, note: str, actor: Optional[User]) -> int:
+def get_item_by_sku(db: Session, sku: str) -> Optional[Item]:
+    """SKU-oppslag via den prosess-globale indeksen; faller tilbake til DB ved bom."""
+    sku = (sku or "").strip()
+    if not sku:
+        return None
+    entry = sku_index.get(sku)
+    if entry:
+        item = db.get(Item, entry.id)
+        if item is not None and item.sku == sku:
+            return item
+        sku_index.invalidate()
+    return db.execute(select(Item).where(Item.sku == sku)).scalar_one_or_none()
+
+# ------------------------------------------------------------
+# Batch-skann (håndholdte skannere / PO-skann)
+# ------------------------------------------------------------
+MAX_SCAN_LINES = 20000
+# Serialiserte varer blir én rad pr enhet – antallet må ha et tak, ellers kan én linje fylle minnet
+MAX_LINE_QTY = 10000     # pr linje
+MAX_SCAN_UNITS = 100000  # pr økt (sum av alle linjer)
+_SKU_CHUNK = 500  # holder oss godt under SQLite sin grense for bind-variabler
+
+def find_items_by_skus(db: Session, skus: Iterable[str]) -> Dict[str, Item]:
+    """Slår opp mange SKU-er i én spørring (chunket ved svært store sett)."""
+    wanted = sorted({(s or "").strip() for s in skus} - {""})
+    found: Dict[str, Item] = {}
+    for i in range(0, len(wanted), _SKU_CHUNK):
+        chunk = wanted[i:i + _SKU_CHUNK]
+        for it in db.execute(select(Item).where(Item.sku.in_(chunk))).scalars():
+            found[it.sku] = it
+    return found
+
+def _parse_scan_line(raw) -> Tuple[str, int, float]:
+    # En skann kan være bare en streng (SKU, antall 1) eller {"sku", "qty", "price"}
+    if isinstance(raw, str):
+        return raw.strip(), 1, 0.0
+    if not isinstance(raw, dict):
+        raise ValueError("Ugyldig linje")
+    sku = str(raw.get("sku", "") or "").strip()
+    qty = int(raw.get("qty", 1) or 0)
+    price = float(raw.get("price", 0) or 0)
+    return sku, qty, price
+
+def scan_units(lines: List) -> int:
+    """Antall enheter på linjene til sammen. ValueError hvis en linje eller summen er over taket."""
+    total = 0
+    for raw in lines:
+        try:
+            qty = _parse_scan_line(raw)[1]
+        except (TypeError, ValueError):
+            continue  # blir feil på linjen
+        if qty > MAX_LINE_QTY:
+            raise ValueError(f"Antall {qty} er over grensen pr linje ({MAX_LINE_QTY})")
+        total += max(qty, 0)
+    if total > MAX_SCAN_UNITS:
+        raise ValueError(f"{total} enheter er over grensen pr økt ({MAX_SCAN_UNITS})")
+    return total
+
+def apply_scan_lines(
+    db: Session,
+    po_code: str,
+    lines: List,
+    note: str = "Mottak (skann)",
+    actor: User | None = None,
+    auto_create: bool = True,
+) -> Tuple[List[dict], List[Tx]]:
+    """Registrerer mottak for en hel skann-økt.
+
+    Skannene aggregeres pr (SKU, pris) og alle varer slås opp i én spørring.
+    Returnerer resultat pr innsendt linje (samme rekkefølge) og Tx-radene som
+    ble laget (én pr aggregert gruppe).
+    """
+    if len(lines) > MAX_SCAN_LINES:
+        raise HTTPException(status_code=413, detail=f"For mange linjer (maks {MAX_SCAN_LINES})")
+    try:
+        scan_units(lines)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    results: List[dict] = []
+    groups: Dict[tuple[str, float], int] = defaultdict(int)
+    group_serials: Dict[tuple[str, float], List[str]] = defaultdict(list)
+    line_keys: List[tuple[str, float] | None] = []
+    parsed = []
+    for idx, raw in enumerate(lines):
+        try:
+            sku, qty, price = _parse_scan_line(raw)
+            serials = unitcodes.clean_serials(raw.get("serials")) if isinstance(raw, dict) else []
+        except (TypeError, ValueError):
+            parsed.append((idx, None, 0, 0.0, [], "Ugyldig linje"))
+            continue
+        if not sku or qty <= 0:
+            parsed.append((idx, sku, qty, price, [], "Mangler SKU eller antall <= 0"))
+        elif len(serials) > qty:
+            parsed.append((idx, sku, qty, price, [], f"{len(serials)} serienumre, men antall er {qty}"))
+        else:
+            parsed.append((idx, sku, qty, price, serials, None))
+    # Serienumre er unike – sjekk alle i økten med én spørring
+    taken = set(unitcodes.taken_serials(db, (s for p in parsed for s in p[4])))
+    for idx, sku, qty, price, serials, error in parsed:
+        clash = [s for s in serials if s in taken]
+        if clash:
+            error = "Serienummer finnes fra før: " + ", ".join(clash[:20])
+        if error:
+            results.append({"index": idx, "sku": sku, "status": "error", "error": error})
+            line_keys.append(None)
+            continue
+        groups[(sku, price)] += qty
+        group_serials[(sku, price)].extend(serials)
+        results.append({"index": idx, "sku": sku, "qty": qty, "status": "ok"})
+        if serials:
+            results[-1]["serials"] = len(serials)
+        line_keys.append((sku, price))
+
+    if not groups:
+        return results, []
+
+    items = find_items_by_skus(db, (sku for sku, _ in groups))
+    created: set[str] = set()
+    missing = sorted({sku for sku, _ in groups} - set(items))
+    if missing and auto_create:
+        cat_id = _named_id(db, Category, "Uncategorized")
+        loc_id = _named_id(db, Location, "Hovedlager")
+        for sku in missing:
+            it = Item(name=sku, sku=sku, qty=0, min_qty=0, price=0.0, currency="NOK", notes="", image_path="",
+                      category_id=cat_id, location_id=loc_id)
+            db.add(it)
+            items[sku] = it
+            created.add(sku)
+        db.flush()
+        for sku in missing:
+            ledger.record(db, "note", items[sku], note="Opprettet vare", actor=actor)
+
+    po = None
+    po_code = (po_code or "").strip()
+    if po_code:
+        po = db.execute(select(PurchaseOrder).where(PurchaseOrder.code == po_code)).scalar_one_or_none()
+        if not po:
+            po = PurchaseOrder(code=po_code, supplier="")
+            db.add(po)
+            db.flush()
+
+    pols: Dict[int, PurchaseOrderLine] = {}
+    if po:
+        item_ids = [it.id for it in items.values()]
+        for pol in db.execute(
+            select(PurchaseOrderLine).where(PurchaseOrderLine.po_id == po.id, PurchaseOrderLine.item_id.in_(item_ids))
+        ).scalars():
+            pols[pol.item_id] = pol
+
+    now = datetime.utcnow()
+    unit_rows: List[dict] = []
+    txs: List[Tx] = []
+    tx_by_key: Dict[tuple[str, float], Tx] = {}
+    for (sku, price), qty in groups.items():
+        item = items.get(sku)
+        if item is None:
+            continue
+        if price > 0:
+            item.price = price
+        if lots.is_lot(item):
+            lots.add(db, item, qty, (po.id if po else None), price, now)
+        else:
+            serials = group_serials.get((sku, price)) or []
+            unit_rows.extend(
+                {"item_id": item.id, "po_id": (po.id if po else None), "status": "available",
+                 "purchase_price": price, "created_at": now, "qty": 1,
+                 "serial": (serials[i] if i < len(serials) else None)}
+                for i in range(qty)
+            )
+        if po:
+            pol = pols.get(item.id)
+            if not pol:
+                pol = PurchaseOrderLine(po_id=po.id, item_id=item.id, qty_ordered=0, qty_received=0)
+                db.add(pol)
+                pols[item.id] = pol
+            pol.qty_received = (pol.qty_received or 0) + qty
+        tx = ledger.record(db, "receive", item, qty, note=note or "Mottak", actor=actor, po=po, ts=now)
+        txs.append(tx)
+        tx_by_key[(sku, price)] = tx
+
+    if unit_rows:
+        db.execute(insert(ItemUnit), unit_rows)
+    unitcodes.label_new(db, (items[sku].id for sku, _ in groups if sku in items))
+    db.flush()
+
+    for res, key in zip(results, line_keys):
+        if key is None:
+            continue
+        item = items.get(key[0])
+        if item is None:
+            res.update(status="error", error="Ukjent SKU")
+            continue
+        res["item_id"] = item.id
+        res["tx_id"] = tx_by_key[key].id
+        if res.get("serials") and lots.is_lot(item):
+            res["warning"] = "Partivare – serienummer er ikke lagret"
+        if key[0] in created:
+            res["status"] = "created"
+    return results, txs
+
+# ------------------------------------------------------------
+# Idempotente operasjoner (offline-kø på skannesidene)
+# ------------------------------------------------------------
+OP_KINDS = ("receive", "po_scan")
+MAX_OPS = 5000
+MAX_OPS_BYTES = 16 * 1024 * 1024  # body etter gzip-utpakking
+
+def _op_lines(kind: str, payload: dict) -> Tuple[str, str, List]:
+    # -> (po_code, note, skann-linjer) for en operasjon
+    if kind == "receive":
+        line = {"sku": payload.get("sku"), "qty": payload.get("qty", 1), "price": payload.get("price") or 0,
+                "serials": payload.get("serials")}
+        note = str(payload.get("note") or "").strip() or "Mottak"
+        return str(payload.get("po_code") or "").strip(), note, [line]
+    lines = payload.get("lines") or []
+    if not isinstance(lines, list):
+        raise ValueError("'lines' må være en liste")
+    return str(payload.get("po_code") or "").strip(), "Mottak (skann)", lines
+
+def apply_ops(db: Session, ops: List, actor: User | None = None) -> Tuple[List[dict], List[Tx]]:
+    """Bruker en bunke klient-genererte operasjoner nøyaktig én gang.
+
+    Operasjoner som allerede finnes i applied_ops svarer med lagret resultat
+    (status 'duplicate'). Nye operasjoner grupperes pr (PO, notat) og skrives
+    i én transaksjon sammen med applied_ops-radene. Grensene for linjer og antall
+    (MAX_SCAN_LINES, MAX_LINE_QTY, MAX_SCAN_UNITS) gjelder pr operasjon; en
+    operasjon over dem får feil, resten går igjennom.
+    """
+    if len(ops) > MAX_OPS:
+        raise HTTPException(status_code=413, detail=f"For mange operasjoner (maks {MAX_OPS})")
+
+    results: List[dict] = [None] * len(ops)  # type: ignore[list-item]
+    valid: Dict[str, int] = {}
+    for idx, op in enumerate(ops):
+        op_id = str((op or {}).get("op_id") or "").strip() if isinstance(op, dict) else ""
+        kind = op.get("kind") if isinstance(op, dict) else None
+        payload = op.get("payload") if isinstance(op, dict) else None
+        if not (8 <= len(op_id) <= 64) or kind not in OP_KINDS or not isinstance(payload, dict):
+            results[idx] = {"op_id": op_id or None, "status": "error", "error": "Ugyldig operasjon"}
+        elif op_id in valid:
+            results[idx] = {"op_id": op_id, "status": "duplicate", "same_as": valid[op_id]}
+        else:
+            valid[op_id] = idx
+
+    ids = list(valid)
+    for i in range(0, len(ids), _SKU_CHUNK):
+        for row in db.execute(select(AppliedOp).where(AppliedOp.op_id.in_(ids[i:i + _SKU_CHUNK]))).scalars():
+            idx = valid.pop(row.op_id)
+            results[idx] = {"op_id": row.op_id, "status": "duplicate", "result": json.loads(row.result or "null")}
+
+    # Grupper nye operasjoner slik at hver (PO, notat) blir ett apply_scan_lines-kall – delt i
+    # biter på maks MAX_SCAN_LINES linjer og MAX_SCAN_UNITS enheter, så mange små operasjoner
+    # fra en gjenoppkobling ikke gir 413/400
+    groups: Dict[tuple[str, str, int], List[tuple[int, int, int]]] = defaultdict(list)  # -> (op-indeks, start, antall)
+    group_lines: Dict[tuple[str, str, int], List] = defaultdict(list)
+    group_units: Dict[tuple[str, str, int], int] = defaultdict(int)
+    chunk_no: Dict[tuple[str, str], int] = defaultdict(int)
+    for op_id, idx in valid.items():
+        op = ops[idx]
+        try:
+            po_code, note, lines = _op_lines(op["kind"], op["payload"])
+            units = scan_units(lines)
+        except (TypeError, ValueError) as e:
+            results[idx] = {"op_id": op_id, "status": "error", "error": str(e)}
+            continue
+        if len(lines) > MAX_SCAN_LINES:
+            results[idx] = {"op_id": op_id, "status": "error", "error": f"For mange linjer (maks {MAX_SCAN_LINES})"}
+            continue
+        key = (po_code, note, chunk_no[(po_code, note)])
+        if len(group_lines[key]) + len(lines) > MAX_SCAN_LINES or group_units[key] + units > MAX_SCAN_UNITS:
+            chunk_no[(po_code, note)] += 1
+            key = (po_code, note, chunk_no[(po_code, note)])
+        groups[key].append((idx, len(group_lines[key]), len(lines)))
+        group_lines[key].extend(lines)
+        group_units[key] += units
+
+    txs: List[Tx] = []
+    applied: List[dict] = []
+    for key, members in groups.items():
+        line_results, group_txs = apply_scan_lines(db, key[0], group_lines[key], note=key[1], actor=actor)
+        txs.extend(group_txs)
+        for idx, start, n in members:
+            op = ops[idx]
+            own = [dict(r, index=r["index"] - start) for r in line_results[start:start + n]]
+            result = own[0] if op["kind"] == "receive" else {"lines": own}
+            results[idx] = {"op_id": op["op_id"].strip(), "status": "applied", "result": result}
+            applied.append({
+                "op_id": op["op_id"].strip(), "kind": op["kind"], "result": json.dumps(result),
+                "user_id": (actor.id if actor else None), "created_at": datetime.utcnow(),
+            })
+    if applied:
+        db.execute(insert(AppliedOp), applied)
+
+    # Auto-reservasjon etter mottak (kjøres kun første gang) – i samme transaksjon som mottaket
+    for idx in valid.values():
+        op, res = ops[idx], results[idx]
+        payload = op["payload"]
+        if op["kind"] != "receive" or res["status"] != "applied" or not (payload.get("co_code") and payload.get("auto_reserve")):
+            continue
+        item_id = res["result"].get("item_id")
+        item = db.get(Item, item_id) if item_id else None
+        if not item:
+            continue
+        qty = int(res["result"].get("qty") or 0)
+        try:
+            co = get_or_create_co_by_code(db, str(payload["co_code"]).strip(), None)
+            reserve_units(db, item, co, qty=qty, note="Auto-reservasjon etter mottak", actor=actor)
+            reduce_ordered_on_co_line(db, co, item, qty, note="Auto: mottak")
+            res["result"]["reserved_co"] = co.code
+        except HTTPException as e:
+            # reserve_units feiler før noe er endret – mottaket står
+            res["result"]["reserve_error"] = e.detail
+    return results, txs
+
+def _picked(u: ItemUnit, qtys: Optional[Dict[int, Optional[int]]]) -> int:
+    # Hele raden med mindre et antall er valgt (partier)
+    have = u.qty or 1
+    n = (qtys or {}).get(u.id)
+    return have if not n else max(0, min(int(n), have))
+
+def reserve_units_by_ids(db: Session, unit_ids: Iterable[int], co_code: str, note: str, actor: Optional[User],
+                         qtys: Optional[Dict[int, Optional[int]]] = None) -> int:
     co = get_or_create_co(db, co_code)
     ids = list(map(int, unit_ids))
     rows = db.execute(select(ItemUnit).where(ItemUnit.id.in_(ids))).scalars().all()
     by_item: Dict[int, List[ItemUnit]] = defaultdict(list)
     for u in rows:
         if u.status == "available":
-            u.status = "reserved"
-            u.reserved_co_id = co.id
             by_item[u.item_id].append(u)
     # Oppdater ordrelinjer og audit per vare
+    total = 0
     for item_id, units in by_item.items():
         item = db.get(Item, item_id)
-        k = len(units)
-        line = ensure_line(db, co, item)
+        picked = {u.id: _picked(u, qtys) for u in units}
+        k = sum(picked.values())
+        lots.move(db, units, k, lots.is_lot(item), picked, status="reserved", reserved_co_id=co.id)
+        total += k
         # Ikke øk 'bestilt' ved reservasjon av konkrete enheter
-        line.qty = (line.qty or 0) + 0
-        line.qty_reserved = (line.qty_reserved or 0) + k
-        db.add(Tx(
-            item_id=item_id, sku=item.sku, name=item.name, delta=0,
-            note=(note or "Reservert") + f" {k} stk (CO {co.code})",
-            co_id=co.id, user_id=(actor.id if actor else None), user_name=(actor.name if actor else None),
-        ))
-    db.commit()
-    return sum(len(v) for v in by_item.values())
-
-def unreserve_units(db: Session, unit_ids: Iterable[int], note: str, actor: Optional[User]) -> int:
+        line = ensure_line(db, co, item)
+        ledger.record(db, "reserve", item, k, note=(note or "Reservert") + f" {k} stk (CO {co.code})",
+                      actor=actor, co=co, line=line)
+    db.flush()
+    return total
+
+def unreserve_units(db: Session, unit_ids: Iterable[int], note: str, actor: Optional[User],
+                    qtys: Optional[Dict[int, Optional[int]]] = None) -> int:
     ids = list(map(int, unit_ids))
     rows = db.execute(select(ItemUnit).where(ItemUnit.id.in_(ids))).scalars().all()
     # grupper per (co_id, item_id) slik at CO-linjer oppdateres korrekt
@@ -758,25 +956,23 @@ def unreserve_units(db: Session, unit_ids: Iterable[int], note: str, actor: Opti
     for u in rows:
         if u.status in ("reserved", "reservert") and u.reserved_co_id:
             by_co_item[(int(u.reserved_co_id), int(u.item_id))].append(u)
-            u.status = "available"
-            u.reserved_co_id = None
     total = 0
     for (co_id, item_id), units in by_co_item.items():
-        total += len(units)
         item = db.get(Item, item_id)
+        picked = {u.id: _picked(u, qtys) for u in units}
+        k = sum(picked.values())
+        lots.move(db, units, k, lots.is_lot(item), picked, status="available", reserved_co_id=None)
+        total += k
         co = db.get(CustomerOrder, co_id)
-        if co and item:
-            line = ensure_line(db, co, item)
-            line.qty_reserved = max(0, (line.qty_reserved or 0) - len(units))
-        db.add(Tx(
-            item_id=item_id, sku=(item.sku if item else ""), name=(item.name if item else ""), delta=0,
-            note=(note or "Opphevet reservasjon") + f" {len(units)} stk",
-            co_id=co_id, user_id=(actor.id if actor else None), user_name=(actor.name if actor else None),
-        ))
-    db.commit()
+        if item:
+            line = ensure_line(db, co, item) if co else None
+            ledger.record(db, "release", item, k, note=(note or "Opphevet reservasjon") + f" {k} stk",
+                          actor=actor, co=co, line=line)
+    db.flush()
     return total
 
-def issue_units(db: Session, unit_ids: Iterable[int], co_code: str, note: str, actor: Optional[User]) -> int:
+def issue_units(db: Session, unit_ids: Iterable[int], co_code: str, note: str, actor: Optional[User],
+                qtys: Optional[Dict[int, Optional[int]]] = None) -> int:
     co = get_or_create_co(db, co_code)
     ids = list(map(int, unit_ids))
     rows = db.execute(select(ItemUnit).where(ItemUnit.id.in_(ids))).scalars().all()
@@ -790,35 +986,31 @@ def issue_units(db: Session, unit_ids: Iterable[int], co_code: str, note: str, a
     total = 0
     for (item_id, po_id), units in by_item_po.items():
         item = db.get(Item, item_id)
-        k = len(units)
-        total += k
-        # endre status
+        po = db.get(PurchaseOrder, po_id) if po_id else None
+        # endre status (“forbrukt til” CO); husk hvor enhetene kom fra
+        free = 0                                   # ledige
+        held: Dict[Optional[int], int] = defaultdict(int)  # reservert, pr CO
+        picked = {u.id: _picked(u, qtys) for u in units}
         for u in units:
-            u.status = "used"
-            u.used_at = datetime.utcnow()
-            u.reserved_co_id = co.id  # “forbrukt til” CO
-        # trekk fra lager
-        item.qty = max(0, (item.qty or 0) - k)
-        item.last_updated = datetime.utcnow()
-        # oppdater CO-linje
+            if u.status == "reserved":
+                held[u.reserved_co_id] += picked[u.id]
+            else:
+                free += picked[u.id]
+        lots.move(db, units, sum(picked.values()), lots.is_lot(item), picked,
+                  status="used", used_at=datetime.utcnow(), reserved_co_id=co.id)
+        total += free + sum(held.values())
+        # Reservert til denne CO-en -> utlevert; reservert til en annen frigis der først og tas så fra ledig
         line = ensure_line(db, co, item)
-        line.qty_fulfilled = (line.qty_fulfilled or 0) + k
-        line.qty_reserved = max(0, (line.qty_reserved or 0) - k)
-        # audit (delta=-k)
-        db.add_all([
-            item,
-            Tx(
-                item_id=item.id, sku=item.sku, name=item.name, delta=-k,
-                note=(note or "Uttak") + f" (CO {co.code}" + (f", PO {db.get(PurchaseOrder, po_id).code}" if po_id else "") + ")",
-                co_id=co.id, po_id=po_id,
-                user_id=(actor.id if actor else None), user_name=(actor.name if actor else None),
-            )
-        ])
-    db.commit()
+        label = (note or "Uttak") + f" (CO {co.code}" + (f", PO {po.code}" if po else "") + ")"
+        mine = held.pop(co.id, 0)
+        if mine:
+            ledger.record(db, "fulfill", item, mine, note=label, actor=actor, co=co, po=po, line=line)
+        for other_id, n in held.items():
+            other = db.get(CustomerOrder, other_id) if other_id else None
+            ledger.record(db, "release", item, n, note=f"Frigitt {n} stk til uttak på {co.code}", actor=actor,
+                          co=other, line=(find_line(db, other, item) if other else None))
+            free += n
+        if free:
+            ledger.record(db, "issue", item, free, note=label, actor=actor, co=co, po=po, line=line)
+    db.flush()
     return total
-
-def unit_counts(db: Session, item: Item) -> Tuple[int,int,int]:
-    total_avail = db.execute(select(func.count(ItemUnit.id)).where(ItemUnit.item_id==item.id, ItemUnit.status=="available")).scalar() or 0
-    total_res = db.execute(select(func.count(ItemUnit.id)).where(ItemUnit.item_id==item.id, ItemUnit.status=="reserved")).scalar() or 0
-    total_used = db.execute(select(func.count(ItemUnit.id)).where(ItemUnit.item_id==item.id, ItemUnit.status=="used")).scalar() or 0
-    return int(total_avail), int(total_res), int(total_used)
@@ -0,0 +1,83 @@
+# app/events.py
+"""SSE-kanalen (/stream/tx): én kø pr lytter.
+
+Rutene publiserer fra event-loopen med `await bcast.publish(...)`. Kode som
+kjører i tråder (bakgrunnsjobber) bruker `bcast.publish_threadsafe(...)`,
+som legger eventet over til loopen appen startet på. Hendelser om endringer
+som ennå ikke er committet legges på sesjonen med
+`bcast.publish_on_commit(db, ...)` og sendes når transaksjonen er committet
+(forkastes ved rollback).
+
+Med flere prosesser setter bus.py `relay`: hendelser publisert her sendes da
+også til de andre prosessene, og deres hendelser leveres lokalt med
+`deliver_threadsafe()` (uten å sendes videre igjen).
+"""
+import asyncio
+from typing import Callable, List, Optional
+
+from sqlalchemy import event as sa_event
+from sqlalchemy.orm import Session
+
+
+class Broadcaster:
+    def __init__(self):
+        self.listeners: List[asyncio.Queue] = []
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.relay: Optional[Callable[[dict], None]] = None
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+
+    async def deliver(self, event: dict):
+        for q in list(self.listeners):
+            try:
+                await q.put(event)
+            except Exception:
+                pass
+
+    async def publish(self, event: dict):
+        await self.deliver(event)
+        if self.relay is not None:
+            asyncio.get_running_loop().run_in_executor(None, self.relay, event)
+
+    def publish_threadsafe(self, event: dict) -> None:
+        if self.relay is not None:
+            self.relay(event)
+        self.deliver_threadsafe(event)
+
+    def deliver_threadsafe(self, event: dict) -> None:
+        loop = self.loop
+        if loop is None or loop.is_closed() or not self.listeners:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.deliver(event), loop)
+        except RuntimeError:  # loopen er i ferd med å stenge
+            pass
+
+    def publish_on_commit(self, db: Session, event: dict) -> None:
+        db.info.setdefault("_sse", []).append(event)
+
+    async def subscribe(self) -> asyncio.Queue:
+        q = asyncio.Queue()
+        self.listeners.append(q)
+        return q
+
+    def unsubscribe(self, q: asyncio.Queue):
+        try:
+            self.listeners.remove(q)
+        except ValueError:
+            pass
+
+
+bcast = Broadcaster()
+
+
+@sa_event.listens_for(Session, "after_commit")
+def _send_committed(session):
+    for ev in session.info.pop("_sse", ()):
+        bcast.publish_threadsafe(ev)
+
+
+@sa_event.listens_for(Session, "after_rollback")
+def _drop_uncommitted(session):
+    session.info.pop("_sse", None)
@@ -0,0 +1,154 @@
+# app/feed.py
+"""Endringsstrøm for eksterne systemer (ERP): `/api/changes?since=<seq>`.
+
+Triggere (migrering 010) skriver én rad i `change_log` for hver rad som endres
+i items, item_units, purchase_orders og customer_orders. Det er INSERT OR
+REPLACE på (tabell, id), så hver rad står der bare én gang, med sekvensnummeret
+fra siste endring – loggen vokser med antall rader, ikke antall endringer.
+Linjer (PO/CO) og lagertall (item_stock) logges på forelderen, så en
+reservasjon gir en ny versjon av varen.
+
+En klient starter med since=0 (alt som finnes, side for side), tar vare på
+`next` fra siste linje og spør med den neste gang. Svaret er NDJSON: én linje
+pr rad (`{"seq", "table", "op", "id", "data"}`) og til slutt
+`{"next": seq, "more": bool}`. Slettede rader kommer med op "delete" uten data.
+Triggerne fanger også bulk-UPDATE og rå SQL (lots.compact, ledger rebuild).
+"""
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+
+from .models import (Category, CustomerOrder, CustomerOrderLine, Item, ItemStock, ItemUnit, Location,
+                     PurchaseOrder, PurchaseOrderLine)
+
+PAGE = 1000
+MAX_PAGE = 5000
+
+# Tabell i strømmen -> [(kildetabell, kolonne med id-en til raden i strømmen)]
+TRACKED: Dict[str, List[Tuple[str, str]]] = {
+    "items": [("items", "id"), ("item_stock", "item_id")],
+    "item_units": [("item_units", "id")],
+    "purchase_orders": [("purchase_orders", "id"), ("purchase_order_lines", "po_id")],
+    "customer_orders": [("customer_orders", "id"), ("customer_order_lines", "co_id")],
+}
+
+def _log(feed: str, ref: str, op: str, need_parent: bool = False) -> str:
+    # DELETE + INSERT i stedet for OR REPLACE: inne i en trigger gjelder konfliktregelen
+    # til den ytre setningen, og en UPSERT (ledger.record) ville da feilet på UNIQUE
+    cond = f"EXISTS (SELECT 1 FROM {feed} WHERE id = {ref})" if need_parent else "1"
+    return (f"DELETE FROM change_log WHERE tbl = '{feed}' AND row_id = {ref} AND {cond}; "
+            f"INSERT INTO change_log (tbl, row_id, op) SELECT '{feed}', {ref}, '{op}' WHERE {cond};")
+
+
+def trigger_sql() -> List[str]:
+    """CREATE TRIGGER-setningene for alle sporede tabeller (brukes av migreringen)."""
+    out = []
+    for feed, sources in TRACKED.items():
+        for src, col in sources:
+            for ev, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+                if src == feed:
+                    body = _log(feed, f"{row}.id", "delete" if ev == "DELETE" else "upsert")
+                else:
+                    # Forelderen kan være slettet i samme setning (cascade) – da logges ingenting
+                    body = _log(feed, f"{row}.{col}", "upsert", need_parent=True)
+                out.append(f"CREATE TRIGGER IF NOT EXISTS trg_feed_{src}_{ev.lower()} "
+                           f"AFTER {ev} ON {src} BEGIN {body} END")
+    return out
+
+
+def seed(execute) -> int:
+    """Alle eksisterende rader inn i loggen, så since=0 gir hele katalogen."""
+    n = 0
+    for feed in TRACKED:
+        n += execute(f"INSERT OR REPLACE INTO change_log (tbl, row_id, op) "
+                     f"SELECT '{feed}', id, 'upsert' FROM {feed} ORDER BY id", ()).rowcount
+    return n
+
+
+# ------------------------------------------------------------
+# Lesing
+# ------------------------------------------------------------
+def _items(db: Session, ids: List[int]) -> Dict[int, dict]:
+    rows = db.execute(
+        select(Item, Category.name, Location.name, ItemStock.available, ItemStock.reserved, ItemStock.used)
+        .outerjoin(Category, Category.id == Item.category_id)
+        .outerjoin(Location, Location.id == Item.location_id)
+        .outerjoin(ItemStock, ItemStock.item_id == Item.id)
+        .where(Item.id.in_(ids))
+    ).all()
+    # Samme nøkler som /export.json, pluss sporing og lagertall
+    return {i.id: {
+        "name": i.name, "sku": i.sku, "qty": i.qty, "minQty": i.min_qty, "price": i.price, "currency": i.currency,
+        "category": cat or "", "location": loc or "", "notes": i.notes, "image": i.image_path,
+        "tracking": i.tracking, "available": a or 0, "reserved": r or 0, "used": u or 0,
+        "lastUpdated": i.last_updated,
+    } for i, cat, loc, a, r, u in rows}
+
+
+def _units(db: Session, ids: List[int]) -> Dict[int, dict]:
+    rows = db.execute(select(ItemUnit).where(ItemUnit.id.in_(ids))).scalars()
+    return {u.id: {
+        "itemId": u.item_id, "poId": u.po_id, "coId": u.reserved_co_id, "status": u.status, "qty": u.qty,
+        "barcode": u.barcode, "serial": u.serial, "purchasePrice": u.purchase_price,
+        "createdAt": u.created_at, "usedAt": u.used_at,
+    } for u in rows}
+
+
+def _pos(db: Session, ids: List[int]) -> Dict[int, dict]:
+    lines = defaultdict(list)
+    for l in db.execute(select(PurchaseOrderLine).where(PurchaseOrderLine.po_id.in_(ids)).order_by(PurchaseOrderLine.id)).scalars():
+        lines[l.po_id].append({"id": l.id, "itemId": l.item_id, "qtyOrdered": l.qty_ordered, "qtyReceived": l.qty_received})
+    return {p.id: {
+        "code": p.code, "supplier": p.supplier, "archived": bool(p.archived), "createdAt": p.created_at,
+        "lines": lines.get(p.id, []),
+    } for p in db.execute(select(PurchaseOrder).where(PurchaseOrder.id.in_(ids))).scalars()}
+
+
+def _cos(db: Session, ids: List[int]) -> Dict[int, dict]:
+    lines = defaultdict(list)
+    for l in db.execute(select(CustomerOrderLine).where(CustomerOrderLine.co_id.in_(ids)).order_by(CustomerOrderLine.id)).scalars():
+        lines[l.co_id].append({"id": l.id, "itemId": l.item_id, "qty": l.qty, "qtyReserved": l.qty_reserved,
+                               "qtyFulfilled": l.qty_fulfilled, "notes": l.notes})
+    return {c.id: {
+        "code": c.code, "customerId": c.customer_id, "status": c.status, "notes": c.notes, "createdAt": c.created_at,
+        "lines": lines.get(c.id, []),
+    } for c in db.execute(select(CustomerOrder).where(CustomerOrder.id.in_(ids))).scalars()}
+
+
+_LOADERS = {"items": _items, "item_units": _units, "purchase_orders": _pos, "customer_orders": _cos}
+
+
+def page(db: Session, since: int, limit: int = PAGE) -> Tuple[List[dict], int, bool]:
+    """(linjer, neste since, flere?) – endringer etter `since`, i sekvensrekkefølge.
+
+    Leses i én eksplisitt lesetransaksjon, så radene hentes fra samme øyeblikksbilde som loggen.
+    """
+    limit = max(1, min(int(limit), MAX_PAGE))
+    since = max(0, int(since))
+    # pysqlite starter ingen transaksjon for SELECT – uten BEGIN får hver spørring sitt eget
+    # øyeblikksbilde, og en rad kunne kommet med nyere data enn seq-en den står under
+    conn = db.connection()
+    if not conn.connection.dbapi_connection.in_transaction:
+        conn.exec_driver_sql("BEGIN")
+    log = db.execute(
+        text("SELECT seq, tbl, row_id, op FROM change_log WHERE seq > :since ORDER BY seq LIMIT :n"),
+        {"since": since, "n": limit + 1},
+    ).all()
+    more = len(log) > limit
+    log = log[:limit]
+
+    wanted: Dict[str, List[int]] = defaultdict(list)
+    for _, tbl, row_id, op in log:
+        if op != "delete":
+            wanted[tbl].append(row_id)
+    data = {tbl: _LOADERS[tbl](db, ids) for tbl, ids in wanted.items()}
+
+    out = []
+    for seq, tbl, row_id, op in log:
+        row = data.get(tbl, {}).get(row_id)
+        if op != "delete" and row is None:
+            op = "delete"
+        out.append({"seq": seq, "table": tbl, "op": op, "id": row_id, **({"data": row} if op != "delete" else {})})
+    return out, (log[-1][0] if log else since), more
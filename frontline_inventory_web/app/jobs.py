@@ -0,0 +1,362 @@
+# app/jobs.py
+"""Bakgrunnsjobber lagret i SQLite (`jobs`-tabellen).
+
+Lange operasjoner (import, sletting av kunde med mange ordre) legges i kø
+med `submit()` og kjøres av en liten trådpool som startes fra lifespan.
+Ruten svarer straks med jobb-id; fremdrift sendes som `{"type": "job", ...}`
+på SSE-kanalen (/stream/tx) og lagres i tabellen, så status overlever en
+omstart.
+
+En handler registreres med `@handler("navn")` og kalles som
+`fn(ctx, payload)`. Den bruker `ctx.db` (egen sesjon), melder fremdrift med
+`ctx.progress()` og kaller `ctx.check_cancel()` jevnlig – helst mellom
+commits, siden fremdriften skrives i en egen transaksjon. crud-funksjonene
+committer ikke; handleren committer selv mellom stegene, og det som
+gjenstår committes når den returnerer. Returverdien (JSON) lagres som
+resultat. Feiler jobben, prøves den på nytt med økende ventetid til
+`max_attempts` er brukt opp.
+
+Handlere som committer i biter bruker `ctx.checkpoint(n)` i stedet for
+`progress()`: fremdriften skrives da i samme transaksjon som arbeidet, og
+neste forsøk (nytt forsøk, «Prøv igjen» eller etter en omstart) begynner på
+`ctx.resume_from` i stedet for på nytt.
+
+`submit()`, `cancel()` og `retry()` endrer bare i rutens sesjon (flush);
+ruten committer, og hendelsen sendes og arbeiderne vekkes først etter commit.
+
+Flere prosesser kan kjøre hver sin pool mot samme tabell: en jobb tas med en
+betinget UPDATE, og jobber som kjører får `heartbeat_at` oppdatert jevnlig.
+Jobber som står som 'running' uten hjerteslag (prosessen døde) legges i kø
+igjen av den neste som ser etter.
+"""
+import json
+import os
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from typing import Callable, Dict, NamedTuple, Optional
+
+from sqlalchemy import event as sa_event, func, select, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from .db import SessionLocal
+from .events import bcast
+from .models import Job, User
+
+WORKERS = int(os.environ.get("INV_JOB_WORKERS", "2"))
+POLL_S = 2.0
+PROGRESS_EVERY_S = 0.5
+HEARTBEAT_S = 15
+STALE_S = 90
+
+
+class Handler(NamedTuple):
+    fn: Callable
+    max_attempts: int
+
+
+HANDLERS: Dict[str, Handler] = {}
+
+
+def handler(kind: str, max_attempts: int = 1):
+    def deco(fn):
+        HANDLERS[kind] = Handler(fn, max_attempts)
+        return fn
+    return deco
+
+
+class Cancelled(Exception):
+    pass
+
+
+def as_dict(job: Job) -> dict:
+    def load(v):
+        try:
+            return json.loads(v) if v else None
+        except ValueError:
+            return v
+    return {
+        "id": job.id, "kind": job.kind, "status": job.status,
+        "progress": job.progress or 0, "total": job.total or 0, "message": job.message or "",
+        "result": load(job.result), "error": job.error or "",
+        "attempts": job.attempts or 0, "max_attempts": job.max_attempts or 1,
+        "cancel_requested": bool(job.cancel_requested),
+        "user_name": job.user_name or "",
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def _publish(job: Job) -> None:
+    bcast.publish_threadsafe({"type": "job", **as_dict(job)})
+
+
+def _publish_on_commit(db: Session, job: Job, wake: bool = False) -> None:
+    db.flush()
+    bcast.publish_on_commit(db, {"type": "job", **as_dict(job)})
+    if wake:
+        db.info["_jobs_wake"] = True
+
+
+@sa_event.listens_for(Session, "after_commit")
+def _wake_after_commit(session):
+    # Jobben er ikke synlig for arbeiderne før rutens transaksjon er committet
+    if session.info.pop("_jobs_wake", False):
+        runner.wake()
+
+
+@sa_event.listens_for(Session, "after_rollback")
+def _forget_wake(session):
+    session.info.pop("_jobs_wake", None)
+
+
+# ------------------------------------------------------------
+# API for rutene
+# ------------------------------------------------------------
+def submit(db: Session, kind: str, payload: dict, actor: Optional[User] = None,
+           max_attempts: Optional[int] = None, total: int = 0) -> Job:
+    if kind not in HANDLERS:
+        raise ValueError(f"ukjent jobbtype: {kind}")
+    job = Job(
+        kind=kind, status="queued", payload=json.dumps(payload, ensure_ascii=False),
+        max_attempts=max_attempts or HANDLERS[kind].max_attempts, total=total, message="I kø",
+        user_id=(actor.id if actor else None), user_name=(actor.name if actor else ""),
+    )
+    db.add(job)
+    _publish_on_commit(db, job, wake=True)
+    return job
+
+
+def cancel(db: Session, job: Job) -> Job:
+    """Jobb i kø avbrytes straks; en jobb som kjører stopper ved neste check_cancel()."""
+    if job.status == "queued":
+        job.status, job.message, job.finished_at = "cancelled", "Avbrutt", datetime.utcnow()
+    elif job.status == "running":
+        job.cancel_requested = True
+        job.message = "Avbryter …"
+    _publish_on_commit(db, job)
+    return job
+
+
+def retry(db: Session, job: Job) -> Job:
+    if job.status in ("failed", "cancelled"):
+        job.status, job.attempts, job.error, job.cancel_requested = "queued", 0, "", False
+        job.run_after, job.finished_at, job.message = datetime.utcnow(), None, "I kø (ny runde)"
+        _publish_on_commit(db, job, wake=True)
+    return job
+
+
+# ------------------------------------------------------------
+# Kjøring
+# ------------------------------------------------------------
+class JobContext:
+    def __init__(self, job: Job, db: Session):
+        self.job_id = job.id
+        self.kind = job.kind
+        self.db = db
+        self.actor = db.get(User, job.user_id) if job.user_id else None
+        self._total = job.total or 0
+        # Siste checkpoint() fra et tidligere forsøk (0 for en ny jobb)
+        self.resume_from = job.progress or 0
+        self._last = 0.0
+        self._last_cancel_check = 0.0
+
+    def progress(self, done: int, total: Optional[int] = None, message: Optional[str] = None, force: bool = False) -> None:
+        if total is not None:
+            self._total = total
+        now = time.monotonic()
+        if not force and now - self._last < PROGRESS_EVERY_S:
+            return
+        self._last = now
+        values = {"progress": int(done), "total": int(self._total), "heartbeat_at": datetime.utcnow()}
+        if message is not None:
+            values["message"] = message[:300]
+        _write(self.job_id, **values)
+
+    def checkpoint(self, done: int, message: Optional[str] = None) -> None:
+        """Lagrer fremdriften i handlerens transaksjon og committer – alt til og med `done` er gjort."""
+        values = {"progress": int(done), "total": int(self._total), "heartbeat_at": datetime.utcnow()}
+        if message is not None:
+            values["message"] = message[:300]
+        self.db.execute(update(Job).where(Job.id == self.job_id).values(**values))
+        self.db.commit()
+        job = self.db.get(Job, self.job_id)
+        if job is not None:
+            _publish(job)
+
+    def check_cancel(self) -> None:
+        now = time.monotonic()
+        if now - self._last_cancel_check < 0.5:
+            return
+        self._last_cancel_check = now
+        # Leses på handlerens egen forbindelse: en ny sesjon midt i en skrivetransaksjon ville ventet
+        # på poolen mens vi holder skrivelåsen – og requestene som har poolen, venter på låsen.
+        # Et avbrudd satt etter at transaksjonen startet, sees derfor først etter neste commit.
+        flag = self.db.execute(select(Job.cancel_requested).where(Job.id == self.job_id)).scalar()
+        if flag:
+            raise Cancelled()
+
+
+def _write(job_id: int, **values) -> Optional[Job]:
+    """Oppdaterer jobbraden i en egen, kort transaksjon og publiserer ny status."""
+    db = SessionLocal()
+    try:
+        db.execute(update(Job).where(Job.id == job_id).values(**values))
+        db.commit()
+        job = db.get(Job, job_id)
+        if job is not None:
+            _publish(job)
+        return job
+    except OperationalError as e:  # fremdrift er ikke viktig nok til å velte jobben
+        db.rollback()
+        print(f"[jobs] kunne ikke oppdatere jobb {job_id}: {e!r}")
+        return None
+    finally:
+        db.close()
+
+
+def _claim() -> Optional[int]:
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        job_id = db.execute(
+            select(Job.id).where(Job.status == "queued", Job.run_after <= now).order_by(Job.id).limit(1)
+        ).scalar()
+        if job_id is None:
+            return None
+        res = db.execute(
+            update(Job).where(Job.id == job_id, Job.status == "queued")
+            .values(status="running", attempts=Job.attempts + 1, started_at=now, heartbeat_at=now, message="Starter")
+        )
+        db.commit()
+        return job_id if res.rowcount == 1 else None  # en annen tråd rakk den først
+    finally:
+        db.close()
+
+
+def _run(job_id: int) -> None:
+    db = SessionLocal()
+    try:
+        job = db.get(Job, job_id)
+        _publish(job)
+        h = HANDLERS.get(job.kind)
+        attempts, max_attempts = job.attempts, job.max_attempts or 1
+        try:
+            if h is None:
+                raise RuntimeError(f"ingen handler for jobbtype {job.kind!r}")
+            ctx = JobContext(job, db)
+            result = h.fn(ctx, json.loads(job.payload or "{}"))
+            db.commit()
+        except Cancelled:
+            db.rollback()
+            _write(job_id, status="cancelled", message="Avbrutt", finished_at=datetime.utcnow())
+            return
+        except Exception as e:
+            db.rollback()
+            tb = traceback.format_exc(limit=6)
+            if attempts < max_attempts:
+                wait = min(300, 5 * 2 ** (attempts - 1))
+                print(f"[jobs] {job.kind} #{job_id} feilet (forsøk {attempts}/{max_attempts}), prøver igjen om {wait} s: {e!r}")
+                _write(job_id, status="queued", error=tb, message=f"Feilet – nytt forsøk om {wait} s",
+                       run_after=datetime.utcnow() + timedelta(seconds=wait))
+            else:
+                print(f"[jobs] {job.kind} #{job_id} feilet: {e!r}")
+                _write(job_id, status="failed", error=tb, message=str(e)[:300] or "Feilet", finished_at=datetime.utcnow())
+            return
+        _write(job_id, status="done", result=json.dumps(result, ensure_ascii=False, default=str),
+               message="Ferdig", progress=func.max(Job.progress, Job.total), finished_at=datetime.utcnow())
+    finally:
+        db.close()
+
+
+class Runner:
+    def __init__(self):
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads: list = []
+        self._running: set = set()
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def start(self, workers: int = WORKERS) -> None:
+        if self._threads or workers <= 0:
+            return
+        recover()
+        self._stop.clear()
+        for i in range(workers):
+            t = threading.Thread(target=self._loop, name=f"job-worker-{i + 1}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        t = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                job_id = _claim()
+            except OperationalError as e:
+                print(f"[jobs] kø utilgjengelig: {e!r}")
+                job_id = None
+            if job_id is None:
+                self._wake.wait(POLL_S)
+                self._wake.clear()
+                continue
+            self._running.add(job_id)
+            try:
+                _run(job_id)
+            finally:
+                self._running.discard(job_id)
+
+    def _heartbeat(self) -> None:
+        while not self._stop.wait(HEARTBEAT_S):
+            try:
+                running = list(self._running)
+                if running:
+                    _beat(running)
+                if recover():
+                    self.wake()
+            except OperationalError as e:
+                print(f"[jobs] hjerteslag feilet: {e!r}")
+
+
+def _beat(job_ids: list) -> None:
+    db = SessionLocal()
+    try:
+        db.execute(update(Job).where(Job.id.in_(job_ids), Job.status == "running").values(heartbeat_at=datetime.utcnow()))
+        db.commit()
+    finally:
+        db.close()
+
+
+def recover(stale_s: float = STALE_S) -> int:
+    """Jobber som står som 'running' uten hjerteslag (prosessen stoppet): legg i kø igjen eller marker som feilet."""
+    cutoff = datetime.utcnow() - timedelta(seconds=stale_s)
+    db = SessionLocal()
+    try:
+        rows = db.execute(
+            select(Job).where(Job.status == "running", (Job.heartbeat_at.is_(None)) | (Job.heartbeat_at < cutoff))
+        ).scalars().all()
+        for job in rows:
+            if (job.attempts or 0) < (job.max_attempts or 1):
+                job.status, job.message = "queued", "Lagt i kø igjen (prosessen stoppet)"
+            else:
+                job.status, job.message, job.finished_at = "failed", "Avbrutt – prosessen stoppet", datetime.utcnow()
+        db.commit()
+        return len(rows)
+    finally:
+        db.close()
+
+
+runner = Runner()
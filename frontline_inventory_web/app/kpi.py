@@ -0,0 +1,71 @@
+# app/kpi.py
+"""Nøkkeltall for dashboard og mobil-fliser.
+
+Alle tellere beregnes i én spørring (SUM(CASE ...) over item_units + to
+skalare delspørringer mot items/item_stock) og caches på versjonsnummeret
+til `items`, `item_units` og `item_stock` fra changes.py. Enhver commit som
+endrer en av tabellene gir nytt versjonsnummer, så neste kall regner ut på nytt.
+"""
+import threading
+from typing import Optional, Tuple
+
+from sqlalchemy import case, exists, func, select
+from sqlalchemy.orm import Session
+
+from . import changes
+from .models import Item, ItemStock, ItemUnit
+
+AVAILABLE = ("available", "ledig")
+RESERVED = ("reserved", "reservert")
+USED = ("used", "brukt")
+
+_lock = threading.Lock()
+_cache: Tuple[Optional[tuple], dict] = (None, {})
+
+
+def version() -> tuple:
+    return changes.version("items"), changes.version("item_units"), changes.version("item_stock")
+
+
+def version_tag() -> str:
+    return "kpi-%d-%d-%d" % version()
+
+
+def has_available():
+    """EXISTS-uttrykk: varen har minst én ledig enhet (brukes også med filter i dashboardet)."""
+    return exists().where(ItemStock.item_id == Item.id, ItemStock.available > 0)
+
+
+def compute(db: Session) -> dict:
+    total_items = select(func.count(Item.id)).scalar_subquery()
+    low_count = select(func.count(Item.id)).where(~has_available()).scalar_subquery()
+    row = db.execute(
+        select(
+            total_items.label("total_items"),
+            low_count.label("low_count"),
+            func.coalesce(func.sum(case((ItemUnit.status.in_(AVAILABLE), ItemUnit.qty), else_=0)), 0).label("total_available"),
+            func.coalesce(func.sum(case((ItemUnit.status.in_(RESERVED), ItemUnit.qty), else_=0)), 0).label("total_reserved"),
+            func.coalesce(func.sum(case((ItemUnit.status.in_(USED), ItemUnit.qty), else_=0)), 0).label("total_used"),
+            # Lagerverdi = innkjøpspris for enheter som ikke er brukt (pr rad: pris × antall)
+            func.coalesce(func.sum(case((ItemUnit.status.in_(AVAILABLE + RESERVED), ItemUnit.purchase_price * ItemUnit.qty), else_=0)), 0).label("total_value"),
+        ).select_from(ItemUnit)
+    ).one()
+    out = dict(row._mapping)
+    out["total_value"] = float(out["total_value"] or 0.0)
+    return {k: (v if k == "total_value" else int(v or 0)) for k, v in out.items()}
+
+
+def get(db: Session) -> dict:
+    global _cache
+    v = version()
+    cached_v, data = _cache
+    if cached_v == v:
+        return data
+    with _lock:
+        cached_v, data = _cache
+        if cached_v == v:
+            return data
+        data = compute(db)
+        # Endret noe mens vi regnet? Da lagrer vi under den gamle versjonen, så neste kall regner på nytt
+        _cache = (v, data)
+        return data
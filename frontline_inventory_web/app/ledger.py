@@ -0,0 +1,379 @@
+# app/ledger.py
+"""Lagerboka: `transactions` som append-only logg med typede hendelser.
+
+Hver lagerbevegelse skrives som én Tx med `kind` og `qty` (antall enheter)
+via `record()`, som oppdaterer projeksjonene i samme transaksjon:
+
+- `items.qty`                      – beholdning (summen av delta)
+- `item_stock`                     – ledige/reserverte/brukte enheter pr vare
+- `customer_order_lines.qty_reserved / qty_fulfilled`
+
+Hendelsene endres ikke i etterkant (bare koblingene nulles når en vare eller
+CO slettes), så projeksjonene kan alltid regnes ut på nytt: åpningsbalansen
+i `ledger_opening` (fra migrering 009, pluss hendelser som er flyttet til
+arkivet) + hendelsene i `transactions`. `rebuild()` gjør det med GROUP BY over
+BATCH hendelser av gangen; `check()` sammenligner projeksjonene med
+hendelsene og med radene i item_units uten å skrive noe.
+
+    python -m app.ledger check
+    python -m app.ledger rebuild [--batch N]
+
+Alle summer holdes pr (vare, CO) – co_id 0 er uten CO. Varens tall er summen
+over alle CO-er; en CO-linje er reservert/brukt i sin egen bøtte.
+"""
+import argparse
+import sqlite3
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from .models import CustomerOrder, CustomerOrderLine, Item, ItemStock, ItemUnit, LedgerOpening, PurchaseOrder, Tx, User
+
+# Endring i (ledig, reservert, brukt) pr enhet i `qty`
+KINDS: Dict[str, Tuple[int, int, int]] = {
+    "receive": (1, 0, 0),     # mottak
+    "unreceive": (-1, 0, 0),  # angret mottak
+    "reserve": (-1, 1, 0),
+    "release": (1, -1, 0),
+    "issue": (-1, 0, 1),      # uttak av ledige enheter
+    "fulfill": (0, -1, 1),    # uttak av enheter reservert til samme CO
+    "return": (1, 0, -1),     # tilbakeført uttak
+    "adjust": (0, 0, 0),      # manuell endring av beholdningen – bare delta
+    "note": (0, 0, 0),        # revisjonsspor uten lagereffekt
+}
+# Beholdningen følger enhetene for disse; for "adjust" oppgis delta direkte
+_SIGN = {"receive": 1, "unreceive": -1, "issue": -1, "fulfill": -1, "return": 1}
+LEGACY = "legacy"  # rader fra før migrering 009 – de står allerede i åpningsbalansen
+BATCH = 50000
+
+_AVAILABLE = ("available", "ledig")
+_RESERVED = ("reserved", "reservert")
+_USED = ("used", "brukt")
+
+
+def effects(kind: Optional[str], qty: Optional[int], delta: Optional[int]) -> Tuple[int, int, int, int]:
+    """(beholdning, ledig, reservert, brukt) for én hendelse – samme regler som SQL-en i rebuild()."""
+    if kind is None or kind == LEGACY:
+        return 0, 0, 0, 0
+    a, r, u = KINDS.get(kind, (0, 0, 0))
+    n = int(qty or 0)
+    return int(delta or 0), a * n, r * n, u * n
+
+
+# ------------------------------------------------------------
+# Skriving (fra crud)
+# ------------------------------------------------------------
+def record(
+    db: Session,
+    kind: str,
+    item: Item,
+    qty: int = 0,
+    note: str = "",
+    actor: Optional[User] = None,
+    co: Optional[CustomerOrder] = None,
+    po: Optional[PurchaseOrder] = None,
+    unit: Optional[ItemUnit] = None,
+    delta: Optional[int] = None,
+    line: Optional[CustomerOrderLine] = None,
+    ts: Optional[datetime] = None,
+) -> Tx:
+    """Skriver én hendelse og oppdaterer projeksjonene.
+
+    `delta` utledes av `kind` og `qty`; bare "adjust" tar den inn. `line` er
+    CO-linjen som skal følge med (kalleren har den fra `ensure_line`).
+    """
+    a, r, u = KINDS[kind]
+    qty = int(qty)
+    if delta is None:
+        delta = _SIGN.get(kind, 0) * qty
+    tx = Tx(
+        kind=kind, qty=qty, item_id=item.id, sku=item.sku, name=item.name, delta=int(delta), note=note or "",
+        user_id=(actor.id if actor else None), user_name=(actor.name if actor else None),
+        co_id=(co.id if co else None), po_id=(po.id if po else None), unit_id=(unit.id if unit else None),
+        ts=ts or datetime.utcnow(),
+    )
+    db.add(tx)
+    if delta:
+        item.qty = (item.qty or 0) + int(delta)
+        item.last_updated = tx.ts
+    if qty and (a or r or u):
+        stmt = sqlite_insert(ItemStock).values(item_id=item.id, available=a * qty, reserved=r * qty, used=u * qty)
+        db.execute(stmt.on_conflict_do_update(index_elements=[ItemStock.item_id], set_={
+            "available": ItemStock.available + stmt.excluded.available,
+            "reserved": ItemStock.reserved + stmt.excluded.reserved,
+            "used": ItemStock.used + stmt.excluded.used,
+        }))
+    if line is not None and qty and (r or u):
+        line.qty_reserved = (line.qty_reserved or 0) + r * qty
+        line.qty_fulfilled = (line.qty_fulfilled or 0) + u * qty
+    return tx
+
+
+def forget_item(db: Session, item_id: int) -> None:
+    """Varen slettes: hendelsene mister koblingen, så åpningsbalansen og projeksjonen går også."""
+    db.execute(delete(LedgerOpening).where(LedgerOpening.item_id == item_id))
+    db.execute(delete(ItemStock).where(ItemStock.item_id == item_id))
+
+
+_MERGE_CO = text(
+    "INSERT INTO ledger_opening (item_id, co_id, on_hand, available, reserved, used) "
+    "SELECT item_id, 0, on_hand, available, reserved, used FROM ledger_opening WHERE co_id = :co "
+    "ON CONFLICT(item_id, co_id) DO UPDATE SET on_hand = on_hand + excluded.on_hand, "
+    "available = available + excluded.available, reserved = reserved + excluded.reserved, used = used + excluded.used"
+)
+
+
+def forget_co(db: Session, co_id: int) -> None:
+    """CO slettes: hendelsene mister co_id, så åpningsbalansen flyttes til bøtta uten CO."""
+    db.execute(_MERGE_CO, {"co": co_id})
+    db.execute(delete(LedgerOpening).where(LedgerOpening.co_id == co_id))
+
+
+def reset(db: Session) -> None:
+    """Alle varer og hendelser er slettet (import som erstatter)."""
+    db.execute(delete(LedgerOpening))
+    db.execute(delete(ItemStock))
+
+
+def stock(db: Session, item_id: int) -> Tuple[int, int, int]:
+    """(ledig, reservert, brukt) for én vare – ett oppslag på primærnøkkel."""
+    row = db.get(ItemStock, item_id)
+    return (row.available or 0, row.reserved or 0, row.used or 0) if row else (0, 0, 0)
+
+
+# ------------------------------------------------------------
+# Åpningsbalanse og arkiv (rå sqlite3 / exec_driver_sql – kalleren eier transaksjonen)
+# ------------------------------------------------------------
+_OPENING_ADD = (
+    "INSERT INTO ledger_opening (item_id, co_id, on_hand, available, reserved, used) VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(item_id, co_id) DO UPDATE SET on_hand = on_hand + excluded.on_hand, "
+    "available = available + excluded.available, reserved = reserved + excluded.reserved, used = used + excluded.used"
+)
+
+
+def _in(values: tuple) -> str:
+    return "(" + ", ".join(f"'{v}'" for v in values) + ")"
+
+
+def open_balance(execute) -> int:
+    """Åpningsbalanse fra dagens tilstand (migrering 009): beholdning fra items, enheter fra item_units.
+
+    CO-linjene får tallene fra enhetene som er reservert/brukt til ordren.
+    Returnerer antall bøtter.
+    """
+    execute("DELETE FROM ledger_opening", ())
+    execute("INSERT INTO ledger_opening (item_id, co_id, on_hand, available, reserved, used) "
+            "SELECT id, 0, COALESCE(qty, 0), 0, 0, 0 FROM items", ())
+    execute(f"""
+        INSERT INTO ledger_opening (item_id, co_id, on_hand, available, reserved, used)
+        SELECT item_id,
+               CASE WHEN status IN {_in(_RESERVED + _USED)} THEN COALESCE(reserved_co_id, 0) ELSE 0 END AS co,
+               0,
+               SUM(CASE WHEN status IN {_in(_AVAILABLE)} THEN COALESCE(qty, 1) ELSE 0 END),
+               SUM(CASE WHEN status IN {_in(_RESERVED)} THEN COALESCE(qty, 1) ELSE 0 END),
+               SUM(CASE WHEN status IN {_in(_USED)} THEN COALESCE(qty, 1) ELSE 0 END)
+        FROM item_units
+        WHERE item_id IN (SELECT id FROM items)
+        GROUP BY item_id, co
+        ON CONFLICT(item_id, co_id) DO UPDATE SET available = available + excluded.available,
+            reserved = reserved + excluded.reserved, used = used + excluded.used
+    """, ())
+    return execute("SELECT COUNT(*) FROM ledger_opening", ()).fetchone()[0]
+
+
+def fold(execute, rows: Iterable[Tuple]) -> None:
+    """Legger hendelser som flyttes ut av `transactions` til åpningsbalansen.
+
+    `rows` er (item_id, co_id, kind, qty, delta). Kalles i samme transaksjon
+    som DELETE-en, så summen over balanse + hendelser er uendret.
+    """
+    acc: Dict[Tuple[int, int], List[int]] = defaultdict(lambda: [0, 0, 0, 0])
+    for item_id, co_id, kind, qty, delta in rows:
+        if item_id is None:
+            continue
+        eff = effects(kind, qty, delta)
+        if any(eff):
+            b = acc[(int(item_id), int(co_id or 0))]
+            for i, v in enumerate(eff):
+                b[i] += v
+    for (item_id, co_id), b in acc.items():
+        execute(_OPENING_ADD, (item_id, co_id, *b))
+
+
+# ------------------------------------------------------------
+# Ombygging og kontroll
+# ------------------------------------------------------------
+def _case(i: int) -> str:
+    return "CASE kind " + " ".join(f"WHEN '{k}' THEN {v[i]}" for k, v in KINDS.items() if v[i]) + " ELSE 0 END"
+
+
+_SUM_TABLE = """CREATE TEMP TABLE ledger_sum (
+    item_id INTEGER NOT NULL, co_id INTEGER NOT NULL,
+    on_hand INTEGER NOT NULL DEFAULT 0, available INTEGER NOT NULL DEFAULT 0,
+    reserved INTEGER NOT NULL DEFAULT 0, used INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (item_id, co_id))"""
+
+_REPLAY = f"""
+INSERT INTO temp.ledger_sum (item_id, co_id, on_hand, available, reserved, used)
+SELECT item_id, COALESCE(co_id, 0),
+       SUM(CASE WHEN kind IS NULL OR kind = '{LEGACY}' THEN 0 ELSE delta END),
+       SUM(COALESCE(qty, 0) * ({_case(0)})),
+       SUM(COALESCE(qty, 0) * ({_case(1)})),
+       SUM(COALESCE(qty, 0) * ({_case(2)}))
+FROM transactions
+WHERE id > ? AND id <= ? AND item_id IS NOT NULL
+GROUP BY item_id, COALESCE(co_id, 0)
+ON CONFLICT(item_id, co_id) DO UPDATE SET on_hand = on_hand + excluded.on_hand,
+    available = available + excluded.available, reserved = reserved + excluded.reserved, used = used + excluded.used
+"""
+
+# Forventede tall pr vare og pr CO-linje fra temp.ledger_sum
+_WANT_ITEM = "(SELECT COALESCE(SUM({col}), 0) FROM temp.ledger_sum s WHERE s.item_id = {ref})"
+_WANT_LINE = ("COALESCE((SELECT {col} FROM temp.ledger_sum s "
+              "WHERE s.item_id = customer_order_lines.item_id AND s.co_id = customer_order_lines.co_id), 0)")
+
+
+def _replay(execute, batch: int, progress=None) -> int:
+    """Bygger temp.ledger_sum = åpningsbalanse + alle hendelser. Returnerer antall hendelser lest."""
+    execute("DROP TABLE IF EXISTS temp.ledger_sum", ())
+    execute(_SUM_TABLE, ())
+    execute("INSERT INTO temp.ledger_sum (item_id, co_id, on_hand, available, reserved, used) "
+            "SELECT item_id, co_id, on_hand, available, reserved, used FROM ledger_opening", ())
+    total = execute("SELECT COUNT(*) FROM transactions", ()).fetchone()[0]
+    done, last = 0, -1
+    while True:
+        row = execute("SELECT MAX(id), COUNT(*) FROM (SELECT id FROM transactions WHERE id > ? ORDER BY id LIMIT ?)",
+                      (last, batch)).fetchone()
+        if row[0] is None:
+            break
+        execute(_REPLAY, (last, row[0]))
+        done, last = done + row[1], row[0]
+        if progress:
+            progress(f"  {done}/{total} hendelser")
+    return done
+
+
+def _write(execute) -> Dict[str, int]:
+    """Skriver temp.ledger_sum til projeksjonene. Returnerer antall rader som ble rettet pr tabell."""
+    want_qty = _WANT_ITEM.format(col="on_hand", ref="items.id")
+    items = execute(f"UPDATE items SET qty = {want_qty} WHERE qty IS NOT {want_qty}", ()).rowcount
+    stock = execute("DELETE FROM item_stock WHERE item_id NOT IN (SELECT id FROM items)", ()).rowcount
+    stock += execute("""
+        INSERT INTO item_stock (item_id, available, reserved, used)
+        SELECT i.id, COALESCE(SUM(s.available), 0), COALESCE(SUM(s.reserved), 0), COALESCE(SUM(s.used), 0)
+        FROM items i LEFT JOIN temp.ledger_sum s ON s.item_id = i.id
+        WHERE 1
+        GROUP BY i.id
+        ON CONFLICT(item_id) DO UPDATE SET available = excluded.available, reserved = excluded.reserved, used = excluded.used
+        WHERE available IS NOT excluded.available OR reserved IS NOT excluded.reserved OR used IS NOT excluded.used
+    """, ()).rowcount
+    res, ful = _WANT_LINE.format(col="reserved"), _WANT_LINE.format(col="used")
+    lines = execute(
+        f"UPDATE customer_order_lines SET qty_reserved = {res}, qty_fulfilled = {ful} "
+        f"WHERE qty_reserved IS NOT {res} OR qty_fulfilled IS NOT {ful}", ()
+    ).rowcount
+    return {"items": items, "item_stock": stock, "customer_order_lines": lines}
+
+
+def _diffs(execute, limit: int) -> List[tuple]:
+    """(hva, id, sku, projeksjon, hendelser, item_units) for alt som ikke stemmer."""
+    queries = [
+        ("items.qty", f"""
+            SELECT i.id, i.sku, i.qty, {_WANT_ITEM.format(col='on_hand', ref='i.id')}, NULL FROM items i
+            WHERE i.qty IS NOT {_WANT_ITEM.format(col='on_hand', ref='i.id')}"""),
+    ]
+    for col, statuses in (("available", _AVAILABLE), ("reserved", _RESERVED), ("used", _USED)):
+        units = (f"(SELECT COALESCE(SUM(COALESCE(qty, 1)), 0) FROM item_units u "
+                 f"WHERE u.item_id = i.id AND u.status IN {_in(statuses)})")
+        want = _WANT_ITEM.format(col=col, ref="i.id")
+        queries.append((f"item_stock.{col}", f"""
+            SELECT i.id, i.sku, COALESCE(st.{col}, 0), {want}, {units}
+            FROM items i LEFT JOIN item_stock st ON st.item_id = i.id
+            WHERE COALESCE(st.{col}, 0) != {want} OR {want} != {units}"""))
+    for field, col in (("qty_reserved", "reserved"), ("qty_fulfilled", "used")):
+        want = _WANT_LINE.format(col=col)
+        queries.append((f"customer_order_lines.{field}", f"""
+            SELECT customer_order_lines.id, COALESCE(i.sku, ''), customer_order_lines.{field}, {want}, NULL
+            FROM customer_order_lines LEFT JOIN items i ON i.id = customer_order_lines.item_id
+            WHERE customer_order_lines.{field} IS NOT {want}"""))
+    out: List[tuple] = []
+    for what, sql in queries:
+        for r in execute(sql + " LIMIT ?", (limit,)).fetchall():
+            out.append((what,) + tuple(r))
+    return out
+
+
+def _bump(execute, tables: Iterable[str]) -> None:
+    # Som changes.py: andre prosesser (bus.py) ser versjonen og laster cacher på nytt
+    for t in tables:
+        execute("INSERT INTO change_versions (table_name, version) VALUES (?, 1) "
+                "ON CONFLICT(table_name) DO UPDATE SET version = version + 1", (t,))
+
+
+def rebuild(execute, batch: int = BATCH, progress=None) -> Dict[str, int]:
+    """Regner ut projeksjonene på nytt fra åpningsbalansen og hendelsene.
+
+    `execute(sql, params)` som i lots.compact – kalleren eier transaksjonen
+    (bruk BEGIN IMMEDIATE, så ingen skriver imens). Returnerer rettede rader pr tabell.
+    """
+    events = _replay(execute, batch, progress)
+    fixed = _write(execute)
+    execute("DROP TABLE temp.ledger_sum", ())
+    _bump(execute, [t for t, n in fixed.items() if n])
+    return {"events": events, **fixed}
+
+
+def check(execute, batch: int = BATCH, limit: int = 100) -> List[tuple]:
+    """Avvik mellom projeksjonene, hendelsene og item_units (tom liste = alt stemmer). Skriver ingenting."""
+    _replay(execute, batch)
+    try:
+        return _diffs(execute, limit)
+    finally:
+        execute("DROP TABLE temp.ledger_sum", ())
+
+
+def _main() -> None:
+    from .db import DB_PATH
+
+    ap = argparse.ArgumentParser(prog="python -m app.ledger", description="Lagerboka: kontroll og ombygging av projeksjonene")
+    ap.add_argument("cmd", choices=("check", "rebuild"))
+    ap.add_argument("--batch", type=int, default=BATCH, help="hendelser pr GROUP BY")
+    ap.add_argument("--limit", type=int, default=100, help="maks avvik som vises pr kontroll")
+    args = ap.parse_args()
+
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    try:
+        t = time.perf_counter()
+        if args.cmd == "check":
+            conn.execute("BEGIN")  # ett konsistent øyeblikksbilde
+            try:
+                diffs = check(conn.execute, args.batch, args.limit)
+            finally:
+                conn.execute("ROLLBACK")
+            for what, ident, sku, have, want, units in diffs:
+                print(f"  {what:<36} #{ident:<8} {sku:<20} har {have}, hendelser gir {want}"
+                      + (f", item_units har {units}" if units is not None else ""))
+            print(("✅ Ingen avvik" if not diffs else f"⚠️  {len(diffs)} avvik") + f" ({time.perf_counter() - t:.1f} s)")
+            if diffs:
+                raise SystemExit(1)
+        else:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                res = rebuild(conn.execute, args.batch, progress=print)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            print(f"✅ {res['events']} hendelser spilt av på {time.perf_counter() - t:.1f} s – rettet: "
+                  f"{res['items']} varer, {res['item_stock']} lagertall, {res['customer_order_lines']} CO-linjer")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    _main()
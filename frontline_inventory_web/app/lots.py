@@ -0,0 +1,302 @@
+# app/lots.py
+"""Partier: én rad i item_units kan stå for flere like enheter (`qty`).
+
+Varer med `tracking = "lot"` lagres som én rad pr (vare, PO, innkjøpspris,
+status, CO) med antall, i stedet for én rad pr fysisk enhet. Serialiserte
+varer (`tracking = "unit"`, default) får fortsatt én rad med qty = 1 pr
+enhet.
+
+Statusoverganger går via `move()`. Skal hele raden over, endres bare
+statusen. Skal bare en del over, deles raden: resten blir stående, og
+antallet legges på en eksisterende rad med samme nøkkel (eller en ny).
+Tellinger og verdi bruker alltid SUM(qty), så kalleren trenger ikke vite
+hvilken type varen har.
+
+Rader med serienummer eller en annen strekkode enn sin egen (`U` + id) er
+én bestemt enhet og slås aldri sammen med andre – verken av `move()`,
+`add()` eller `compact()` – så identiteten ikke forsvinner.
+
+`compact()` slår sammen like rader for partivarer (migrering 007 og når en
+vare byttes til parti). `python -m app.lots compact --min-units N` gjør
+varer med minst N enhetsrader om til partier.
+"""
+import argparse
+import os
+import sqlite3
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, func, literal, or_, select, update
+from sqlalchemy.orm import Session
+
+from .models import Item, ItemUnit, Tx
+from .unitcodes import PREFIX, code_for
+
+TRACKING = ("unit", "lot")
+# Migrering 007 gjør varer med minst så mange enhetsrader om til partier (0 = ingen)
+AUTO_LOT_UNITS = int(os.environ.get("INV_LOT_AUTO_UNITS", "100"))
+
+Key = Tuple[Optional[int], Optional[int], float, str, Optional[int]]
+
+
+def is_lot(item: Optional[Item]) -> bool:
+    return bool(item is not None and item.tracking == "lot")
+
+
+def total(rows: Iterable[ItemUnit]) -> int:
+    return sum(u.qty or 1 for u in rows)
+
+
+def parse_selection(raw: str) -> Dict[int, Optional[int]]:
+    """"12,13:5" -> {12: None, 13: 5}. None = hele raden."""
+    out: Dict[int, Optional[int]] = {}
+    for part in (raw or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        uid, _, n = part.partition(":")
+        out[int(uid)] = int(n) if n.strip() else None
+    return out
+
+
+# ------------------------------------------------------------
+# Mottak og overganger
+# ------------------------------------------------------------
+def _key(u: ItemUnit, values: dict) -> Key:
+    return (u.item_id, u.po_id, float(u.purchase_price or 0.0),
+            values.get("status", u.status), values.get("reserved_co_id", u.reserved_co_id))
+
+
+def _plain(u: ItemUnit) -> bool:
+    # Uten serienummer og med egen intern strekkode (eller ingen) – kan slås sammen
+    return u.serial is None and (u.barcode is None or u.id is None or u.barcode == code_for(u.id))
+
+
+# Det samme i SQL
+_PLAIN = (ItemUnit.serial.is_(None)
+          & or_(ItemUnit.barcode.is_(None), ItemUnit.barcode == literal(PREFIX) + func.printf("%08d", ItemUnit.id)))
+
+
+def _find(db: Session, key: Key, exclude: Optional[int] = None) -> Optional[ItemUnit]:
+    item_id, po_id, price, status, co_id = key
+    q = select(ItemUnit).where(
+        ItemUnit.item_id == item_id, ItemUnit.po_id == po_id, ItemUnit.purchase_price == price,
+        ItemUnit.status == status, ItemUnit.reserved_co_id == co_id, _PLAIN,
+    )
+    if exclude is not None:
+        q = q.where(ItemUnit.id != exclude)
+    return db.execute(q.order_by(ItemUnit.id).limit(1)).scalar_one_or_none()
+
+
+def _existing(db: Session, keys: Iterable[Key]) -> Dict[Key, ItemUnit]:
+    """Som _find(), men for mange nøkler med én spørring (laveste id pr nøkkel)."""
+    keys = set(keys)
+    if not keys:
+        return {}
+    q = select(ItemUnit).where(
+        ItemUnit.item_id.in_({k[0] for k in keys}), ItemUnit.status.in_({k[3] for k in keys}), _PLAIN,
+    ).order_by(ItemUnit.id)
+    out: Dict[Key, ItemUnit] = {}
+    for u in db.execute(q).scalars():
+        k = _key(u, {})
+        if k in keys:
+            out.setdefault(k, u)
+    return out
+
+
+def _drop(db: Session, gone: List[Tuple[ItemUnit, Optional[ItemUnit]]]) -> None:
+    # Transaksjoner som pekte på radene følger med til raden de slås inn i – én UPDATE for alle
+    if not gone:
+        return
+    if any(into is not None and into.id is None for _, into in gone):
+        db.flush()
+    moved = {u.id: (into.id if into else None) for u, into in gone}
+    db.execute(update(Tx).where(Tx.unit_id.in_(list(moved))).values(unit_id=case(moved, value=Tx.unit_id)))
+    for u, _ in gone:
+        db.delete(u)
+
+
+def add(db: Session, item: Item, qty: int, po_id: Optional[int], price: float, now: Optional[datetime] = None) -> List[ItemUnit]:
+    """Legger inn `qty` nye ledige enheter fra mottak. Returnerer nye rader (tom hvis lagt på et parti)."""
+    now = now or datetime.utcnow()
+    if qty <= 0:
+        return []
+    if is_lot(item):
+        lot = _find(db, (item.id, po_id, float(price or 0.0), "available", None))
+        if lot is not None:
+            lot.qty = (lot.qty or 1) + qty
+            return []
+        rows = [ItemUnit(item_id=item.id, po_id=po_id, status="available", purchase_price=price, created_at=now, qty=qty)]
+    else:
+        rows = [ItemUnit(item_id=item.id, po_id=po_id, status="available", purchase_price=price, created_at=now, qty=1)
+                for _ in range(qty)]
+    db.add_all(rows)
+    return rows
+
+
+def move(db: Session, rows: Iterable[ItemUnit], qty: int, lot: bool,
+         picked: Optional[Dict[int, int]] = None, **values) -> List[ItemUnit]:
+    """Flytter inntil `qty` enheter fra `rows` (i rekkefølge) til `values` (status, reserved_co_id, used_at …).
+
+    `picked` ({rad-id: antall}) tar et bestemt antall fra hver rad i stedet
+    for å fylle opp fra starten – valgte rader fra skjema flyttes da med ett
+    kall. Returnerer radene som nå holder de flyttede enhetene.
+    """
+    rows = list(rows)
+    targets: Dict[Key, ItemUnit] = {}
+    if lot:
+        db.flush()  # leser databasen – ventende endringer må med
+        targets = _existing(db, (_key(u, values) for u in rows))
+    left = qty
+    moved: List[ItemUnit] = []
+    split: List[ItemUnit] = []
+    merged: List[Tuple[ItemUnit, ItemUnit]] = []
+    for u in rows:
+        if left <= 0:
+            break
+        have = u.qty or 1
+        n = min(have, left) if picked is None else min(have, left, picked.get(u.id, have))
+        if n <= 0:
+            continue
+        left -= n
+        key = _key(u, values)
+        plain = _plain(u)
+        t = targets.get(key) if lot and plain else None
+        if t is u:
+            t = None
+        if n == have and t is None:
+            for k, v in values.items():
+                setattr(u, k, v)
+            t = u
+        elif n == have:
+            t.qty = (t.qty or 1) + n
+            for k, v in values.items():
+                setattr(t, k, v)
+            merged.append((u, t))
+        else:
+            u.qty = have - n
+            if t is None:
+                t = ItemUnit(item_id=u.item_id, po_id=u.po_id, purchase_price=u.purchase_price,
+                             status=u.status, reserved_co_id=u.reserved_co_id, created_at=u.created_at,
+                             used_at=u.used_at, qty=n)
+                for k, v in values.items():
+                    setattr(t, k, v)
+                db.add(t)
+                split.append(t)
+            else:
+                t.qty = (t.qty or 1) + n
+                for k, v in values.items():
+                    setattr(t, k, v)
+        if lot and _plain(t):
+            targets[key] = t
+        if t not in moved:
+            moved.append(t)
+    if split:
+        # Delte partier får egen etikett
+        db.flush()
+        for t in split:
+            t.barcode = code_for(t.id)
+    _drop(db, merged)
+    return moved
+
+
+def remove(db: Session, rows: Iterable[ItemUnit], qty: int) -> int:
+    """Sletter inntil `qty` enheter (angret mottak). Returnerer antallet som ble fjernet."""
+    left = qty
+    for u in rows:
+        if left <= 0:
+            break
+        have = u.qty or 1
+        if have <= left:
+            _drop(db, [(u, None)])
+            left -= have
+        else:
+            u.qty = have - left
+            left = 0
+    return qty - left
+
+
+# ------------------------------------------------------------
+# Sammenslåing
+# ------------------------------------------------------------
+# Én rad pr (vare, PO, pris, status, CO) beholdes – den med lavest id – og får summen.
+# Rader med serienummer eller fremmed strekkode havner alene i sin gruppe og står urørt
+# (kolonnene kommer først i migrering 008 – migrering 007 kjører uten).
+_SOLO = "CASE WHEN serial IS NOT NULL OR barcode != :prefix || printf('%08d', id) THEN id END"
+_COMPACT = [
+    "DROP TABLE IF EXISTS temp.lot_map",
+    """CREATE TEMP TABLE lot_map AS
+       SELECT id, MIN(id) OVER w AS keep_id, SUM(COALESCE(qty, 1)) OVER w AS n,
+              COUNT(*) OVER w AS rows_in_group, MIN(created_at) OVER w AS created_at, MAX(used_at) OVER w AS used_at
+       FROM item_units
+       WHERE item_id IN (SELECT id FROM items WHERE tracking = 'lot' AND (:item_id IS NULL OR id = :item_id))
+       WINDOW w AS (PARTITION BY item_id, po_id, purchase_price, status, reserved_co_id, {solo})""",
+    "DELETE FROM temp.lot_map WHERE rows_in_group = 1",
+    "CREATE INDEX temp.ix_lot_map_id ON lot_map (id)",
+    """UPDATE transactions SET unit_id = (SELECT keep_id FROM temp.lot_map m WHERE m.id = transactions.unit_id)
+       WHERE unit_id IN (SELECT id FROM temp.lot_map WHERE id != keep_id)""",
+    """UPDATE item_units SET
+           qty = (SELECT n FROM temp.lot_map m WHERE m.id = item_units.id),
+           created_at = (SELECT created_at FROM temp.lot_map m WHERE m.id = item_units.id),
+           used_at = (SELECT used_at FROM temp.lot_map m WHERE m.id = item_units.id)
+       WHERE id IN (SELECT keep_id FROM temp.lot_map)""",
+    "DELETE FROM item_units WHERE id IN (SELECT id FROM temp.lot_map WHERE id != keep_id)",
+]
+
+
+def compact(execute, item_id: Optional[int] = None) -> int:
+    """Slår sammen like rader for partivarer (alle, eller bare `item_id`). Returnerer antall rader fjernet.
+
+    `execute(sql, params)` er sqlite3-forbindelsens execute (migrering) eller
+    `db.connection().exec_driver_sql` (sesjon) – kalleren eier transaksjonen.
+    """
+    params = {"item_id": item_id, "prefix": PREFIX}
+    cols = {r[1] for r in execute("PRAGMA table_info(item_units)", ()).fetchall()}
+    solo = _SOLO if {"serial", "barcode"} <= cols else "NULL"
+    removed = 0
+    for sql in _COMPACT:
+        sql = sql.replace("{solo}", solo)
+        res = execute(sql, params if ":item_id" in sql else ())
+        if sql.startswith("DELETE FROM item_units"):
+            removed = res.rowcount
+    execute("DROP TABLE temp.lot_map", ())
+    return removed
+
+
+def convert(execute, min_units: int) -> Tuple[int, int]:
+    """Gjør varer med minst `min_units` enhetsrader om til partier. Returnerer (varer, rader fjernet)."""
+    items = execute(
+        "UPDATE items SET tracking = 'lot' WHERE COALESCE(tracking, 'unit') != 'lot' AND id IN ("
+        " SELECT item_id FROM item_units WHERE item_id IS NOT NULL GROUP BY item_id HAVING COUNT(*) >= ?)",
+        (int(min_units),),
+    ).rowcount
+    return items, compact(execute)
+
+
+def _main() -> None:
+    from .db import DB_PATH
+
+    ap = argparse.ArgumentParser(prog="python -m app.lots", description="Partier (antall pr rad) for varer uten serienummer")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("compact", help="slå sammen like rader for partivarer")
+    c.add_argument("--min-units", type=int, default=0, help="gjør også varer med minst så mange enhetsrader om til partier")
+    args = ap.parse_args()
+
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    try:
+        before = conn.execute("SELECT COUNT(*) FROM item_units").fetchone()[0]
+        conn.execute("BEGIN IMMEDIATE")
+        if args.min_units > 0:
+            items, removed = convert(conn.execute, args.min_units)
+        else:
+            items, removed = 0, compact(conn.execute)
+        conn.execute("INSERT INTO change_versions (table_name, version) VALUES ('item_units', 1) "
+                     "ON CONFLICT(table_name) DO UPDATE SET version = version + 1")
+        conn.execute("COMMIT")
+        print(f"{items} vare(r) gjort om til parti, {removed} rad(er) slått sammen ({before} -> {before - removed})")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    _main()
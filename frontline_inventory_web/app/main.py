@@ -1,94 +1,211 @@
-import os, csv, io, asyncio, json
-from datetime import datetime
+from . import startup  # først: startup.T0 markerer starten på import av appen
+
+import os, csv, io, asyncio, json, zlib
+from contextlib import asynccontextmanager
+from datetime import date, datetime
 from typing import Optional, List
-from fastapi import FastAPI, Request, Form, UploadFile, File, Depends, HTTPException, Response
-from fastapi.responses import HTMLResponse, StreamingResponse, PlainTextResponse
-from starlette.staticfiles import StaticFiles
+from fastapi import FastAPI, Request, Form, UploadFile, File, Depends, HTTPException, Response, Body, Query
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, StreamingResponse, PlainTextResponse, FileResponse
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.sessions import SessionMiddleware
+from fastapi.routing import APIRoute
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
-from sqlalchemy import select
-from .models import Customer
-from .db import DB_PATH
-from .models import Item, Category, Location, Tx, ItemUnit, PurchaseOrder, CustomerOrder, Customer, CustomerOrderLine
-
-from . import crud
-from fastapi import Form
-
-from fastapi import HTTPException, Form
-from fastapi.responses import RedirectResponse, HTMLResponse
 from sqlalchemy import select, func
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from .db import DB_PATH, SessionLocal
+from .migrations import run_migrations
+from .models import Item, Tx, ItemUnit, ItemStock, PurchaseOrder, CustomerOrder, Customer, CustomerOrderLine, Job
+from . import crud, archive, snapshots, kpi, refdata, jobs, reporting, backup, lots, unitcodes, pdf, queries, ledger, feed, assets, compress, scheduling, metrics
+from .auth import router as auth_router, require_user, session_secret, templates as auth_templates
+from .sku_index import index as sku_index
+from .events import bcast
+from .bus import bus
+
+
+# --------- Oppstart ---------
+def warm_caches():
+    # Kjøres i bakgrunnen etter at appen tar imot trafikk; oppslag før den er
+    # ferdig varmer indeksen selv (eller går rett mot DB)
+    with startup.phase("varm indeks (bakgrunn)"):
+        try:
+            sku_index.warm()
+            refdata.warm()
+        except Exception as e:
+            print(f"[startup] varming av indeks feilet: {e!r}")
+
+
+async def every(hours: float, label: str, fn, first_delay: float | None = None):
+    # Enkel periodisk bakgrunnsjobb i en tråd (hours <= 0 = av)
+    if hours <= 0:
+        return
+    await asyncio.sleep(hours * 3600 if first_delay is None else first_delay)
+    while True:
+        try:
+            await run_in_threadpool(fn)
+        except Exception as e:
+            print(f"[{label}] feilet: {e!r}")
+        await asyncio.sleep(hours * 3600)
+
+
+def archive_job():
+    n = archive.archive_old_transactions(progress=lambda msg: None)
+    if n:
+        print(f"[archive] {n} transaksjoner flyttet til {archive.ARCHIVE_DIR}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup.mark_ready_start()
+    # DB-skjema: versjonerte migreringer (én SELECT når databasen er oppdatert)
+    with startup.phase("migreringer"):
+        await run_in_threadpool(run_migrations)
+    with startup.phase("maler"):
+        await run_in_threadpool(startup.precompile_templates, templates.env, auth_templates.env)
+    # Fingerprintede og ferdigkomprimerte statiske filer (skriver bare det som mangler)
+    with startup.phase("statiske filer"):
+        await run_in_threadpool(assets.build)
+    loop = asyncio.get_running_loop()
+    bcast.bind(loop)
+    # Endringer fra andre prosesser (flere workers / CLI) → cacher og SSE
+    await run_in_threadpool(bus.start)
+    app.state.warm = loop.run_in_executor(None, warm_caches)
+    startup.mark_ready()
+    print(f"🔧 INVENTORY DB: {DB_PATH} – {startup.summary()}")
+    # Bakgrunnsjobber (import, store slettinger) – egne tråder
+    await run_in_threadpool(jobs.runner.start)
+    # Sikkerhetskopi: én prosess tar kopier (og arkiverer WAL med INV_BACKUP_WAL=1)
+    await run_in_threadpool(backup.start)
+    tasks = [
+        # Flytter gamle transaksjoner til månedsarkiv
+        asyncio.create_task(every(float(os.environ.get("INV_TX_ARCHIVE_HOURS", "24")), "archive", archive_job)),
+        # Dagens lagersnapshot (sjekkes hver time, tas én gang pr dag)
+        asyncio.create_task(every(1, "snapshots", snapshots.run_daily, first_delay=60)),
+        # Kopi av databasen for rapportsidene (bare når INV_REPORT_SNAPSHOT_S > 0)
+        asyncio.create_task(every(reporting.SNAPSHOT_S / 3600, "report-snapshot", reporting.refresh_if_stale, first_delay=0)),
+        # Full kopi når den nyeste er eldre enn INV_BACKUP_HOURS
+        asyncio.create_task(every(min(1, backup.INTERVAL_H), "backup", backup.run_due, first_delay=300)),
+    ]
+    yield
+    for task in tasks:
+        task.cancel()
+    await run_in_threadpool(jobs.runner.stop)
+    await run_in_threadpool(backup.stop)
+    await run_in_threadpool(bus.stop)
+    pdf.shutdown()
 
-from .db import SessionLocal, engine, Base, ensure_migrations
-from .models import Item, Category, Location, Tx
-from . import crud
-from .auth import router as auth_router, require_user
 
 # --------- App init ---------
-app = FastAPI(title="Frontline Inventory (Server-drevet)")
+class UnitOfWorkRoute(APIRoute):
+    """Committer request-sesjonen fra get_db når endepunktet har returnert, før svaret sendes.
+
+    Hvor exit-koden til en yield-avhengighet kjøres har endret seg mellom FastAPI-versjoner
+    (før eller etter at svaret er sendt). Her er rekkefølgen vår egen: feiler commit, går
+    feilen til exception-handlerne (503 ved lås) i stedet for at klienten får et «OK».
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def commit_then_respond(request: Request):
+            response = await handler(request)
+            db = getattr(request.state, "db", None)
+            if db is not None and db.in_transaction():
+                await run_in_threadpool(db.commit)
+            return response
+
+        return commit_then_respond
+
+
+app = FastAPI(title="Frontline Inventory (Server-drevet)", lifespan=lifespan)
+app.router.route_class = UnitOfWorkRoute
 
 # Sessions (cookie-basert)
-SECRET_KEY = os.environ.get("SECRET_KEY", "dev-secret-change-me")
+SECRET_KEY = session_secret()
 app.add_middleware(SessionMiddleware, secret_key=SECRET_KEY, max_age=60*60*8, same_site="lax", https_only=False)
+# Komprimering ytterst (HTML/JSON over INV_COMPRESS_MIN byte; se compress.py)
+app.add_middleware(compress.CompressMiddleware)
+# Opptak pr ruteklasse: skanning har reserverte plasser, eksport/rapporter står i kø (se scheduling.py)
+app.add_middleware(scheduling.SchedulerMiddleware)
+# Ytterst, så tid i opptakskøen og 429-svar også telles (se metrics.py)
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Static og templates
 STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
 os.makedirs(os.path.join(STATIC_DIR, "uploads"), exist_ok=True)
-app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+app.mount("/static", assets.AssetFiles(directory=STATIC_DIR), name="static")
 templates = Jinja2Templates(directory=os.path.join(os.path.dirname(__file__), "templates"))
-
-# DB tabeller + mini-migrering
-Base.metadata.create_all(bind=engine)
-ensure_migrations()  # <- VIKTIG: legger til transactions.user_id / user_name hvis de mangler
+assets.install(templates.env, auth_templates.env)
 
 # Auth-ruter
 app.include_router(auth_router)
 
+# SQLite-lås (skriver venter lenger enn busy-timeout): 503 + Retry-After i stedet for en
+# generisk 500, så skannere/klienter vet at de kan prøve igjen
+@app.exception_handler(OperationalError)
+async def db_locked_handler(request: Request, exc: OperationalError):
+    msg = str(exc.orig or exc).lower()
+    if "locked" in msg or "busy" in msg:
+        return PlainTextResponse("Databasen er opptatt (database is locked) – prøv igjen", status_code=503,
+                                 headers={"Retry-After": "1"})
+    raise exc
+
 # --------- DB dependency ---------
-def get_db():
+def get_db(request: Request):
+    # Én transaksjon pr request: crud flusher, UnitOfWorkRoute committer alt samlet før svaret
+    # sendes (commit her dekker FastAPI-versjoner som kjører exit-koden først), rollback ved feil
     db = SessionLocal()
+    request.state.db = db
     try:
         yield db
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
     finally:
         db.close()
 
-# --------- SSE broadcast (enkel) ---------
-class Broadcaster:
-    def __init__(self):
-        self.listeners: List[asyncio.Queue] = []
-    async def publish(self, event: dict):
-        for q in list(self.listeners):
-            try:
-                await q.put(event)
-            except Exception:
-                pass
-    async def subscribe(self) -> asyncio.Queue:
-        q = asyncio.Queue()
-        self.listeners.append(q)
-        return q
-    def unsubscribe(self, q: asyncio.Queue):
-        try:
-            self.listeners.remove(q)
-        except ValueError:
-            pass
-
-bcast = Broadcaster()
+def get_report_db():
+    # Rapport-/oversiktssider: egen read-only pool eller snapshot-kopi (se reporting.py)
+    db = reporting.ReportSession()
+    try:
+        yield db
+    finally:
+        db.close()
 
 # --------- Helpers ---------
+def tx_event(tx: Tx) -> dict:
+    return {
+        "type": "tx",
+        "id": tx.id,
+        "name": tx.name,
+        "sku": tx.sku,
+        "delta": tx.delta,
+        "note": tx.note,
+        "ts": tx.ts.isoformat(),
+        "by": tx.user_name,
+    }
+
 def fmt_currency(v: float) -> str:
     try:
         return f"{v:,.2f}".replace(",", " ").replace(".", ",")
     except Exception:
         return str(v)
 
+def parse_date(v: str | None):
+    try:
+        return date.fromisoformat((v or "").strip()[:10]) if v else None
+    except ValueError:
+        return None
+
 # --------- Routes ---------
 @app.get("/", response_class=HTMLResponse)
 def dashboard(request: Request, q: str = "", category: str = "Alle", location: str = "Alle",
-              sort: str = "name", page: int = 1, per_page: int = 25, db: Session = Depends(get_db),
+              sort: str = "name", page: int = 1, per_page: int = 25, as_of: str = "", db: Session = Depends(get_db),
               current_user=Depends(require_user)):
-    # Lister
-    cats = [c.name for c in db.execute(select(Category).order_by(Category.name)).scalars()]
-    locs = [l.name for l in db.execute(select(Location).order_by(Location.name)).scalars()]
+    # Lister (fra refdata-cachen)
+    cats, locs = refdata.categories(), refdata.locations()
 
     stmt = select(Item)
     if q:
@@ -96,48 +213,59 @@ def dashboard(request: Request, q: str = "", category: str = "Alle", location: s
         from sqlalchemy import or_
         stmt = stmt.where(or_(Item.name.like(like), Item.sku.like(like), Item.notes.like(like)))
     if category != "Alle":
-        stmt = stmt.join(Item.category_obj).where(Category.name == category)
+        stmt = stmt.where(Item.category_id == refdata.id_by_name("categories", category))
     if location != "Alle":
-        stmt = stmt.join(Item.location_obj).where(Location.name == location)
+        stmt = stmt.where(Item.location_id == refdata.id_by_name("locations", location))
+    filtered = bool(q) or category != "Alle" or location != "Alle"
 
     # sortering
     if sort == "qty":
         from sqlalchemy import desc
-        stmt = stmt.order_by(desc(Item.qty), Item.name)
+        order = (desc(Item.qty), Item.name)
     elif sort == "value":
         from sqlalchemy import desc
-        stmt = stmt.order_by(desc((Item.price) * (Item.qty)), Item.name)
+        order = (desc((Item.price) * (Item.qty)), Item.name)
     elif sort == "sku":
-        stmt = stmt.order_by(Item.sku)
+        order = (Item.sku,)
     else:
-        stmt = stmt.order_by(Item.name)
-
-    items = db.execute(stmt).scalars().all()
-
-    # Tilgjengelige enheter per vare (status 'available'/'ledig')
-    avail_rows = db.execute(
-        select(ItemUnit.item_id, func.count(ItemUnit.id))
-        .where(ItemUnit.status.in_(("available", "ledig")))
-        .where(ItemUnit.item_id.is_not(None))
-        .group_by(ItemUnit.item_id)
-    ).all()
-    # Ignorer rader der item_id er None (kan forekomme etter sletting)
-    avail_counts = {int(item_id): int(cnt or 0) for item_id, cnt in avail_rows if item_id is not None}
-
-    # paginering
-    total = len(items)
+        order = (Item.name,)
+
+    # paginering i SQL – bare siden som vises hentes
+    page = max(1, page)
+    per_page = max(1, min(per_page, 500))
     start = (page - 1) * per_page
-    end = start + per_page
-    page_items = items[start:end]
+    total = db.execute(select(func.count()).select_from(stmt.with_only_columns(Item.id).subquery())).scalar_one()
+    page_items = db.execute(
+        stmt.order_by(*order).limit(per_page).offset(start)
+        .options(*queries.options(Item, "list"))
+    ).scalars().all()
 
-    # Lav beholdning: ingen ledige enheter igjen
-    low_count = sum(1 for i in items if (avail_counts.get(i.id, 0) <= 0))
-    total_items, total_value = crud.inventory_stats(db)
+    # Tilgjengelige enheter for varene på siden (fra lagerbokas projeksjon)
+    avail_counts = {}
+    if page_items:
+        avail_rows = db.execute(
+            select(ItemStock.item_id, ItemStock.available)
+            .where(ItemStock.item_id.in_([i.id for i in page_items]))
+        ).all()
+        avail_counts = {int(item_id): int(cnt or 0) for item_id, cnt in avail_rows}
+
+    # Nøkkeltall: én samlet spørring, cachet til varer/enheter endres
+    k = kpi.get(db)
+    total_items, total_value = k["total_items"], k["total_value"]
+    total_available, total_reserved, total_used = k["total_available"], k["total_reserved"], k["total_used"]
+    # Lav beholdning: ingen ledige enheter igjen (innenfor filteret hvis det er satt)
+    if filtered:
+        low_count = db.execute(
+            select(func.count()).select_from(stmt.where(~kpi.has_available()).with_only_columns(Item.id).subquery())
+        ).scalar_one()
+    else:
+        low_count = k["low_count"]
 
-    # Nøkkeltall til mobilvisning
-    total_available = int(db.execute(select(func.count(ItemUnit.id)).where(ItemUnit.status.in_(("available", "ledig")))).scalar() or 0)
-    total_reserved = int(db.execute(select(func.count(ItemUnit.id)).where(ItemUnit.status.in_(("reserved", "reservert")))).scalar() or 0)
-    total_used = int(db.execute(select(func.count(ItemUnit.id)).where(ItemUnit.status.in_(("used", "brukt")))).scalar() or 0)
+    # Historisk visning: beholdning ved slutten av valgt dato (nærmeste snapshot ± Tx)
+    asof = None
+    as_of_date = parse_date(as_of)
+    if as_of_date:
+        asof = snapshots.stock_as_of(db, snapshots.end_of_day(as_of_date), [i.id for i in page_items])
 
     return templates.TemplateResponse("index.html", {
         "request": request,
@@ -146,8 +274,8 @@ def dashboard(request: Request, q: str = "", category: str = "Alle", location: s
         "q": q,
         "category": category,
         "location": location,
-        "cats": cats,
-        "locs": locs,
+        "cats": cats.names,
+        "locs": locs.names,
         "sort": sort,
         "page": page,
         "per_page": per_page,
@@ -160,24 +288,27 @@ def dashboard(request: Request, q: str = "", category: str = "Alle", location: s
         "total_available": total_available,
         "total_reserved": total_reserved,
         "total_used": total_used,
+        "as_of": as_of_date.isoformat() if as_of_date else "",
+        "asof": asof,
     })
 
 @app.get("/orders", response_class=HTMLResponse)
 def orders_overview(
     request: Request,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_report_db),
     current_user=Depends(require_user)
 ):
     # Hent alle åpne kundeordre som har noe bestilt
-    cos = db.execute(select(CustomerOrder).where(CustomerOrder.status == "open").order_by(CustomerOrder.created_at.desc())).scalars().all()
+    cos = db.execute(
+        queries.rows(CustomerOrder, "detail").where(CustomerOrder.status == "open").order_by(CustomerOrder.created_at.desc())
+    ).scalars().all()
 
     orders = []
     total_needed_all = 0
     for co in cos:
-        lines = db.execute(select(CustomerOrderLine).where(CustomerOrderLine.co_id == co.id)).scalars().all()
         co_lines = []
         total_needed = 0
-        for l in lines:
+        for l in co.lines:
             ordered = int(l.qty or 0)
             reserved = int(l.qty_reserved or 0)
             fulfilled = int(l.qty_fulfilled or 0)
@@ -201,14 +332,14 @@ def orders_overview(
             total_needed_all += total_needed
 
     # Leverandørordre (PO) oversikt
-    from .models import PurchaseOrder, PurchaseOrderLine
     pos = []
-    po_rows = db.execute(select(PurchaseOrder).where(PurchaseOrder.archived == False).order_by(PurchaseOrder.created_at.desc())).scalars().all()
+    po_rows = db.execute(
+        queries.rows(PurchaseOrder, "list").where(PurchaseOrder.archived == False).order_by(PurchaseOrder.created_at.desc())
+    ).scalars().all()
     for po in po_rows:
-        pols = db.execute(select(PurchaseOrderLine).where(PurchaseOrderLine.po_id == po.id)).scalars().all()
         po_lines = []
         total_remaining = 0
-        for pol in pols:
+        for pol in po.lines:
             ordered = int(pol.qty_ordered or 0)
             received = int(pol.qty_received or 0)
             remaining = max(ordered - received, 0)
@@ -227,8 +358,6 @@ def orders_overview(
         })
 
     # PO-koder for mottak-datalist i denne visningen
-    from .models import PurchaseOrder
-    po_rows = db.execute(select(PurchaseOrder).where(PurchaseOrder.archived == False).order_by(PurchaseOrder.created_at.desc())).scalars().all()
     po_codes = [po.code for po in po_rows]
 
     return templates.TemplateResponse(
@@ -247,11 +376,143 @@ def api_item_by_sku(sku: str, db: Session = Depends(get_db), current_user=Depend
     sku = (sku or "").strip()
     if not sku:
         return {"exists": False}
-    it = db.execute(select(Item).where(Item.sku == sku)).scalar_one_or_none()
+    it = sku_index.get(sku)
+    if not it:
+        it = db.execute(select(Item).where(Item.sku == sku)).scalar_one_or_none()
     if not it:
         return {"exists": False, "sku": sku}
     return {"exists": True, "id": it.id, "sku": it.sku, "name": it.name}
 
+def etag_json(request: Request, tag: str, build):
+    # Svarer 304 når klienten har samme versjon; ellers JSON fra build() med ETag
+    etag = f'W/"{tag}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(build(), headers=headers)
+
+
+@app.get("/metrics")
+def metrics_endpoint(request: Request, db: Session = Depends(get_report_db)):
+    # Prometheus-format; lokal skraper, INV_METRICS_TOKEN eller innlogget bruker
+    if not metrics.allowed(request):
+        raise HTTPException(status_code=403, detail="Forbudt")
+    return Response(content=metrics.render(db), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/api/scheduler")
+def api_scheduler(current_user=Depends(require_user)):
+    # Aktive/ventende/avviste requester pr klasse i denne prosessen
+    return scheduling.scheduler.stats()
+
+@app.get("/api/kpi")
+def api_kpi(request: Request, db: Session = Depends(get_db), current_user=Depends(require_user)):
+    # Mobil-flisene poller dette; uendrede tall gir 304 uten DB-arbeid
+    return etag_json(request, kpi.version_tag(), lambda: kpi.get(db))
+
+@app.get("/api/items/suggest")
+def api_items_suggest(q: str = "", limit: int = 20, current_user=Depends(require_user)):
+    # Autocomplete for SKU-felter: eksakt, prefiks og fuzzy fra minneindeksen
+    limit = max(1, min(int(limit), 100))
+    return [e.as_dict() for e in sku_index.suggest(q, limit)]
+
+@app.post("/api/ops")
+async def api_ops(request: Request, db: Session = Depends(get_db), current_user=Depends(require_user)):
+    # Offline-køen sender {"ops": [{"op_id", "kind", "payload"}, ...]}, gjerne gzip-komprimert
+    raw = await request.body()
+    too_big = HTTPException(status_code=413, detail=f"For stor forespørsel (maks {crud.MAX_OPS_BYTES // 2**20} MB)")
+    if request.headers.get("content-encoding", "").lower() == "gzip":
+        # Pakkes ut med tak, så en liten gzip-bombe ikke fyller minnet
+        d = zlib.decompressobj(wbits=31)
+        try:
+            raw = d.decompress(raw, crud.MAX_OPS_BYTES + 1)
+        except zlib.error:
+            raise HTTPException(status_code=400, detail="Ugyldig gzip-data")
+        if len(raw) > crud.MAX_OPS_BYTES:
+            raise too_big
+        if not d.eof:
+            raise HTTPException(status_code=400, detail="Ugyldig gzip-data")
+    elif len(raw) > crud.MAX_OPS_BYTES:
+        raise too_big
+    try:
+        body = json.loads(raw or b"{}")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ugyldig JSON")
+    ops = body.get("ops") if isinstance(body, dict) else None
+    if not isinstance(ops, list):
+        raise HTTPException(status_code=400, detail="'ops' må være en liste")
+
+    def run():
+        try:
+            return crud.apply_ops(db, ops, actor=current_user)
+        except IntegrityError:
+            # En annen enhet la inn samme op_id samtidig – prøv igjen, nå blir de duplikater
+            db.rollback()
+            return crud.apply_ops(db, ops, actor=current_user)
+
+    results, txs = await run_in_threadpool(run)
+    for tx in txs:
+        bcast.publish_on_commit(db, tx_event(tx))
+    return {"results": results}
+
+@app.get("/sw.js")
+def service_worker():
+    # Service worker må serveres fra roten for å kunne styre /receive og /po/scan
+    return FileResponse(
+        os.path.join(STATIC_DIR, "js", "sw.js"),
+        media_type="application/javascript",
+        headers={"Cache-Control": "no-cache", "Service-Worker-Allowed": "/"},
+    )
+
+@app.post("/api/item/by_skus")
+def api_items_by_skus(body: dict = Body(...), db: Session = Depends(get_db), current_user=Depends(require_user)):
+    # Validerer en hel skann-økt i én rundtur: {"skus": [...]}
+    skus = body.get("skus") or []
+    if not isinstance(skus, list):
+        raise HTTPException(status_code=400, detail="'skus' må være en liste")
+    if len(skus) > crud.MAX_SCAN_LINES:
+        raise HTTPException(status_code=413, detail=f"For mange SKU-er (maks {crud.MAX_SCAN_LINES})")
+    wanted = {str(s).strip() for s in skus} - {""}
+    found = crud.find_items_by_skus(db, wanted)
+    return {
+        "items": {sku: {"id": it.id, "sku": it.sku, "name": it.name} for sku, it in found.items()},
+        "missing": sorted(wanted - set(found)),
+    }
+
+@app.get("/api/units/scan")
+def api_unit_scan(code: str, db: Session = Depends(get_db), current_user=Depends(require_user)):
+    # Skannet etikett eller serienummer -> enhet med vare, PO og CO (ett indeksoppslag)
+    hit = unitcodes.resolve_one(db, code)
+    if not hit:
+        raise HTTPException(status_code=404, detail="Ukjent kode")
+    return hit
+
+@app.post("/api/units/resolve")
+def api_units_resolve(body: dict = Body(...), db: Session = Depends(get_db), current_user=Depends(require_user)):
+    # Hele skann-økten i én rundtur: {"codes": [...]}
+    codes = body.get("codes") or []
+    if not isinstance(codes, list):
+        raise HTTPException(status_code=400, detail="'codes' må være en liste")
+    if len(codes) > unitcodes.MAX_CODES:
+        raise HTTPException(status_code=413, detail=f"For mange koder (maks {unitcodes.MAX_CODES})")
+    found = unitcodes.resolve(db, codes)
+    return {
+        "units": {code: hit for code, hit in found.items() if hit["found"]},
+        "missing": sorted(code for code, hit in found.items() if not hit["found"]),
+    }
+
+def _label_units(db: Session, stmt):
+    # Enhetene i stmt som skal ha etikett (brukte enheter tas ikke med)
+    return db.execute(
+        stmt.where(ItemUnit.status != "used").options(*queries.options(ItemUnit, "export")).order_by(ItemUnit.id)
+    ).scalars().all()
+
+def _labels_page(request: Request, db: Session, user, title: str, back: str, stmt):
+    units = _label_units(db, stmt)
+    labels = [(u, unitcodes.code128_svg(u.barcode or unitcodes.code_for(u.id))) for u in units]
+    return templates.TemplateResponse("labels.html", {
+        "request": request, "user": user, "title": title, "back": back, "labels": labels,
+    })
+
 @app.get("/po", response_class=HTMLResponse)
 def po_page(
     request: Request,
@@ -260,9 +521,8 @@ def po_page(
     db: Session = Depends(get_db),
     current_user=Depends(require_user),
 ):
-    from .models import PurchaseOrder, PurchaseOrderLine
     pos = []
-    stmt = select(PurchaseOrder).where(PurchaseOrder.archived == False)
+    stmt = queries.rows(PurchaseOrder, "list").where(PurchaseOrder.archived == False)
     if q:
         like = f"%{q}%"
         from sqlalchemy import or_
@@ -273,10 +533,9 @@ def po_page(
         stmt = stmt.order_by(PurchaseOrder.created_at.desc())
     po_rows = db.execute(stmt).scalars().all()
     for po in po_rows:
-        pols = db.execute(select(PurchaseOrderLine).where(PurchaseOrderLine.po_id == po.id)).scalars().all()
         po_lines = []
         total_remaining = 0
-        for pol in pols:
+        for pol in po.lines:
             ordered = int(pol.qty_ordered or 0)
             received = int(pol.qty_received or 0)
             remaining = max(ordered - received, 0)
@@ -293,8 +552,6 @@ def po_page(
             "lines": po_lines,
             "total_remaining": total_remaining,
         })
-    # Brukes for datalist ved SKU-søk i PO-linje
-    items_for_datalist = db.execute(select(Item).order_by(Item.name.asc()).limit(300)).scalars().all()
     return templates.TemplateResponse(
         "po_list.html",
         {
@@ -303,7 +560,6 @@ def po_page(
             "pos": pos,
             "q": q,
             "sort": sort,
-            "items_for_datalist": items_for_datalist,
         },
     )
 
@@ -323,19 +579,41 @@ async def po_scan_submit(
         lines = json.loads(payload or "[]")
     except Exception:
         lines = []
-    po_code = (po_code or "").strip()
-    for line in lines:
-        sku = str(line.get("sku", "")).strip()
-        qty = int(line.get("qty", 1))
-        price = float(line.get("price", 0) or 0)
-        if not sku or qty <= 0:
-            continue
-        item = db.execute(select(Item).where(Item.sku == sku)).scalar_one_or_none()
-        if not item:
-            item = crud.create_item(db, actor=current_user, name=sku, sku=sku, qty=0, min_qty=0, price=price, currency="NOK", category="Uncategorized", location="Hovedlager", notes="")
-        crud.create_units_for_receive(db, item, qty=qty, po_code=po_code, note=f"Mottak (skann)", actor=current_user, unit_price=price)
+    if not isinstance(lines, list):
+        lines = []
+    # Hele skann-økten registreres i én transaksjon – i en tråd, så en stor økt (eller venting
+    # på skrivelåsen) ikke stopper event-loopen for alle andre requester
+    _, txs = await run_in_threadpool(crud.apply_scan_lines, db, po_code, lines, note="Mottak (skann)", actor=current_user)
+    for tx in txs:
+        bcast.publish_on_commit(db, tx_event(tx))
     return RedirectResponse(url="/po", status_code=303)
 
+@app.post("/api/scan/batch")
+async def api_scan_batch(
+    body: dict = Body(...),
+    db: Session = Depends(get_db),
+    current_user=Depends(require_user),
+):
+    # {"po_code": "...", "note": "...", "lines": ["SKU", {"sku": "...", "qty": 2, "price": 10.0}, ...]}
+    lines = body.get("lines") or []
+    if not isinstance(lines, list):
+        raise HTTPException(status_code=400, detail="'lines' må være en liste")
+    # I en tråd som /api/ops: en full økt (MAX_SCAN_UNITS) er over ett sekund CPU
+    results, txs = await run_in_threadpool(
+        crud.apply_scan_lines, db, str(body.get("po_code") or ""), lines,
+        note=(str(body.get("note") or "").strip() or "Mottak (skann)"),
+        actor=current_user,
+        auto_create=bool(body.get("auto_create", True)),
+    )
+    for tx in txs:
+        bcast.publish_on_commit(db, tx_event(tx))
+    return {
+        "po_code": (body.get("po_code") or "").strip(),
+        "received": sum(tx.delta for tx in txs),
+        "errors": sum(1 for r in results if r["status"] == "error"),
+        "lines": results,
+    }
+
 @app.post("/po/new")
 def po_new(
     request: Request,
@@ -351,7 +629,7 @@ def po_new(
     po = db.execute(select(PurchaseOrder).where(PurchaseOrder.code == code)).scalar_one_or_none()
     if not po:
         po = PurchaseOrder(code=code, supplier=supplier, created_at=datetime.utcnow())
-        db.add(po); db.commit(); db.refresh(po)
+        db.add(po); db.flush()
     else:
         # Oppdater leverandør hvis angitt
         if supplier:
@@ -369,7 +647,6 @@ def po_new(
         with open(fpath, "wb") as f:
             f.write(pdf.file.read())
         po.pdf_path = f"/static/uploads/po/{fname}"
-    db.commit()
     return RedirectResponse(url="/po", status_code=303)
 
 @app.post("/po/{po_id}/line/add")
@@ -390,7 +667,7 @@ def po_line_add(
     if item_id:
         item = db.get(Item, int(item_id))
     if not item and sku:
-        item = db.execute(select(Item).where(Item.sku == sku.strip())).scalar_one_or_none()
+        item = crud.get_item_by_sku(db, sku)
     if not item:
         raise HTTPException(status_code=400, detail="Ugyldig vare")
     pol = db.execute(select(PurchaseOrderLine).where(PurchaseOrderLine.po_id == po.id, PurchaseOrderLine.item_id == item.id)).scalar_one_or_none()
@@ -398,7 +675,6 @@ def po_line_add(
         pol = PurchaseOrderLine(po_id=po.id, item_id=item.id, qty_ordered=0, qty_received=0)
         db.add(pol)
     pol.qty_ordered = (pol.qty_ordered or 0) + int(qty)
-    db.commit()
     return RedirectResponse(url="/po", status_code=303)
 
 @app.post("/po/{po_id}/archive")
@@ -408,7 +684,6 @@ def po_archive_toggle(po_id: int, db: Session = Depends(get_db), current_user=De
     if not po:
         raise HTTPException(status_code=404)
     po.archived = True
-    db.commit()
     return RedirectResponse(url="/po", status_code=303)
 
 @app.post("/po/{po_id}/unarchive")
@@ -418,26 +693,23 @@ def po_unarchive(po_id: int, db: Session = Depends(get_db), current_user=Depends
     if not po:
         raise HTTPException(status_code=404)
     po.archived = False
-    db.commit()
     return RedirectResponse(url="/po/archive", status_code=303)
 
 @app.get("/po/archive", response_class=HTMLResponse)
-def po_archive_page(request: Request, q: str = "", db: Session = Depends(get_db), current_user=Depends(require_user)):
-    from .models import PurchaseOrder, PurchaseOrderLine
-    stmt = select(PurchaseOrder).where(PurchaseOrder.archived == True)
+def po_archive_page(request: Request, q: str = "", db: Session = Depends(get_report_db), current_user=Depends(require_user)):
+    stmt = queries.rows(PurchaseOrder, "list").where(PurchaseOrder.archived == True)
     if q:
         like = f"%{q}%"; from sqlalchemy import or_
         stmt = stmt.where(or_(PurchaseOrder.code.like(like), PurchaseOrder.supplier.like(like)))
     rows = db.execute(stmt.order_by(PurchaseOrder.created_at.desc())).scalars().all()
     pos = []
     for po in rows:
-        pols = db.execute(select(PurchaseOrderLine).where(PurchaseOrderLine.po_id == po.id)).scalars().all()
-        total_remaining = sum(max(int(l.qty_ordered or 0) - int(l.qty_received or 0), 0) for l in pols)
-        pos.append({"po": po, "lines": pols, "total_remaining": total_remaining})
+        total_remaining = sum(max(int(l.qty_ordered or 0) - int(l.qty_received or 0), 0) for l in po.lines)
+        pos.append({"po": po, "lines": po.lines, "total_remaining": total_remaining})
     return templates.TemplateResponse("po_archive.html", {"request": request, "user": current_user, "pos": pos, "q": q})
 
 @app.post("/po/{po_id}/receive")
-async def po_receive(
+def po_receive(
     request: Request,
     po_id: int,
     item_id: int = Form(...),
@@ -469,7 +741,7 @@ async def po_receive(
         except HTTPException:
             pass
     # send til item units
-    await bcast.publish({
+    bcast.publish_on_commit(db, {
         "type": "tx",
         "id": tx.id,
         "name": tx.name,
@@ -508,9 +780,13 @@ def dev_whoami(db: Session = Depends(get_db), current_user = Depends(require_use
     }
 
 @app.get("/api/customers")
-def api_customers(db: Session = Depends(get_db), current_user = Depends(require_user)):
-    rows = db.execute(select(Customer).order_by(Customer.name.asc())).scalars().all()
-    return [{"id": c.id, "name": c.name, "email": c.email or ""} for c in rows]
+def api_customers(request: Request, current_user = Depends(require_user)):
+    return etag_json(request, refdata.version_tag("customers"), lambda: refdata.customers().as_list())
+
+@app.get("/api/refdata")
+def api_refdata(request: Request, current_user = Depends(require_user)):
+    tables = ("categories", "locations", "customers")
+    return etag_json(request, refdata.version_tag(*tables), lambda: {t: refdata.get(t).as_list() for t in tables})
 
 @app.get("/item/new", response_class=HTMLResponse)
 def item_new(request: Request, current_user=Depends(require_user)):
@@ -528,6 +804,7 @@ def item_create(
     category: str = Form(""),
     location: str = Form(""),
     notes: str = Form(""),
+    tracking: str = Form("unit"),
     image: UploadFile | None = File(None),
     db: Session = Depends(get_db),
     current_user=Depends(require_user)
@@ -545,12 +822,13 @@ def item_create(
     item = crud.create_item(db,
         actor=current_user,
         name=name.strip(), sku=sku.strip(), qty=qty, min_qty=min_qty, price=price, currency=currency.strip(),
-        category=category.strip(), location=location.strip(), notes=notes.strip(), image_path=image_path
+        category=category.strip(), location=location.strip(), notes=notes.strip(), image_path=image_path,
+        tracking=(tracking if tracking in lots.TRACKING else "unit"),
     )
     return RedirectResponse(url="/", status_code=303)
 
 @app.get("/item/{item_id}")
-async def item_detail(
+def item_detail(
     request: Request,
     item_id: int,
     db: Session = Depends(get_db),
@@ -562,28 +840,21 @@ async def item_detail(
 
     # Enheter til tabellen nederst
     units = db.execute(
-        select(ItemUnit)
+        queries.rows(ItemUnit, "list")
         .where(ItemUnit.item_id == item.id)
         .order_by(ItemUnit.status.desc(), ItemUnit.id.desc())
     ).scalars().all()
 
-    # Transaksjoner (hvis vist i UI)
-    txs = db.execute(
-        select(Tx).where(Tx.item_id == item.id).order_by(Tx.id.desc()).limit(50)
-    ).scalars().all()
+    # Transaksjoner (hvis vist i UI) – på tvers av varm tabell og arkiv
+    txs = archive.history(db, limit=50, item_id=item.id, order="id")
 
     # Tellerne slik templaten din forventer (count_avail/res/used)
-    count_avail = sum(1 for u in units if u.status in ("available", "ledig"))
-    count_res   = sum(1 for u in units if u.status in ("reserved",  "reservert"))
-    count_used  = sum(1 for u in units if u.status in ("used",      "brukt"))
+    count_avail = sum(u.qty or 1 for u in units if u.status in ("available", "ledig"))
+    count_res   = sum(u.qty or 1 for u in units if u.status in ("reserved",  "reservert"))
+    count_used  = sum(u.qty or 1 for u in units if u.status in ("used",      "brukt"))
 
     # KUNDER til dropdown (nøkkelen)
-    customers = db.execute(
-        select(Customer).order_by(Customer.name.asc())
-    ).scalars().all()
-
-    # HØYLYTT DEBUG i konsollen – skal være > 0 hvis kunder finnes
-    print(f"[item_detail] DB={DB_PATH} customers_len={len(customers)} at {datetime.utcnow().isoformat()}")
+    customers = refdata.customers().rows
 
     return templates.TemplateResponse(
         "item_units.html",
@@ -601,7 +872,7 @@ async def item_detail(
 
 @app.get("/item/{item_id}/edit", response_class=HTMLResponse)
 def item_edit(request: Request, item_id: int, db: Session = Depends(get_db), current_user=Depends(require_user)):
-    item = db.get(Item, item_id)
+    item = queries.get(db, Item, item_id)
     if not item:
         raise HTTPException(status_code=404)
     return templates.TemplateResponse("item_form.html", {"request": request, "user": current_user, "item": item})
@@ -618,6 +889,7 @@ def item_update(
     category: str = Form(""),
     location: str = Form(""),
     notes: str = Form(""),
+    tracking: str = Form("unit"),
     image: UploadFile | None = File(None),
     db: Session = Depends(get_db),
     current_user=Depends(require_user)
@@ -641,7 +913,8 @@ def item_update(
     crud.update_item(db, item,
         actor=current_user,
         name=name.strip(), sku=sku.strip(), qty=qty, min_qty=min_qty, price=price, currency=currency.strip(),
-        category=category.strip(), location=location.strip(), notes=notes.strip(), image_path=image_path
+        category=category.strip(), location=location.strip(), notes=notes.strip(), image_path=image_path,
+        tracking=(tracking if tracking in lots.TRACKING else "unit"),
     )
     return HTMLResponse(headers={"HX-Redirect": "/"}, content="")
 
@@ -661,7 +934,7 @@ def item_delete(
         return RedirectResponse(url="/", status_code=303)
     except HTTPException as e:
         if e.status_code == 400:
-            items = db.execute(select(Item).order_by(Item.name)).scalars().all()
+            items = db.execute(queries.rows(Item, "list").order_by(Item.name)).scalars().all()
             return templates.TemplateResponse(
                 "index.html",
                 {"request": request, "user": current_user, "items": items, "error": e.detail},
@@ -670,7 +943,7 @@ def item_delete(
         raise
 
 @app.post("/item/{item_id}/adjust")
-async def item_adjust(
+def item_adjust(
     request: Request,
     item_id: int,
     delta: int = Form(...),
@@ -682,7 +955,7 @@ async def item_adjust(
     if not item:
         raise HTTPException(status_code=404)
     tx = crud.adjust_stock(db, item, delta=delta, note=note, actor=current_user)
-    await bcast.publish({
+    bcast.publish_on_commit(db, {
         "type": "tx",
         "id": tx.id,
         "name": tx.name,
@@ -700,18 +973,65 @@ def item_units_page(request: Request, item_id: int, db: Session = Depends(get_db
     if not item:
         raise HTTPException(status_code=404)
     units = db.execute(
-    select(ItemUnit)
-    .where(ItemUnit.item_id == item.id)
-    .order_by(ItemUnit.status.desc(), ItemUnit.id.desc())
-).scalars().all()
-    avail, res, used = crud.unit_counts(db, item)
+        queries.rows(ItemUnit, "list")
+        .where(ItemUnit.item_id == item.id)
+        .order_by(ItemUnit.status.desc(), ItemUnit.id.desc())
+    ).scalars().all()
+    avail, res, used = ledger.stock(db, item.id)
     return templates.TemplateResponse("item_units.html", {
         "request": request, "user": current_user, "item": item, "units": units,
         "count_avail": avail, "count_res": res, "count_used": used
     })
 
+def _item_units_stmt(db: Session, item_id: int, ids: str, po_id: int | None):
+    item = db.get(Item, item_id)
+    if not item:
+        raise HTTPException(status_code=404)
+    stmt = select(ItemUnit).where(ItemUnit.item_id == item.id)
+    if ids:
+        stmt = stmt.where(ItemUnit.id.in_(list(lots.parse_selection(ids))))
+    if po_id:
+        stmt = stmt.where(ItemUnit.po_id == po_id)
+    return item, stmt
+
+@app.get("/item/{item_id}/labels", response_class=HTMLResponse)
+def item_labels(request: Request, item_id: int, ids: str = "", po_id: int | None = None,
+                db: Session = Depends(get_db), current_user=Depends(require_user)):
+    item, stmt = _item_units_stmt(db, item_id, ids, po_id)
+    return _labels_page(request, db, current_user, f"{item.name} ({item.sku})", f"/item/{item.id}/units", stmt)
+
+@app.get("/item/{item_id}/labels.pdf")
+def item_labels_pdf(item_id: int, ids: str = "", po_id: int | None = None,
+                    db: Session = Depends(get_db), current_user=Depends(require_user)):
+    item, stmt = _item_units_stmt(db, item_id, ids, po_id)
+    return pdf.response("labels", pdf.unit_labels(_label_units(db, stmt)), f"etiketter-{item.sku}.pdf")
+
+@app.get("/po/{po_id}/labels", response_class=HTMLResponse)
+def po_labels(request: Request, po_id: int, db: Session = Depends(get_db), current_user=Depends(require_user)):
+    po = db.get(PurchaseOrder, po_id)
+    if not po:
+        raise HTTPException(status_code=404)
+    return _labels_page(request, db, current_user, po.code, "/po", select(ItemUnit).where(ItemUnit.po_id == po.id))
+
+@app.get("/po/{po_id}/labels.pdf")
+def po_labels_pdf(po_id: int, db: Session = Depends(get_db), current_user=Depends(require_user)):
+    po = db.get(PurchaseOrder, po_id)
+    if not po:
+        raise HTTPException(status_code=404)
+    units = _label_units(db, select(ItemUnit).where(ItemUnit.po_id == po.id))
+    return pdf.response("labels", pdf.unit_labels(units), f"etiketter-{po.code}.pdf")
+
+@app.get("/labels/items.pdf")
+def item_sku_labels_pdf(ids: str = "", db: Session = Depends(get_db), current_user=Depends(require_user)):
+    # Hylleetiketter med SKU som strekkode, én pr vare (ids = kommaseparerte vare-id-er)
+    wanted = [int(x) for x in ids.split(",") if x.strip().isdigit()]
+    if not wanted:
+        raise HTTPException(status_code=400, detail="Ingen varer valgt")
+    items = db.execute(select(Item).where(Item.id.in_(wanted)).order_by(Item.sku)).scalars().all()
+    return pdf.response("labels", pdf.item_labels(items), "vareetiketter.pdf")
+
 @app.post("/receive/legacy")
-async def receive_post(
+def receive_post(
     request: Request,
     sku: str = Form(...),
     qty: int = Form(1),
@@ -721,7 +1041,7 @@ async def receive_post(
     current_user = Depends(require_user),
 ):
     sku = sku.strip()
-    item = db.execute(select(Item).where(Item.sku == sku)).scalar_one_or_none()
+    item = crud.get_item_by_sku(db, sku)
     if not item:
         # auto-opprette enkel vare hvis SKU ikke finnes
         item = crud.create_item(
@@ -736,7 +1056,7 @@ async def receive_post(
     )
 
     # behold broadcast (samme format som tidligere)
-    await bcast.publish({
+    bcast.publish_on_commit(db, {
         "type": "tx",
         "id": tx.id,
         "name": tx.name,
@@ -751,7 +1071,7 @@ async def receive_post(
     return RedirectResponse(url="/", status_code=303)
 
 @app.post("/item/{item_id}/reserve_customer")
-async def item_reserve_customer(
+def item_reserve_customer(
     request: Request,
     item_id: int,
     customer_id: int = Form(...),
@@ -790,13 +1110,11 @@ def api_open_cos(customer_id: int, db: Session = Depends(get_db), current_user =
 # Lag en NY åpen CO for kunden (brukes av “+ Ny”-knappen)
 @app.post("/api/customers/{customer_id}/co/new")
 def api_new_co(customer_id: int, db: Session = Depends(get_db), current_user = Depends(require_user)):
-    from .models import CustomerOrder
-    from datetime import datetime
     n = db.query(CustomerOrder).count() + 1
     code = f"CO-{datetime.utcnow().year}-{n:03d}"
     co = CustomerOrder(code=code, customer_id=customer_id, status="open", notes="", created_at=datetime.utcnow())
     db.add(co)
-    db.commit()
+    db.flush()
     return {"id": co.id, "code": co.code}
 
 # CO-opplysninger for bekreftelse i UI
@@ -824,7 +1142,7 @@ def api_co_next_code(db: Session = Depends(get_db), current_user = Depends(requi
     return {"code": crud._gen_co_code(db)}
 
 @app.post("/item/{item_id}/units/reserve")
-async def item_units_reserve(
+def item_units_reserve(
     request: Request,
     item_id: int,
     unit_ids: str = Form(...),
@@ -833,12 +1151,12 @@ async def item_units_reserve(
     db: Session = Depends(get_db),
     current_user = Depends(require_user),
 ):
-    ids = [int(x) for x in unit_ids.split(",") if x.strip()]
-    crud.reserve_units_by_ids(db, ids, co_code=co_code, note=note, actor=current_user)
+    sel = lots.parse_selection(unit_ids)
+    crud.reserve_units_by_ids(db, sel, co_code=co_code, note=note, actor=current_user, qtys=sel)
     return RedirectResponse(url=f"/item/{item_id}/units", status_code=303)
 
 @app.post("/item/{item_id}/units/unreserve")
-async def item_units_unreserve(
+def item_units_unreserve(
     request: Request,
     item_id: int,
     unit_ids: str = Form(...),
@@ -846,13 +1164,13 @@ async def item_units_unreserve(
     db: Session = Depends(get_db),
     current_user = Depends(require_user),
 ):
-    ids = [int(x) for x in unit_ids.split(",") if x.strip()]
-    crud.unreserve_units(db, ids, note=note, actor=current_user)
+    sel = lots.parse_selection(unit_ids)
+    crud.unreserve_units(db, sel, note=note, actor=current_user, qtys=sel)
     return RedirectResponse(url=f"/item/{item_id}/units", status_code=303)
 
 
 @app.post("/item/{item_id}/units/issue")
-async def item_units_issue(
+def item_units_issue(
     request: Request,
     item_id: int,
     unit_ids: str = Form(...),
@@ -861,17 +1179,17 @@ async def item_units_issue(
     db: Session = Depends(get_db),
     current_user = Depends(require_user),
 ):
-    ids = [int(x) for x in unit_ids.split(",") if x.strip()]
-    k = crud.issue_units(db, ids, co_code=co_code, note=note, actor=current_user)
+    sel = lots.parse_selection(unit_ids)
+    k = crud.issue_units(db, sel, co_code=co_code, note=note, actor=current_user, qtys=sel)
 
     item = db.get(Item, item_id)
     if item:
-        await bcast.publish({
+        bcast.publish_on_commit(db, {
             "type": "tx",
             "id": 0,
             "name": item.name,
             "sku": item.sku,
-            "delta": -len(ids),
+            "delta": -k,
             "note": note,
             "ts": datetime.utcnow().isoformat(),
             "by": current_user.name,
@@ -883,7 +1201,7 @@ def receive_page(request: Request, current_user=Depends(require_user)):
     return templates.TemplateResponse("receive.html", {"request": request, "user": current_user})
 
 @app.post("/receive")
-async def receive_post(
+def receive_post(
     request: Request,
     sku: str = Form(...),
     qty: int = Form(1),
@@ -892,13 +1210,15 @@ async def receive_post(
     note: str = Form("Mottak"),
     co_code: str | None = Form(None),
     auto_reserve: str | None = Form(None),
+    serials: str = Form(""),
     db: Session = Depends(get_db),
     current_user = Depends(require_user),
 ):
     sku = (sku or "").strip()
-    qty = max(1, int(qty))
+    serial_list = unitcodes.clean_serials(serials)
+    qty = max(1, int(qty), len(serial_list))
     # Slå opp eller auto-opprett vare
-    item = db.execute(select(Item).where(Item.sku == sku)).scalar_one_or_none()
+    item = crud.get_item_by_sku(db, sku)
     if not item:
         item = crud.create_item(
             db, actor=current_user,
@@ -908,7 +1228,8 @@ async def receive_post(
 
     # Registrer mottak og knytt til PO hvis angitt
     tx = crud.create_units_for_receive(
-        db, item, qty=qty, po_code=(po_code or "").strip(), note=(note.strip() or "Mottak"), actor=current_user, unit_price=price
+        db, item, qty=qty, po_code=(po_code or "").strip(), note=(note.strip() or "Mottak"), actor=current_user, unit_price=price,
+        serials=serial_list,
     )
 
     # Valgfritt: Reserver til en angitt CO, og trekk ned 'bestilt' på linja
@@ -922,7 +1243,7 @@ async def receive_post(
             request.session["flash_error"] = f"Mottak gjennomført, men reservasjon feilet: {e.detail}"
 
     # Etter enkelt-mottak: gå rett til enhetssiden så du ser tellere og rader
-    await bcast.publish({
+    bcast.publish_on_commit(db, {
         "type": "tx",
         "id": tx.id,
         "name": tx.name,
@@ -936,16 +1257,22 @@ async def receive_post(
     return RedirectResponse(url=f"/item/{item.id}/units", status_code=303)
 
 @app.get("/tx", response_class=HTMLResponse)
-def tx_log(request: Request, q: str = "", db: Session = Depends(get_db), current_user=Depends(require_user)):
-    stmt = select(Tx).order_by(Tx.ts.desc()).limit(500)
-    rows = db.execute(stmt).scalars().all()
+def tx_log(request: Request, q: str = "", db: Session = Depends(get_report_db), current_user=Depends(require_user)):
+    rows = archive.history(db, limit=500)
     if q:
         qq = q.lower()
         rows = [t for t in rows if qq in (t.name or "").lower() or qq in (t.sku or "").lower() or qq in (t.note or "").lower() or qq in (t.user_name or "").lower()]
     return templates.TemplateResponse("tx.html", {"request": request, "user": current_user, "rows": rows, "q": q})
 
 @app.get("/stream/tx")
-async def stream_tx(current_user=Depends(require_user)):
+async def stream_tx(request: Request, db: Session = Depends(get_db)):
+    # Innloggingen sjekkes med rutens egen sesjon (ikke Depends(require_user), som har sin egen
+    # fra auth.get_db), så vi kan gi tilbake DB-forbindelsen før vi blir hengende i strømmen –
+    # ellers holder hver lytter en plass i poolen
+    try:
+        await run_in_threadpool(require_user, request, db)
+    finally:
+        db.close()
     async def event_generator():
         q = await bcast.subscribe()
         try:
@@ -958,103 +1285,196 @@ async def stream_tx(current_user=Depends(require_user)):
             bcast.unsubscribe(q)
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
+# ---------- Bakgrunnsjobber ----------
+def get_job(db: Session, job_id: int):
+    job = db.get(Job, job_id)
+    if not job:
+        raise HTTPException(status_code=404)
+    return job
+
+@app.get("/jobs", response_class=HTMLResponse)
+def jobs_page(request: Request, db: Session = Depends(get_db), current_user=Depends(require_user)):
+    rows = db.execute(select(Job).order_by(Job.id.desc()).limit(50)).scalars().all()
+    return templates.TemplateResponse("jobs.html", {"request": request, "user": current_user, "rows": [jobs.as_dict(j) for j in rows]})
+
+@app.get("/api/jobs/{job_id}")
+def api_job(job_id: int, db: Session = Depends(get_db), current_user=Depends(require_user)):
+    return jobs.as_dict(get_job(db, job_id))
+
+@app.post("/api/jobs/{job_id}/cancel")
+def api_job_cancel(job_id: int, db: Session = Depends(get_db), current_user=Depends(require_user)):
+    return jobs.as_dict(jobs.cancel(db, get_job(db, job_id)))
+
+@app.post("/api/jobs/{job_id}/retry")
+def api_job_retry(job_id: int, db: Session = Depends(get_db), current_user=Depends(require_user)):
+    return jobs.as_dict(jobs.retry(db, get_job(db, job_id)))
+
 # ---------- Import/Export ----------
 @app.get("/import", response_class=HTMLResponse)
 def import_page(request: Request, current_user=Depends(require_user)):
     return templates.TemplateResponse("import.html", {"request": request, "user": current_user})
 
+def import_payloads(name: str, content: bytes) -> list:
+    # Leser hele filen før jobben legges i kø, så formatfeil gir 400 straks
+    out = []
+    try:
+        if name.endswith(".json"):
+            arr = json.loads(content.decode("utf-8"))
+            if not isinstance(arr, list):
+                raise HTTPException(400, "JSON må være en liste")
+            for raw in arr:
+                sku = str(raw.get("sku","")).strip()
+                if not sku:
+                    continue
+                out.append({
+                    "name": raw.get("name") or sku,
+                    "sku": sku,
+                    "qty": int(raw.get("qty",0)),
+                    "min_qty": int(raw.get("minQty", raw.get("min_qty",0))),
+                    "price": float(raw.get("price",0.0)),
+                    "currency": raw.get("currency","NOK"),
+                    "category": raw.get("category",""),
+                    "location": raw.get("location",""),
+                    "notes": raw.get("notes","")
+                })
+        else:
+            import csv as _csv, io as _io
+            reader = _csv.DictReader(_io.StringIO(content.decode("utf-8")))
+            for row in reader:
+                sku = str(row.get("sku","")).strip()
+                if not sku:
+                    continue
+                out.append({
+                    "name": row.get("name") or sku,
+                    "sku": sku,
+                    "qty": int(row.get("qty", row.get("Antall", 0) or 0)),
+                    "min_qty": int(row.get("min_qty", row.get("Min", 0) or 0)),
+                    "price": float(row.get("price", 0.0) or 0.0),
+                    "currency": row.get("currency", "NOK"),
+                    "category": row.get("category",""),
+                    "location": row.get("location",""),
+                    "notes": row.get("notes","")
+                })
+    except (ValueError, AttributeError, UnicodeDecodeError) as e:
+        raise HTTPException(400, f"Kunne ikke lese filen: {e}")
+    return out
+
+IMPORT_CHUNK = 200  # varer pr transaksjon i importjobben
+
+@jobs.handler("import")
+def import_job(ctx: jobs.JobContext, payload: dict):
+    # Én transaksjon pr IMPORT_CHUNK varer, med fremdriften som checkpoint i samme commit:
+    # en lang skrivetransaksjon ville holdt skrivelåsen for alle andre requester. Feiler eller
+    # avbrytes jobben, står bitene som er committet, og neste forsøk fortsetter etter dem.
+    db, rows = ctx.db, payload.get("rows", [])
+    start = min(ctx.resume_from, len(rows))
+    if payload.get("mode") == "replace" and start == 0:
+        from sqlalchemy import delete
+        # Ikke egen commit – slettingen går sammen med første bit
+        db.execute(delete(Tx))
+        db.execute(delete(Item))
+        ledger.reset(db)
+    for n, item_payload in enumerate(rows[start:], start + 1):
+        ctx.check_cancel()
+        existing = crud.get_item_by_sku(db, item_payload["sku"])
+        if existing:
+            crud.update_item(db, existing, actor=ctx.actor, **item_payload)
+        else:
+            crud.create_item(db, actor=ctx.actor, **item_payload)
+        if n % IMPORT_CHUNK == 0 or n == len(rows):
+            ctx.checkpoint(n, f"Importerer ({n}/{len(rows)})")
+    count = len(rows)
+    return {"count": count, "resumed_at": start, "message": f"Importert {count} varer"}
+
 @app.post("/import")
 def import_post(request: Request, file: UploadFile = File(...), mode: str = Form("merge"), db: Session = Depends(get_db), current_user=Depends(require_user)):
-    content = file.file.read()
-    name = file.filename or ""
-    count = 0
-    if name.endswith(".json"):
-        arr = json.loads(content.decode("utf-8"))
-        if not isinstance(arr, list):
-            raise HTTPException(400, "JSON må være en liste")
-        if mode == "replace":
-            from sqlalchemy import delete
-            db.execute(delete(Tx))
-            db.execute(delete(Item))
-            db.commit()
-        for raw in arr:
-            sku = str(raw.get("sku","")).strip()
-            if not sku:
-                continue
-            existing = db.execute(select(Item).where(Item.sku == sku)).scalar_one_or_none()
-            payload = {
-                "name": raw.get("name") or sku,
-                "sku": sku,
-                "qty": int(raw.get("qty",0)),
-                "min_qty": int(raw.get("minQty", raw.get("min_qty",0))),
-                "price": float(raw.get("price",0.0)),
-                "currency": raw.get("currency","NOK"),
-                "category": raw.get("category",""),
-                "location": raw.get("location",""),
-                "notes": raw.get("notes","")
-            }
-            if existing:
-                crud.update_item(db, existing, actor=current_user, **payload)
-            else:
-                crud.create_item(db, actor=current_user, **payload)
-            count += 1
-    else:
-        text = content.decode("utf-8")
-        import csv as _csv, io as _io
-        reader = _csv.DictReader(_io.StringIO(text))
-        if mode == "replace":
-            from sqlalchemy import delete
-            db.execute(delete(Tx))
-            db.execute(delete(Item))
-            db.commit()
-        for row in reader:
-            sku = str(row.get("sku","")).strip()
-            if not sku:
-                continue
-            existing = db.execute(select(Item).where(Item.sku == sku)).scalar_one_or_none()
-            payload = {
-                "name": row.get("name") or sku,
-                "sku": sku,
-                "qty": int(row.get("qty", row.get("Antall", 0) or 0)),
-                "min_qty": int(row.get("min_qty", row.get("Min", 0) or 0)),
-                "price": float(row.get("price", 0.0) or 0.0),
-                "currency": row.get("currency", "NOK"),
-                "category": row.get("category",""),
-                "location": row.get("location",""),
-                "notes": row.get("notes","")
-            }
-            if existing:
-                crud.update_item(db, existing, actor=current_user, **payload)
-            else:
-                crud.create_item(db, actor=current_user, **payload)
-            count += 1
-
-    return PlainTextResponse(f"Importert {count} varer")
+    rows = import_payloads(file.filename or "", file.file.read())
+    job = jobs.submit(db, "import", {"mode": mode, "rows": rows, "filename": file.filename or ""},
+                      actor=current_user, total=len(rows))
+    if "application/json" in request.headers.get("accept", ""):
+        return JSONResponse(jobs.as_dict(job), status_code=202)
+    return RedirectResponse(url=f"/jobs#job-{job.id}", status_code=303)
 
 @app.get("/export.json")
-def export_json(db: Session = Depends(get_db), current_user=Depends(require_user)):
+def export_json(db: Session = Depends(get_report_db), current_user=Depends(require_user)):
     rows = db.execute(select(Item)).scalars().all()
+    cats, locs = refdata.categories().by_id, refdata.locations().by_id
     arr = []
     for i in rows:
         arr.append({
             "name": i.name, "sku": i.sku, "qty": i.qty, "minQty": i.min_qty, "price": i.price, "currency": i.currency,
-            "category": i.category_obj.name if i.category_obj else "", "location": i.location_obj.name if i.location_obj else "",
+            "category": cats[i.category_id].name if i.category_id in cats else "", "location": locs[i.location_id].name if i.location_id in locs else "",
             "notes": i.notes, "image": i.image_path
         })
     data = json.dumps(arr, ensure_ascii=False, indent=2)
     return Response(content=data, media_type="application/json", headers={"Content-Disposition": "attachment; filename=frontline-inventory.json"})
 
 @app.get("/export.csv")
-def export_csv(db: Session = Depends(get_db), current_user=Depends(require_user)):
+def export_csv(db: Session = Depends(get_report_db), current_user=Depends(require_user)):
     rows = db.execute(select(Item)).scalars().all()
+    cats, locs = refdata.categories().by_id, refdata.locations().by_id
     out = io.StringIO()
     import csv as _csv
     writer = _csv.writer(out)
     writer.writerow(["name","sku","qty","min_qty","price","currency","category","location","notes","image"])
     for i in rows:
-        writer.writerow([i.name, i.sku, i.qty, i.min_qty, i.price, i.currency, i.category_obj.name if i.category_obj else "", i.location_obj.name if i.location_obj else "", i.notes, i.image_path])
+        writer.writerow([i.name, i.sku, i.qty, i.min_qty, i.price, i.currency, cats[i.category_id].name if i.category_id in cats else "", locs[i.location_id].name if i.location_id in locs else "", i.notes, i.image_path])
     return Response(content=out.getvalue(), media_type="text/csv", headers={"Content-Disposition": "attachment; filename=frontline-inventory.csv"})
 
+@app.get("/api/changes")
+def api_changes(since: int = 0, limit: int = feed.PAGE, db: Session = Depends(get_report_db), current_user=Depends(require_user)):
+    # Endringsstrøm for ERP o.l. (se feed.py): NDJSON, siste linje har neste `since`
+    rows, nxt, more = feed.page(db, since, limit)
+    rows.append({"next": nxt, "more": more})
+    body = "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in rows)
+    return Response(content=body, media_type="application/x-ndjson", headers={"X-Next-Since": str(nxt)})
+
+# ---------- Historisk beholdning / periodeoversikt ----------
+@app.get("/api/stock/as_of")
+def api_stock_as_of(at: str, item_id: List[int] | None = Query(None), db: Session = Depends(get_report_db), current_user=Depends(require_user)):
+    d = parse_date(at)
+    if not d:
+        raise HTTPException(status_code=400, detail="Ugyldig dato (YYYY-MM-DD)")
+    rows = snapshots.stock_as_of(db, snapshots.end_of_day(d), item_id)
+    names = {r.id: r for r in db.execute(select(Item.id, Item.sku, Item.name).where(Item.id.in_(list(rows)))).all()}
+    items = [{**r._asdict(), "sku": names[r.item_id].sku if r.item_id in names else "",
+              "name": names[r.item_id].name if r.item_id in names else ""} for r in rows.values()]
+    return {
+        "as_of": d.isoformat(),
+        "items": items,
+        "totals": {k: sum(i[k] for i in items) for k in ("qty", "available", "reserved", "used", "value")},
+    }
+
+@app.get("/reports/stock.csv")
+def report_stock_csv(at: str, db: Session = Depends(get_report_db), current_user=Depends(require_user)):
+    d = parse_date(at)
+    if not d:
+        raise HTTPException(status_code=400, detail="Ugyldig dato (YYYY-MM-DD)")
+    rows = snapshots.stock_as_of(db, snapshots.end_of_day(d))
+    names = {r.id: r for r in db.execute(select(Item.id, Item.sku, Item.name)).all()}
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["sku", "name", "qty", "available", "reserved", "used", "value"])
+    for r in sorted(rows.values(), key=lambda r: names[r.item_id].sku if r.item_id in names else ""):
+        n = names.get(r.item_id)
+        writer.writerow([n.sku if n else "", n.name if n else "(slettet vare)", r.qty, r.available, r.reserved, r.used, r.value])
+    return Response(content=out.getvalue(), media_type="text/csv",
+                    headers={"Content-Disposition": f"attachment; filename=beholdning-{d.isoformat()}.csv"})
+
+@app.get("/reports/period.csv")
+def report_period_csv(start: str, end: str, db: Session = Depends(get_report_db), current_user=Depends(require_user)):
+    d0, d1 = parse_date(start), parse_date(end)
+    if not d0 or not d1 or d1 < d0:
+        raise HTTPException(status_code=400, detail="Ugyldig periode (start/end som YYYY-MM-DD)")
+    rows = snapshots.period_report(db, d0, d1)
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["sku", "name", "opening", "received", "issued", "closing", "closing_value"])
+    for r in rows:
+        writer.writerow([r["sku"], r["name"], r["opening"], r["received"], r["issued"], r["closing"], r["closing_value"]])
+    return Response(content=out.getvalue(), media_type="text/csv",
+                    headers={"Content-Disposition": f"attachment; filename=periode-{d0.isoformat()}-{d1.isoformat()}.csv"})
+
 @app.get("/customers")
 def customers_list(request: Request, q: str = "", db: Session = Depends(get_db), current_user=Depends(require_user)):
     stmt = select(Customer)
@@ -1102,6 +1522,22 @@ def customers_delete_confirm(request: Request, customer_id: int, db: Session = D
         },
     )
 
+@jobs.handler("customer_delete", max_attempts=3)
+def customer_delete_job(ctx: jobs.JobContext, payload: dict):
+    db = ctx.db
+    cust = db.get(Customer, int(payload["customer_id"]))
+    if not cust:
+        return {"deleted": False, "message": "Kunden finnes ikke lenger"}
+    cos = db.execute(select(CustomerOrder).where(CustomerOrder.customer_id == cust.id)).scalars().all()
+    total = len(cos) + 1
+    for n, co in enumerate(cos, 1):
+        ctx.check_cancel()
+        crud.delete_customer_order(db, co, confirm_code=payload.get("confirm"))
+        db.commit()
+        ctx.progress(n, total, f"Sletter kundeordre ({n}/{len(cos)})")
+    crud.delete_customer(db, cust, confirm_code=payload.get("confirm"))
+    return {"deleted": True, "orders": len(cos), "message": f"Kunde slettet sammen med {len(cos)} ordre"}
+
 @app.post("/customers/{customer_id}/delete")
 def customers_delete_post(
     request: Request,
@@ -1115,9 +1551,15 @@ def customers_delete_post(
     if not cust:
         raise HTTPException(status_code=404)
     try:
-        # Slett tilknyttede CO-er hvis krysset av
+        # Slett tilknyttede CO-er hvis krysset av – som bakgrunnsjobb, hver ordre frigir enheter og Tx-koblinger
         if delete_cos:
-            crud.delete_customer_orders_for_customer(db, cust.id, confirm_code=confirm.strip())
+            co_cnt = db.execute(select(func.count(CustomerOrder.id)).where(CustomerOrder.customer_id == cust.id)).scalar() or 0
+            if co_cnt > 0:
+                if confirm.strip() != "1234":
+                    raise HTTPException(status_code=400, detail=f"Kunden har {co_cnt} kundeordre(r). Skriv 1234 for å bekrefte sletting. Dette kan ikke angres.")
+                job = jobs.submit(db, "customer_delete", {"customer_id": cust.id, "confirm": confirm.strip()},
+                                  actor=current_user, total=int(co_cnt) + 1)
+                return RedirectResponse(url=f"/jobs#job-{job.id}", status_code=303)
         crud.delete_customer(db, cust, confirm_code=confirm.strip())
         return RedirectResponse(url="/customers", status_code=303)
     except HTTPException as e:
@@ -1146,7 +1588,7 @@ def co_list(
     db: Session = Depends(get_db),
     current_user=Depends(require_user),
 ):
-    stmt = select(CustomerOrder).order_by(CustomerOrder.created_at.desc())
+    stmt = queries.rows(CustomerOrder, "list").order_by(CustomerOrder.created_at.desc())
     if q and q.strip():
         qs = f"%{q.strip()}%"
         from sqlalchemy import or_
@@ -1162,7 +1604,7 @@ def co_list(
     ).all()}
     if only_ordered:
         rows = [co for co in rows if (totals.get(co.id, 0) or 0) > 0]
-    customers = db.execute(select(Customer).order_by(Customer.name.asc())).scalars().all()
+    customers = refdata.customers().rows
     total_ordered = sum(int(totals.get(co.id, 0) or 0) for co in rows)
     return templates.TemplateResponse(
         "co_list.html",
@@ -1181,8 +1623,8 @@ def co_list(
     )
 
 @app.get("/co/new")
-def co_new(request: Request, db: Session = Depends(get_db), current_user=Depends(require_user)):
-    customers = db.execute(select(Customer).order_by(Customer.name)).scalars().all()
+def co_new(request: Request, current_user=Depends(require_user)):
+    customers = refdata.customers().rows
     return templates.TemplateResponse("co_form.html", {"request": request, "user": current_user, "customers": customers})
 
 @app.post("/co/new")
@@ -1199,23 +1641,26 @@ def co_new_post(
 
 @app.get("/co/{co_id}")
 def co_detail(request: Request, co_id: int, db: Session = Depends(get_db), current_user=Depends(require_user)):
-    co = db.get(CustomerOrder, co_id)
+    co = queries.get(db, CustomerOrder, co_id)
     if not co:
         raise HTTPException(status_code=404)
-    lines = db.execute(select(CustomerOrderLine).where(CustomerOrderLine.co_id == co.id)).scalars().all()
-    # Brukes for datalist ved "Legg til vare" (begrenset for ytelse)
-    items_for_datalist = db.execute(select(Item).order_by(Item.name.asc()).limit(300)).scalars().all()
     return templates.TemplateResponse(
         "co_detail.html",
         {
             "request": request,
             "user": current_user,
             "co": co,
-            "lines": lines,
-            "items_for_datalist": items_for_datalist,
+            "lines": co.lines,
         },
     )
 
+@app.get("/co/{co_id}/picklist.pdf")
+def co_picklist_pdf(co_id: int, db: Session = Depends(get_db), current_user=Depends(require_user)):
+    co = queries.get(db, CustomerOrder, co_id, "export")
+    if not co:
+        raise HTTPException(status_code=404)
+    return pdf.response("picklist", pdf.picklist(db, co), f"plukkliste-{co.code}.pdf")
+
 @app.post("/co/{co_id}/notes")
 def co_update_notes(
     request: Request, co_id: int,
@@ -1226,7 +1671,6 @@ def co_update_notes(
     if not co:
         raise HTTPException(status_code=404)
     co.notes = (notes or "").strip()
-    db.commit()
     return RedirectResponse(url=f"/co/{co.id}", status_code=303)
 
 @app.post("/co/{co_id}/line/add")
@@ -1248,7 +1692,7 @@ def co_line_add(
     if not item and sku:
         s = sku.strip()
         if s:
-            item = db.execute(select(Item).where(Item.sku == s)).scalar_one_or_none()
+            item = crud.get_item_by_sku(db, s)
     if not item:
         request.session["flash_error"] = "Fant ikke varen. Velg en gyldig SKU."
         return RedirectResponse(url=f"/co/{co.id}", status_code=303)
@@ -1260,10 +1704,10 @@ def co_line_add(
 
 @app.get("/co/{co_id}/delete")
 def co_delete_confirm(request: Request, co_id: int, db: Session = Depends(get_db), current_user=Depends(require_user)):
-    co = db.get(CustomerOrder, co_id)
+    co = queries.get(db, CustomerOrder, co_id, "list")
     if not co:
         raise HTTPException(status_code=404)
-    reserved_cnt = db.execute(select(func.count(ItemUnit.id)).where(ItemUnit.reserved_co_id == co.id, ItemUnit.status.in_(("reserved","reservert")))).scalar() or 0
+    reserved_cnt = db.execute(select(func.sum(ItemUnit.qty)).where(ItemUnit.reserved_co_id == co.id, ItemUnit.status.in_(("reserved","reservert")))).scalar() or 0
     lines_cnt = db.execute(select(func.count(CustomerOrderLine.id)).where(CustomerOrderLine.co_id == co.id)).scalar() or 0
     return templates.TemplateResponse(
         "co_delete.html",
@@ -1293,7 +1737,7 @@ def co_delete_post(
         return RedirectResponse(url="/co", status_code=303)
     except HTTPException as e:
         if e.status_code == 400:
-            reserved_cnt = db.execute(select(func.count(ItemUnit.id)).where(ItemUnit.reserved_co_id == co.id, ItemUnit.status.in_(("reserved","reservert")))).scalar() or 0
+            reserved_cnt = db.execute(select(func.sum(ItemUnit.qty)).where(ItemUnit.reserved_co_id == co.id, ItemUnit.status.in_(("reserved","reservert")))).scalar() or 0
             lines_cnt = db.execute(select(func.count(CustomerOrderLine.id)).where(CustomerOrderLine.co_id == co.id)).scalar() or 0
             return templates.TemplateResponse(
                 "co_delete.html",
@@ -1394,8 +1838,7 @@ def co_line_order(
         raise HTTPException(status_code=404)
     line = crud.ensure_line(db, co, item)
     line.qty = (line.qty or 0) + int(qty)
-    db.add(Tx(item_id=item.id, sku=item.sku, name=item.name, delta=0, note=f"{note} {qty} stk for CO {co.code}", co_id=co.id, user_id=None, user_name=None))
-    db.commit()
+    ledger.record(db, "note", item, note=f"{note} {qty} stk for CO {co.code}", co=co)
     return RedirectResponse(url=f"/co/{co.id}", status_code=303)
 
 @app.post("/co/{co_id}/line/delete")
@@ -1460,3 +1903,6 @@ def co_undo_receive(
         po = db.execute(select(PurchaseOrder).where(PurchaseOrder.code == po_code.strip())).scalar_one_or_none()
     crud.undo_receive_units(db, item, int(qty), po=po, note=f"Angret mottak (CO {co.code})", actor=current_user)
     return RedirectResponse(url=f"/co/{co.id}", status_code=303)
+
+
+startup.mark_imported()
@@ -0,0 +1,269 @@
+# app/metrics.py
+"""`/metrics` i Prometheus' tekstformat – uten prometheus_client eller egen tjeneste.
+
+Telles i prosessen (én verdi pr worker, se README):
+
+- requester pr rute/metode/status og varighet som histogram (MetricsMiddleware)
+- byte mottatt i request-body (opplastinger, import) pr rute
+- checkouts og ventetid i SQLAlchemy-poolene (`instrument_pool`)
+- SSE-lyttere og køene deres i `bcast`, og opptakskøene i scheduling.py
+
+Leses fra databasen ved hver skraping, og er derfor like i alle workers:
+
+- størrelsen på WAL-filen og hvor mange sider som ikke er sjekkpunktet ennå
+  (fra headeren i -shm-filen, så skrapingen tar ingen låser)
+- enheter mottatt, reservert og tatt ut siste minutt (fra lagerboka)
+"""
+import hmac
+import os
+import struct
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from sqlalchemy import func, select
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from . import reporting, scheduling
+from .db import DB_PATH, engine
+from .events import bcast
+from .models import Tx
+
+TOKEN = os.environ.get("INV_METRICS_TOKEN", "")
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Lagerbok-hendelser -> navn i metrikken (uttak av reserverte enheter er også uttak)
+UNIT_KINDS = {"receive": "received", "reserve": "reserved", "issue": "issued", "fulfill": "issued"}
+
+_lock = threading.Lock()
+
+
+class _Histogram:
+    def __init__(self) -> None:
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, v: float) -> None:
+        for i, b in enumerate(BUCKETS):
+            if v <= b:
+                self.counts[i] += 1
+                break
+        self.total += 1
+        self.sum += v
+
+
+_requests: Dict[Tuple[str, str, str], int] = defaultdict(int)
+_latency: Dict[Tuple[str, str], _Histogram] = defaultdict(_Histogram)
+_body_bytes: Dict[str, int] = defaultdict(int)
+_pool_checkouts: Dict[str, int] = defaultdict(int)
+_pool_wait: Dict[str, _Histogram] = defaultdict(_Histogram)
+_pools: Dict[str, object] = {}
+
+
+# ------------------------------------------------------------
+# Innsamling
+# ------------------------------------------------------------
+def _route(scope: Scope) -> str:
+    # Malen (/co/{co_id}), ikke selve stien – ellers blir det én serie pr ordre
+    route = scope.get("route")
+    if route is not None and getattr(route, "path", None):
+        return route.path
+    path = scope.get("path", "")
+    if path.startswith("/static/"):
+        return "/static"
+    return "<ukjent>"
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        t = time.perf_counter()
+        status = 500
+        streaming = False
+        received = 0
+
+        async def counted_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+            return message
+
+        async def wrapped(message: Message) -> None:
+            nonlocal status, streaming
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                streaming = any(k == b"content-type" and v.startswith(b"text/event-stream")
+                                for k, v in message.get("headers", ()))
+            await send(message)
+
+        try:
+            await self.app(scope, counted_receive, wrapped)
+        finally:
+            route, method = _route(scope), scope.get("method", "GET")
+            _requests[(route, method, str(status))] += 1
+            # SSE-strømmer varer så lenge klienten er koblet til – de ville bare forskjøvet histogrammet
+            if not streaming:
+                _latency[(route, method)].observe(time.perf_counter() - t)
+            if received:
+                _body_bytes[route] += received
+
+
+def instrument_pool(engine, name: str) -> None:
+    """Teller checkouts og måler hvor lenge en tråd venter på en ledig forbindelse."""
+    pool = engine.pool
+    _pools[name] = pool
+    do_get = pool._do_get  # der QueuePool blokkerer når alle forbindelser er i bruk
+
+    def timed_get():
+        t = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            with _lock:
+                _pool_checkouts[name] += 1
+                _pool_wait[name].observe(time.perf_counter() - t)
+
+    pool._do_get = timed_get
+
+
+instrument_pool(engine, "main")
+instrument_pool(reporting.read_engine, "report")
+
+
+def wal_status(db_path: str = DB_PATH) -> Dict[str, int]:
+    """WAL-størrelse og sider som ikke er skrevet tilbake til databasen ennå.
+
+    mxFrame (siste gyldige side i WAL) og nBackfill (sider som er sjekkpunktet)
+    står i wal-index-headeren i -shm-filen (https://sqlite.org/walformat.html).
+    """
+    out = {"wal_bytes": 0, "frames": 0, "backfilled": 0, "page_size": 0}
+    try:
+        out["wal_bytes"] = os.path.getsize(db_path + "-wal")
+        with open(db_path + "-wal", "rb") as f:
+            header = f.read(32)
+        if len(header) == 32:
+            out["page_size"] = struct.unpack(">I", header[8:12])[0]
+        with open(db_path + "-shm", "rb") as f:
+            shm = f.read(136)
+    except OSError:
+        return out
+    if len(shm) == 136:
+        # Native byteorden til maskinen som skrev; nBackfill ligger i WalCkptInfo rett etter de to headerkopiene
+        out["frames"] = struct.unpack("=I", shm[16:20])[0]
+        out["backfilled"] = struct.unpack("=I", shm[96:100])[0]
+    return out
+
+
+def units_last_minute(db) -> Dict[str, int]:
+    since = datetime.utcnow() - timedelta(minutes=1)
+    rows = db.execute(
+        select(Tx.kind, func.coalesce(func.sum(Tx.qty), 0))
+        .where(Tx.ts >= since, Tx.kind.in_(list(UNIT_KINDS)))
+        .group_by(Tx.kind)
+    ).all()
+    out = {name: 0 for name in UNIT_KINDS.values()}
+    for kind, n in rows:
+        out[UNIT_KINDS[kind]] += int(n)
+    return out
+
+
+def allowed(request: Request) -> bool:
+    """Lokal skraper, riktig `Authorization: Bearer $INV_METRICS_TOKEN` eller innlogget bruker."""
+    auth = request.headers.get("authorization", "")
+    if TOKEN and hmac.compare_digest(auth, f"Bearer {TOKEN}"):
+        return True
+    if request.session.get("uid"):
+        return True
+    host = request.client.host if request.client else ""
+    return host in ("127.0.0.1", "::1")
+
+
+# ------------------------------------------------------------
+# Tekstformat
+# ------------------------------------------------------------
+def _labels(**kw) -> str:
+    if not kw:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in kw.items()) + "}"
+
+
+def _metric(out: List[str], name: str, kind: str, help_: str, samples) -> None:
+    out.append(f"# HELP {name} {help_}")
+    out.append(f"# TYPE {name} {kind}")
+    for labels, value in samples:
+        out.append(f"{name}{_labels(**labels)} {value}")
+
+
+def _histogram(out: List[str], name: str, help_: str, series) -> None:
+    out.append(f"# HELP {name} {help_}")
+    out.append(f"# TYPE {name} histogram")
+    for labels, h in series:
+        acc = 0
+        for b, n in zip(BUCKETS, h.counts):
+            acc += n
+            out.append(f"{name}_bucket{_labels(**labels, le=b)} {acc}")
+        out.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {h.total}")
+        out.append(f"{name}_sum{_labels(**labels)} {h.sum:.6f}")
+        out.append(f"{name}_count{_labels(**labels)} {h.total}")
+
+
+def render(db) -> str:
+    out: List[str] = []
+    _metric(out, "inventory_http_requests_total", "counter", "Requester pr rute, metode og status",
+            [({"route": r, "method": m, "status": s}, n) for (r, m, s), n in sorted(_requests.items())])
+    _histogram(out, "inventory_http_request_duration_seconds", "Tid til svaret er sendt (uten SSE)",
+               [({"route": r, "method": m}, h) for (r, m), h in sorted(_latency.items())])
+    _metric(out, "inventory_http_request_body_bytes_total", "counter", "Byte mottatt i request-body (opplastinger)",
+            [({"route": r}, n) for r, n in sorted(_body_bytes.items())])
+
+    queues = [q.qsize() for q in list(bcast.listeners)]
+    _metric(out, "inventory_sse_subscribers", "gauge", "Åpne SSE-tilkoblinger i denne prosessen",
+            [({}, len(queues))])
+    _metric(out, "inventory_sse_queue_events", "gauge", "Hendelser som venter i SSE-køene (sum og største kø)",
+            [({"agg": "sum"}, sum(queues)), ({"agg": "max"}, max(queues, default=0))])
+
+    stats = scheduling.scheduler.stats()
+    for name, key, kind, help_ in (
+        ("inventory_scheduler_active", "active", "gauge", "Requester i gang pr opptaksklasse"),
+        ("inventory_scheduler_waiting", "waiting", "gauge", "Requester i kø pr opptaksklasse"),
+        ("inventory_scheduler_limit", "limit", "gauge", "Maks samtidige pr opptaksklasse"),
+        ("inventory_scheduler_admitted_total", "admitted", "counter", "Requester sluppet inn pr opptaksklasse"),
+        ("inventory_scheduler_rejected_total", "rejected", "counter", "Requester avvist med 429 pr opptaksklasse"),
+        ("inventory_scheduler_wait_seconds_total", "wait_seconds", "counter", "Samlet ventetid i opptakskøen"),
+    ):
+        _metric(out, name, kind, help_, [({"class": c}, s[key]) for c, s in stats.items()])
+
+    with _lock:
+        checkouts = sorted(_pool_checkouts.items())
+        waits = [({"pool": p}, h) for p, h in sorted(_pool_wait.items())]
+        _metric(out, "inventory_db_pool_checkouts_total", "counter", "Forbindelser hentet fra poolen",
+                [({"pool": p}, n) for p, n in checkouts])
+        _histogram(out, "inventory_db_pool_wait_seconds", "Ventetid på ledig forbindelse", waits)
+    _metric(out, "inventory_db_pool_checked_out", "gauge", "Forbindelser i bruk nå",
+            [({"pool": p}, pool.checkedout()) for p, pool in sorted(_pools.items())])
+    _metric(out, "inventory_db_pool_size", "gauge", "Faste forbindelser i poolen",
+            [({"pool": p}, pool.size()) for p, pool in sorted(_pools.items())])
+
+    wal = wal_status()
+    lag = max(0, wal["frames"] - wal["backfilled"])
+    _metric(out, "inventory_sqlite_wal_bytes", "gauge", "Størrelsen på WAL-filen", [({}, wal["wal_bytes"])])
+    _metric(out, "inventory_sqlite_wal_frames", "gauge", "Sider i WAL siden forrige nullstilling", [({}, wal["frames"])])
+    _metric(out, "inventory_sqlite_checkpoint_lag_frames", "gauge", "Sider i WAL som ikke er sjekkpunktet", [({}, lag)])
+    _metric(out, "inventory_sqlite_checkpoint_lag_bytes", "gauge", "Det samme i byte",
+            [({}, lag * (wal["page_size"] + 24) if wal["page_size"] else 0)])
+
+    _metric(out, "inventory_units_last_minute", "gauge", "Enheter mottatt, reservert og tatt ut siste minutt",
+            [({"kind": k}, n) for k, n in units_last_minute(db).items()])
+    return "\n".join(out) + "\n"
@@ -0,0 +1,569 @@
+# app/migrations.py
+"""Versjonerte skjemamigreringer.
+
+Hver migrering kjører nøyaktig én gang og registreres i `schema_version`.
+Varm oppstart koster én `SELECT MAX(version)`; bare når databasen ligger
+bak tar vi en fil-lås (slik at flere workers kan starte samtidig) og kjører
+det som mangler, hver migrering i sin egen transaksjon.
+
+Kjør manuelt med `python -m app.migrations` (viser status og migrerer).
+"""
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Callable, List, Tuple
+
+from sqlalchemy.dialects import sqlite as sqlite_dialect
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from .db import DB_PATH
+from . import models  # noqa: F401  (registrerer alle tabeller på Base.metadata)
+from . import feed, ledger, lots, unitcodes
+
+LOCK_PATH = DB_PATH + ".migrate.lock"
+COPY_CHUNK = 5000
+
+Progress = Callable[[str], None]
+
+# Skjemaet slik det var da versjoneringen startet (migrering 001). Fryst som tekst: senere
+# endringer i models.py kommer med egne migreringer, så nye og oppgraderte databaser blir like.
+BASELINE_TABLES: List[Tuple[str, str, Tuple[str, ...]]] = [
+    ("categories", """
+        CREATE TABLE categories (
+            id INTEGER NOT NULL,
+            name VARCHAR(100) NOT NULL,
+            PRIMARY KEY (id)
+        )""",
+     ("CREATE UNIQUE INDEX IF NOT EXISTS ix_categories_name ON categories (name)",)),
+    ("customers", """
+        CREATE TABLE customers (
+            id INTEGER NOT NULL,
+            name VARCHAR(200) NOT NULL,
+            email VARCHAR(200) NOT NULL,
+            phone VARCHAR(50) NOT NULL,
+            notes VARCHAR(500) NOT NULL,
+            created_at DATETIME NOT NULL,
+            PRIMARY KEY (id)
+        )""",
+     ()),
+    ("locations", """
+        CREATE TABLE locations (
+            id INTEGER NOT NULL,
+            name VARCHAR(100) NOT NULL,
+            PRIMARY KEY (id)
+        )""",
+     ("CREATE UNIQUE INDEX IF NOT EXISTS ix_locations_name ON locations (name)",)),
+    ("purchase_orders", """
+        CREATE TABLE purchase_orders (
+            id INTEGER NOT NULL,
+            code VARCHAR(80) NOT NULL,
+            supplier VARCHAR(120) NOT NULL,
+            pdf_path VARCHAR(300) NOT NULL,
+            archived BOOLEAN NOT NULL,
+            created_at DATETIME NOT NULL,
+            PRIMARY KEY (id)
+        )""",
+     ("CREATE UNIQUE INDEX IF NOT EXISTS ix_purchase_orders_code ON purchase_orders (code)",)),
+    ("users", """
+        CREATE TABLE users (
+            id INTEGER NOT NULL,
+            name VARCHAR(120) NOT NULL,
+            email VARCHAR(200) NOT NULL,
+            password_hash VARCHAR(255) NOT NULL,
+            role VARCHAR(20) NOT NULL,
+            created_at DATETIME NOT NULL,
+            PRIMARY KEY (id)
+        )""",
+     ("CREATE UNIQUE INDEX IF NOT EXISTS ix_users_email ON users (email)",)),
+    ("applied_ops", """
+        CREATE TABLE applied_ops (
+            id INTEGER NOT NULL,
+            op_id VARCHAR(64) NOT NULL,
+            kind VARCHAR(30) NOT NULL,
+            result TEXT NOT NULL,
+            user_id INTEGER,
+            created_at DATETIME NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(user_id) REFERENCES users (id)
+        )""",
+     ("CREATE UNIQUE INDEX IF NOT EXISTS ix_applied_ops_op_id ON applied_ops (op_id)",)),
+    ("customer_orders", """
+        CREATE TABLE customer_orders (
+            id INTEGER NOT NULL,
+            code VARCHAR(120) NOT NULL,
+            customer_id INTEGER,
+            status VARCHAR(20),
+            notes VARCHAR(500),
+            created_at DATETIME,
+            PRIMARY KEY (id),
+            UNIQUE (code),
+            FOREIGN KEY(customer_id) REFERENCES customers (id)
+        )""",
+     ()),
+    ("items", """
+        CREATE TABLE items (
+            id INTEGER NOT NULL,
+            name VARCHAR(200) NOT NULL,
+            sku VARCHAR(120) NOT NULL,
+            qty INTEGER NOT NULL,
+            min_qty INTEGER NOT NULL,
+            price FLOAT NOT NULL,
+            currency VARCHAR(8) NOT NULL,
+            notes TEXT NOT NULL,
+            image_path VARCHAR(300) NOT NULL,
+            category_id INTEGER,
+            location_id INTEGER,
+            last_updated DATETIME NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(category_id) REFERENCES categories (id),
+            FOREIGN KEY(location_id) REFERENCES locations (id)
+        )""",
+     ("CREATE UNIQUE INDEX IF NOT EXISTS ix_items_sku ON items (sku)", "CREATE INDEX IF NOT EXISTS ix_items_name ON items (name)")),
+    ("customer_order_lines", """
+        CREATE TABLE customer_order_lines (
+            id INTEGER NOT NULL,
+            co_id INTEGER NOT NULL,
+            item_id INTEGER,
+            qty_ordered INTEGER NOT NULL,
+            qty_reserved INTEGER NOT NULL,
+            qty_fulfilled INTEGER NOT NULL,
+            notes VARCHAR(500),
+            created_at DATETIME,
+            PRIMARY KEY (id),
+            FOREIGN KEY(co_id) REFERENCES customer_orders (id),
+            FOREIGN KEY(item_id) REFERENCES items (id)
+        )""",
+     ()),
+    ("item_units", """
+        CREATE TABLE item_units (
+            id INTEGER NOT NULL,
+            item_id INTEGER,
+            po_id INTEGER,
+            reserved_co_id INTEGER,
+            status VARCHAR(20) NOT NULL,
+            purchase_price FLOAT NOT NULL,
+            created_at DATETIME NOT NULL,
+            used_at DATETIME,
+            PRIMARY KEY (id),
+            FOREIGN KEY(item_id) REFERENCES items (id) ON DELETE SET NULL,
+            FOREIGN KEY(po_id) REFERENCES purchase_orders (id) ON DELETE SET NULL,
+            FOREIGN KEY(reserved_co_id) REFERENCES customer_orders (id) ON DELETE SET NULL
+        )""",
+     ()),
+    ("purchase_order_lines", """
+        CREATE TABLE purchase_order_lines (
+            id INTEGER NOT NULL,
+            po_id INTEGER NOT NULL,
+            item_id INTEGER,
+            qty_ordered INTEGER NOT NULL,
+            qty_received INTEGER NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(po_id) REFERENCES purchase_orders (id),
+            FOREIGN KEY(item_id) REFERENCES items (id) ON DELETE SET NULL
+        )""",
+     ()),
+    ("transactions", """
+        CREATE TABLE transactions (
+            id INTEGER NOT NULL,
+            item_id INTEGER,
+            sku VARCHAR(120) NOT NULL,
+            name VARCHAR(200) NOT NULL,
+            delta INTEGER NOT NULL,
+            note VARCHAR(200) NOT NULL,
+            ts DATETIME NOT NULL,
+            user_id INTEGER,
+            user_name VARCHAR(120),
+            unit_id INTEGER,
+            po_id INTEGER,
+            co_id INTEGER,
+            PRIMARY KEY (id),
+            FOREIGN KEY(item_id) REFERENCES items (id) ON DELETE SET NULL,
+            FOREIGN KEY(user_id) REFERENCES users (id),
+            FOREIGN KEY(unit_id) REFERENCES item_units (id),
+            FOREIGN KEY(po_id) REFERENCES purchase_orders (id),
+            FOREIGN KEY(co_id) REFERENCES customer_orders (id) ON DELETE SET NULL
+        )""",
+     ("CREATE INDEX IF NOT EXISTS ix_transactions_sku ON transactions (sku)",)),
+]
+
+
+# ------------------------------------------------------------
+# Hjelpere
+# ------------------------------------------------------------
+@contextmanager
+def _file_lock(path: str):
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if os.name == "nt":
+            import msvcrt
+            os.lseek(fd, 0, os.SEEK_SET)
+            while True:
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK gir opp etter ~10 s; vent videre
+                    time.sleep(0.5)
+            try:
+                yield
+            finally:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def _connect() -> sqlite3.Connection:
+    # isolation_level=None: vi styrer BEGIN/COMMIT selv
+    return sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+
+
+def _table_exists(conn, name: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone() is not None
+
+
+def _columns(conn, table: str) -> List[str]:
+    return [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _item_fk_needs_rebuild(conn, table: str) -> bool:
+    # item_id må være nullable og ha ON DELETE SET NULL
+    notnull = next((r[3] for r in conn.execute(f"PRAGMA table_info({table})") if r[1] == "item_id"), None)
+    for (_, _, _table, from_col, _to_col, _seq, on_delete, _match) in conn.execute(f"PRAGMA foreign_key_list({table})"):
+        if from_col == "item_id" and (on_delete or "").upper() == "SET NULL":
+            return notnull == 1
+    return True
+
+
+def create_missing_tables(conn, tables) -> None:
+    """Som Base.metadata.create_all for `tables`, men på vår egen forbindelse/transaksjon.
+
+    Bare for tabeller som blir til i samme migrering; endringer i dem senere må ha egen migrering.
+    """
+    dialect = sqlite_dialect.dialect()
+    for t in tables:
+        if not _table_exists(conn, t.name):
+            conn.execute(str(CreateTable(t).compile(dialect=dialect)))
+        cols = set(_columns(conn, t.name))
+        for ix in t.indexes:
+            # Kolonner som legges til av en senere migrering får indeksen sin der
+            if all(c.name in cols for c in ix.columns):
+                conn.execute(str(CreateIndex(ix, if_not_exists=True).compile(dialect=dialect)))
+
+
+def rebuild_table(conn, table: str, create_new_sql: str, dst_cols: str, select_expr: str, progress: Progress) -> int:
+    """Bygger `table` på nytt via `{table}_new` med chunket INSERT ... SELECT.
+
+    `create_new_sql` må lage `{table}_new`. Kopierer COPY_CHUNK rader av gangen
+    (etter rowid) og rapporterer fremdrift, i stedet for å lese alt inn i Python.
+    """
+    total = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    conn.execute(create_new_sql)
+    copied, last = 0, -(2 ** 63)
+    while True:
+        hi = conn.execute(
+            f"SELECT MAX(rowid) FROM (SELECT rowid FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?)",
+            (last, COPY_CHUNK),
+        ).fetchone()[0]
+        if hi is None:
+            break
+        cur = conn.execute(
+            f"INSERT INTO {table}_new ({dst_cols}) SELECT {select_expr} FROM {table} AS src WHERE src.rowid > ? AND src.rowid <= ?",
+            (last, hi),
+        )
+        copied += cur.rowcount
+        last = hi
+        progress(f"  {table}: {copied}/{total} rader kopiert")
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    return copied
+
+
+# ------------------------------------------------------------
+# Migreringer
+# ------------------------------------------------------------
+def _m001_baseline(conn, progress: Progress) -> None:
+    """Tidligere ensure_migrations(): bringer eldre databaser opp til skjemaet i BASELINE_TABLES."""
+    for name, create_sql, _ in BASELINE_TABLES:
+        if not _table_exists(conn, name):
+            conn.execute(create_sql)
+
+    # customer_orders – fjern legacy 'customer' kolonne (navn -> customer_id)
+    co_cols = _columns(conn, "customer_orders")
+    if "customer" in co_cols:
+        status = "src.status" if "status" in co_cols else "'open'"
+        notes = "src.notes" if "notes" in co_cols else "''"
+        created = "src.created_at" if "created_at" in co_cols else "NULL"
+        rebuild_table(conn, "customer_orders", """
+            CREATE TABLE customer_orders_new (
+                id INTEGER PRIMARY KEY,
+                code VARCHAR(120) NOT NULL UNIQUE,
+                customer_id INTEGER NULL,
+                status VARCHAR(20) DEFAULT 'open',
+                notes VARCHAR(500) DEFAULT '',
+                created_at DATETIME
+            )""",
+            "id, code, customer_id, status, notes, created_at",
+            f"src.id, src.code, (SELECT MAX(c.id) FROM customers c WHERE c.name = src.customer), "
+            f"COALESCE({status}, 'open'), COALESCE({notes}, ''), {created}",
+            progress,
+        )
+    co_cols = _columns(conn, "customer_orders")
+    if "customer_id" not in co_cols:
+        conn.execute("ALTER TABLE customer_orders ADD COLUMN customer_id INTEGER NULL")
+    if "status" not in co_cols:
+        conn.execute("ALTER TABLE customer_orders ADD COLUMN status VARCHAR(20) DEFAULT 'open'")
+    if "notes" not in co_cols:
+        conn.execute("ALTER TABLE customer_orders ADD COLUMN notes VARCHAR(500) DEFAULT ''")
+    if "created_at" not in co_cols:
+        conn.execute("ALTER TABLE customer_orders ADD COLUMN created_at DATETIME NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_co_customer_status ON customer_orders(customer_id, status)")
+
+    # transactions – nye kolonner + nullable item_id med ON DELETE SET NULL
+    t_cols = _columns(conn, "transactions")
+    for addcol in ("user_id", "user_name", "unit_id", "po_id", "co_id"):
+        if addcol not in t_cols:
+            conn.execute(f"ALTER TABLE transactions ADD COLUMN {addcol} {'INTEGER' if addcol.endswith('_id') else 'VARCHAR(120)'}")
+    if _item_fk_needs_rebuild(conn, "transactions"):
+        cols = "id, item_id, sku, name, delta, note, ts, user_id, user_name, unit_id, po_id, co_id"
+        rebuild_table(conn, "transactions", """
+            CREATE TABLE transactions_new (
+                id INTEGER PRIMARY KEY,
+                item_id INTEGER NULL,
+                sku VARCHAR(120),
+                name VARCHAR(200),
+                delta INTEGER,
+                note VARCHAR(200) DEFAULT '',
+                ts DATETIME,
+                user_id INTEGER NULL,
+                user_name VARCHAR(120) NULL,
+                unit_id INTEGER NULL,
+                po_id INTEGER NULL,
+                co_id INTEGER NULL,
+                FOREIGN KEY(item_id) REFERENCES items(id) ON DELETE SET NULL
+            )""", cols, cols, progress)
+
+    # item_units – nullable item_id med ON DELETE SET NULL + ekstra kolonner
+    iu_cols = _columns(conn, "item_units")
+    if _item_fk_needs_rebuild(conn, "item_units"):
+        keep = [c for c in ("id", "item_id", "po_id", "reserved_co_id", "status", "created_at", "used_at",
+                            "reserved_customer_id", "purchase_price") if c in iu_cols]
+        rebuild_table(conn, "item_units", """
+            CREATE TABLE item_units_new (
+                id INTEGER PRIMARY KEY,
+                item_id INTEGER NULL,
+                po_id INTEGER NULL,
+                reserved_co_id INTEGER NULL,
+                status VARCHAR(20),
+                created_at DATETIME,
+                used_at DATETIME,
+                reserved_customer_id INTEGER NULL,
+                purchase_price FLOAT DEFAULT 0.0,
+                FOREIGN KEY(item_id) REFERENCES items(id) ON DELETE SET NULL
+            )""", ", ".join(keep), ", ".join(keep), progress)
+    iu_cols = _columns(conn, "item_units")
+    if "reserved_co_id" not in iu_cols:
+        conn.execute("ALTER TABLE item_units ADD COLUMN reserved_co_id INTEGER NULL")
+    if "reserved_customer_id" not in iu_cols:
+        conn.execute("ALTER TABLE item_units ADD COLUMN reserved_customer_id INTEGER NULL")
+    if "purchase_price" not in iu_cols:
+        conn.execute("ALTER TABLE item_units ADD COLUMN purchase_price FLOAT DEFAULT 0.0")
+
+    # purchase_orders – pdf_path + archived
+    po_cols = _columns(conn, "purchase_orders")
+    if "pdf_path" not in po_cols:
+        conn.execute("ALTER TABLE purchase_orders ADD COLUMN pdf_path VARCHAR(300) DEFAULT ''")
+    if "archived" not in po_cols:
+        conn.execute("ALTER TABLE purchase_orders ADD COLUMN archived INTEGER DEFAULT 0")
+
+    # purchase_order_lines – nullable item_id med ON DELETE SET NULL
+    if _item_fk_needs_rebuild(conn, "purchase_order_lines"):
+        cols = "id, po_id, item_id, qty_ordered, qty_received"
+        rebuild_table(conn, "purchase_order_lines", """
+            CREATE TABLE purchase_order_lines_new (
+                id INTEGER PRIMARY KEY,
+                po_id INTEGER NOT NULL,
+                item_id INTEGER NULL,
+                qty_ordered INTEGER DEFAULT 0,
+                qty_received INTEGER DEFAULT 0,
+                FOREIGN KEY(item_id) REFERENCES items(id) ON DELETE SET NULL
+            )""", cols, cols, progress)
+
+    # customer_order_lines – eldre DB-er har 'qty' i stedet for 'qty_ordered'
+    cols = _columns(conn, "customer_order_lines")
+    if "qty_ordered" not in cols:
+        conn.execute("ALTER TABLE customer_order_lines ADD COLUMN qty_ordered INTEGER")
+        if "qty" in cols:
+            conn.execute("UPDATE customer_order_lines SET qty_ordered = COALESCE(qty, 1)")
+        conn.execute("UPDATE customer_order_lines SET qty_ordered = 1 WHERE qty_ordered IS NULL")
+    if "qty_reserved" not in cols:
+        conn.execute("ALTER TABLE customer_order_lines ADD COLUMN qty_reserved INTEGER")
+        conn.execute("UPDATE customer_order_lines SET qty_reserved = 0 WHERE qty_reserved IS NULL")
+    if "notes" not in cols:
+        conn.execute("ALTER TABLE customer_order_lines ADD COLUMN notes VARCHAR(500) DEFAULT ''")
+    if "created_at" not in cols:
+        conn.execute("ALTER TABLE customer_order_lines ADD COLUMN created_at DATETIME")
+    if "qty_fulfilled" not in cols:
+        conn.execute("ALTER TABLE customer_order_lines ADD COLUMN qty_fulfilled INTEGER")
+        conn.execute("UPDATE customer_order_lines SET qty_fulfilled = 0 WHERE qty_fulfilled IS NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_col_co ON customer_order_lines(co_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_col_item ON customer_order_lines(item_id)")
+
+    # Ombygde tabeller mister indeksene sine – lag dem (på nytt)
+    for _, _, indexes in BASELINE_TABLES:
+        for sql in indexes:
+            conn.execute(sql)
+
+
+def _m002_tx_ts_index(conn, progress: Progress) -> None:
+    # Arkivering og /tx leser transaksjoner etter tidspunkt
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_transactions_ts ON transactions(ts)")
+
+
+def _m003_stock_snapshots(conn, progress: Progress) -> None:
+    create_missing_tables(conn, [models.StockSnapshot.__table__])
+
+
+def _m004_item_units_status_index(conn, progress: Progress) -> None:
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_item_units_item_status ON item_units(item_id, status)")
+    conn.execute("ANALYZE item_units")
+
+
+def _m005_jobs(conn, progress: Progress) -> None:
+    create_missing_tables(conn, [models.Job.__table__])
+
+
+def _m006_process_bus(conn, progress: Progress) -> None:
+    if "heartbeat_at" not in _columns(conn, "jobs"):
+        conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at DATETIME")
+    create_missing_tables(conn, [models.ChangeVersion.__table__, models.BusEvent.__table__])
+
+
+def _m007_unit_lots(conn, progress: Progress) -> None:
+    if "tracking" not in _columns(conn, "items"):
+        conn.execute("ALTER TABLE items ADD COLUMN tracking VARCHAR(10) DEFAULT 'unit'")
+    if "qty" not in _columns(conn, "item_units"):
+        conn.execute("ALTER TABLE item_units ADD COLUMN qty INTEGER DEFAULT 1")
+    # Sammenslåing peker transaksjoner om fra rad til rad
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_transactions_unit_id ON transactions(unit_id)")
+    if lots.AUTO_LOT_UNITS > 0:
+        items, removed = lots.convert(conn.execute, lots.AUTO_LOT_UNITS)
+        if items:
+            progress(f"  {items} vare(r) med minst {lots.AUTO_LOT_UNITS} enheter gjort om til parti ({removed} rader slått sammen)")
+
+
+def _m008_unit_codes(conn, progress: Progress) -> None:
+    cols = _columns(conn, "item_units")
+    if "barcode" not in cols:
+        conn.execute("ALTER TABLE item_units ADD COLUMN barcode VARCHAR(32)")
+    if "serial" not in cols:
+        conn.execute("ALTER TABLE item_units ADD COLUMN serial VARCHAR(120)")
+    n = conn.execute(
+        "UPDATE item_units SET barcode = ? || printf('%08d', id) WHERE barcode IS NULL", (unitcodes.PREFIX,)
+    ).rowcount
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_item_units_barcode ON item_units(barcode)")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_item_units_serial ON item_units(serial)")
+    if n:
+        progress(f"  item_units: {n} strekkoder tildelt")
+
+
+def _m009_stock_ledger(conn, progress: Progress) -> None:
+    cols = _columns(conn, "transactions")
+    if "kind" not in cols:
+        # Eksisterende rader er historikk fra før lagerboka – tallene deres står i åpningsbalansen
+        conn.execute(f"ALTER TABLE transactions ADD COLUMN kind VARCHAR(20) DEFAULT '{ledger.LEGACY}'")
+    if "qty" not in cols:
+        conn.execute("ALTER TABLE transactions ADD COLUMN qty INTEGER DEFAULT 0")
+    create_missing_tables(conn, [models.ItemStock.__table__, models.LedgerOpening.__table__])
+    buckets = ledger.open_balance(conn.execute)
+    fixed = ledger.rebuild(conn.execute)
+    progress(f"  lagerbok: åpningsbalanse i {buckets} bøtter, {fixed['customer_order_lines']} CO-linje(r) rettet etter enhetene")
+
+
+def _m010_change_feed(conn, progress: Progress) -> None:
+    create_missing_tables(conn, [models.ChangeLog.__table__])
+    for sql in feed.trigger_sql():
+        conn.execute(sql)
+    progress(f"  change_log: {feed.seed(conn.execute)} rader lagt inn som utgangspunkt")
+
+
+# (versjon, navn, funksjon) – legg nye migreringer til på slutten, aldri endre gamle
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, "baseline", _m001_baseline),
+    (2, "tx_ts_index", _m002_tx_ts_index),
+    (3, "stock_snapshots", _m003_stock_snapshots),
+    (4, "item_units_status_index", _m004_item_units_status_index),
+    (5, "jobs", _m005_jobs),
+    (6, "process_bus", _m006_process_bus),
+    (7, "unit_lots", _m007_unit_lots),
+    (8, "unit_codes", _m008_unit_codes),
+    (9, "stock_ledger", _m009_stock_ledger),
+    (10, "change_feed", _m010_change_feed),
+]
+LATEST = MIGRATIONS[-1][0]
+
+
+# ------------------------------------------------------------
+# Runner
+# ------------------------------------------------------------
+def current_version(conn) -> int:
+    try:
+        return int(conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] or 0)
+    except sqlite3.OperationalError:
+        return 0
+
+
+def run_migrations(progress: Progress = print) -> int:
+    conn = _connect()
+    try:
+        if current_version(conn) >= LATEST:
+            return LATEST
+        with _file_lock(LOCK_PATH):
+            # En annen worker kan ha migrert mens vi ventet på låsen
+            version = current_version(conn)
+            if version >= LATEST:
+                return version
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    name VARCHAR(100),
+                    applied_at DATETIME
+                )
+            """)
+            # Tabell-ombygging krever at FK-sjekk er av (kan ikke endres inne i en transaksjon)
+            conn.execute("PRAGMA foreign_keys=OFF")
+            for ver, name, fn in MIGRATIONS:
+                if ver <= version:
+                    continue
+                t0 = time.perf_counter()
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    fn(conn, progress)
+                    conn.execute(
+                        "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, datetime('now'))",
+                        (ver, name),
+                    )
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                progress(f"✅ Migrering {ver:03d} {name} utført ({(time.perf_counter() - t0) * 1000:.0f} ms)")
+            conn.execute("PRAGMA foreign_keys=ON")
+            return LATEST
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    c = _connect()
+    before = current_version(c)
+    c.close()
+    print(f"DB: {DB_PATH}\nSkjemaversjon: {before} (siste: {LATEST})")
+    print(f"Skjemaversjon nå: {run_migrations()}")
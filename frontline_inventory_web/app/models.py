@@ -1,6 +1,6 @@
-from sqlalchemy import Column, Integer, String, Float, Text, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Float, Text, Date, DateTime, ForeignKey, Boolean, Index, UniqueConstraint
 from sqlalchemy.orm import relationship, Mapped, mapped_column
-from datetime import datetime
+from datetime import date, datetime
 from .db import Base
 from typing import Optional
 
@@ -38,6 +38,8 @@ class Item(Base):
     currency: Mapped[str] = mapped_column(String(8), default="NOK")
     notes: Mapped[str] = mapped_column(Text, default="")
     image_path: Mapped[str] = mapped_column(String(300), default="")
+    # 'unit' = én rad pr fysisk enhet, 'lot' = én rad pr parti med antall (se lots.py)
+    tracking: Mapped[str] = mapped_column(String(10), default="unit")
 
     category_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("categories.id"))
     location_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("locations.id"))
@@ -55,17 +57,21 @@ class Tx(Base):
     name: Mapped[str] = mapped_column(String(200))
     delta: Mapped[int] = mapped_column(Integer)
     note: Mapped[str] = mapped_column(String(200), default="")
-    ts: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    ts: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
 
     # audit
     user_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("users.id"), nullable=True)
     user_name: Mapped[str | None] = mapped_column(String(120), default=None)
 
     # nye koblinger for sporing
-    unit_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("item_units.id"), nullable=True)
+    unit_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("item_units.id"), nullable=True, index=True)
     po_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("purchase_orders.id"), nullable=True)
     co_id: Mapped[Optional[int]] = mapped_column(ForeignKey("customer_orders.id", ondelete="SET NULL"), nullable=True)
 
+    # Lagerboka (se ledger.py): hendelsestype og antall enheter som flyttes
+    kind: Mapped[str] = mapped_column(String(20), default="note")
+    qty: Mapped[int] = mapped_column(Integer, default=0)
+
     item = relationship("Item")
 
 
@@ -78,6 +84,9 @@ class PurchaseOrder(Base):
     archived: Mapped[bool] = mapped_column(Boolean, default=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
+    # Bare for lesing (queries.py) – linjene endres via crud
+    lines = relationship("PurchaseOrderLine", viewonly=True, order_by="PurchaseOrderLine.id")
+
 class PurchaseOrderLine(Base):
     __tablename__ = "purchase_order_lines"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -99,10 +108,16 @@ class CustomerOrder(Base):
     created_at = Column(DateTime)
 
     customer = relationship("Customer")
-    lines = relationship("CustomerOrderLine", back_populates="co", cascade="all, delete-orphan")
+    lines = relationship("CustomerOrderLine", back_populates="co", cascade="all, delete-orphan", order_by="CustomerOrderLine.id")
 
 class ItemUnit(Base):
     __tablename__ = "item_units"
+    # Dekker tellinger pr vare og status (dashboard, KPI); unike koder for skanning (se unitcodes.py)
+    __table_args__ = (
+        Index("ix_item_units_item_status", "item_id", "status"),
+        Index("ux_item_units_barcode", "barcode", unique=True),
+        Index("ux_item_units_serial", "serial", unique=True),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     item_id = mapped_column(Integer, ForeignKey("items.id", ondelete="SET NULL"), nullable=True)
     # Hvilken bestillingsordre enheten kom inn på (opprinnelse)
@@ -111,11 +126,15 @@ class ItemUnit(Base):
 
     status: Mapped[str] = mapped_column(String(20), default="available")  # available | reserved | used
     purchase_price: Mapped[float] = mapped_column(Float, default=0.0)
+    # Antall enheter raden står for – alltid 1 for serialiserte varer
+    qty: Mapped[int] = mapped_column(Integer, default=1)
+    barcode: Mapped[str | None] = mapped_column(String(32), nullable=True)  # etikett, settes ved mottak
+    serial: Mapped[str | None] = mapped_column(String(120), nullable=True)  # produsentens serienummer (valgfritt)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     used_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
 
     item = relationship("Item")
-    po = relationship("PurchaseOrder", lazy="joined")
+    po = relationship("PurchaseOrder")
     reserved_co: Mapped[Optional[CustomerOrder]] = relationship("CustomerOrder", foreign_keys=[reserved_co_id])
 
 class Customer(Base):
@@ -144,5 +163,98 @@ class CustomerOrderLine(Base):
     notes = Column(String(500), default="")
     created_at = Column(DateTime)
 
-    co = relationship("CustomerOrder", back_populates="lines", lazy="joined")
-    item = relationship("Item", lazy="joined")
+    co = relationship("CustomerOrder", back_populates="lines")
+    item = relationship("Item")
+
+class AppliedOp(Base):
+    # Idempotente mutasjoner fra skannere: op_id genereres av klienten og lagres én gang
+    __tablename__ = "applied_ops"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    op_id: Mapped[str] = mapped_column(String(64), unique=True, index=True)
+    kind: Mapped[str] = mapped_column(String(30))
+    result: Mapped[str] = mapped_column(Text, default="")  # JSON-svaret som ble gitt første gang
+    user_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("users.id"), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+class Job(Base):
+    # Bakgrunnsjobber (se jobs.py): payload/result er JSON
+    __tablename__ = "jobs"
+    __table_args__ = (Index("ix_jobs_status_run_after", "status", "run_after"),)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    kind: Mapped[str] = mapped_column(String(40))
+    status: Mapped[str] = mapped_column(String(20), default="queued")  # queued | running | done | failed | cancelled
+    payload: Mapped[str] = mapped_column(Text, default="{}")
+    result: Mapped[str] = mapped_column(Text, default="")
+    error: Mapped[str] = mapped_column(Text, default="")
+    progress: Mapped[int] = mapped_column(Integer, default=0)
+    total: Mapped[int] = mapped_column(Integer, default=0)
+    message: Mapped[str] = mapped_column(String(300), default="")
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    max_attempts: Mapped[int] = mapped_column(Integer, default=1)
+    cancel_requested: Mapped[bool] = mapped_column(Boolean, default=False)
+    run_after: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    user_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    user_name: Mapped[str] = mapped_column(String(120), default="")
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    started_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    heartbeat_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)  # oppdateres mens jobben kjører
+
+class ItemStock(Base):
+    # Projeksjon av lagerboka: enheter pr status for hver vare (se ledger.py)
+    __tablename__ = "item_stock"
+    item_id: Mapped[int] = mapped_column(Integer, ForeignKey("items.id", ondelete="CASCADE"), primary_key=True)
+    available: Mapped[int] = mapped_column(Integer, default=0)
+    reserved: Mapped[int] = mapped_column(Integer, default=0)
+    used: Mapped[int] = mapped_column(Integer, default=0)
+
+class LedgerOpening(Base):
+    # Åpningsbalanse for lagerboka pr (vare, CO) – co_id 0 = uten CO. Hendelser som
+    # arkiveres legges til her, så projeksjonene kan bygges fra `transactions` alene.
+    __tablename__ = "ledger_opening"
+    item_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    co_id: Mapped[int] = mapped_column(Integer, primary_key=True, default=0)
+    on_hand: Mapped[int] = mapped_column(Integer, default=0)
+    available: Mapped[int] = mapped_column(Integer, default=0)
+    reserved: Mapped[int] = mapped_column(Integer, default=0)
+    used: Mapped[int] = mapped_column(Integer, default=0)
+
+class ChangeVersion(Base):
+    # Versjon pr tabell, telles opp i samme transaksjon som endringen (se changes.py/bus.py)
+    __tablename__ = "change_versions"
+    table_name: Mapped[str] = mapped_column(String(60), primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, default=0)
+
+class ChangeLog(Base):
+    # Endringsstrømmen (se feed.py): skrives av triggere, én rad pr (tabell, id) med siste sekvensnummer
+    __tablename__ = "change_log"
+    __table_args__ = (UniqueConstraint("tbl", "row_id", name="uq_change_log_row"), {"sqlite_autoincrement": True})
+    seq: Mapped[int] = mapped_column(Integer, primary_key=True)
+    tbl: Mapped[str] = mapped_column(String(30))
+    row_id: Mapped[int] = mapped_column(Integer)
+    op: Mapped[str] = mapped_column(String(10), default="upsert")  # upsert | delete
+
+class BusEvent(Base):
+    # SSE-hendelser som videreformidles mellom prosesser; ryddes etter noen minutter
+    __tablename__ = "bus_events"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    pid: Mapped[int] = mapped_column(Integer)
+    payload: Mapped[str] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+
+class StockSnapshot(Base):
+    # Daglig beholdning pr vare (se snapshots.py). item_id uten FK: historikken beholdes når varen slettes
+    __tablename__ = "stock_snapshots"
+    __table_args__ = (
+        UniqueConstraint("day", "item_id", name="uq_stock_snapshots_day_item"),
+        Index("ix_stock_snapshots_taken", "taken_at", "item_id"),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    day: Mapped[date] = mapped_column(Date)
+    taken_at: Mapped[datetime] = mapped_column(DateTime)
+    item_id: Mapped[int] = mapped_column(Integer)
+    qty: Mapped[int] = mapped_column(Integer, default=0)  # items.qty
+    qty_available: Mapped[int] = mapped_column(Integer, default=0)
+    qty_reserved: Mapped[int] = mapped_column(Integer, default=0)
+    qty_used: Mapped[int] = mapped_column(Integer, default=0)
+    value: Mapped[float] = mapped_column(Float, default=0.0)  # innkjøpspris for enheter som ikke er brukt
@@ -0,0 +1,424 @@
+# app/pdf.py
+"""Utskrifter som PDF: etiketter og plukklister.
+
+Sidene tegnes i en prosesspool (INV_PDF_WORKERS, default 2), så en
+etikettutskrift for et stort mottak ikke holder web-workeren opptatt.
+Dokumentet deles i biter på CHUNK_PAGES sider, og ruten sender hver bit
+videre så snart den er ferdig (StreamingResponse). Maks AHEAD biter er i
+arbeid om gangen.
+
+Ferdige filer lagres i pdf_cache/ med sha256 av innholdet (type, layout og
+data) som navn, så samme utskrift igjen leses rett fra disk. Cachen ryddes
+ned til INV_PDF_CACHE_MB, eldste først.
+
+PDF-en skrives for hånd uten avhengigheter: Helvetica (WinAnsi), tekst og
+fylte rektangler (Code 128-strekkoder) i FlateDecode-komprimerte
+innholdsstrømmer.
+"""
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import zlib
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import FileResponse, StreamingResponse
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import refdata
+from .db import DB_PATH
+from .models import CustomerOrder, Item, ItemUnit
+from .unitcodes import code128_pattern, code_for
+
+WORKERS = int(os.environ.get("INV_PDF_WORKERS", "2"))
+CACHE_DIR = os.environ.get("INV_PDF_CACHE_DIR") or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "pdf_cache")
+CACHE_MB = float(os.environ.get("INV_PDF_CACHE_MB", "200"))
+CHUNK_PAGES = 10
+AHEAD = 2
+LAYOUT = 1  # øk når layouten endres, så gamle filer i cachen ikke brukes
+
+PAGE_W, PAGE_H = 595.28, 841.89  # A4 i punkter
+MM = 72 / 25.4
+
+# Etikettark 3 × 8 (70 × 37 mm)
+LABEL_COLS, LABEL_ROWS = 3, 8
+LABEL_W, LABEL_H = 70 * MM, 37.1 * MM
+PER_PAGE = LABEL_COLS * LABEL_ROWS
+
+
+# ------------------------------------------------------------
+# Tegning (kjører i prosesspoolen)
+# ------------------------------------------------------------
+def _pdf_text(s) -> bytes:
+    raw = str(s if s is not None else "").encode("cp1252", "replace")
+    return b"(" + raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+def _fit(s, size: float, width: float) -> str:
+    # Helvetica er i snitt ~0,52 × punktstørrelse bred pr tegn
+    s = str(s or "")
+    n = max(1, int(width / (size * 0.52)))
+    return s if len(s) <= n else s[:n - 1] + "…"
+
+
+class _Page:
+    def __init__(self):
+        self.ops: List[bytes] = [b"0 g"]
+
+    def text(self, x: float, y: float, s, size: float = 9, bold: bool = False, width: Optional[float] = None) -> None:
+        if width:
+            s = _fit(s, size, width)
+        self.ops.append(b"BT /%s %.1f Tf %.2f %.2f Td %s Tj ET" % (b"F2" if bold else b"F1", size, x, y, _pdf_text(s)))
+
+    def rect(self, x: float, y: float, w: float, h: float, fill: bool = True) -> None:
+        self.ops.append(b"%.2f %.2f %.2f %.2f re %s" % (x, y, w, h, b"f" if fill else b"S"))
+
+    def line(self, x1: float, y1: float, x2: float, y2: float) -> None:
+        self.ops.append(b"0.5 w %.2f %.2f m %.2f %.2f l S" % (x1, y1, x2, y2))
+
+    def barcode(self, x: float, y: float, code: str, height: float, max_width: float) -> None:
+        pattern = code128_pattern(code)
+        module = min(1.2, max_width / (sum(int(w) for w in pattern) + 20))
+        x += 10 * module  # stille sone
+        for i, w in enumerate(pattern):
+            width = int(w) * module
+            if i % 2 == 0:
+                self.rect(x, y, width, height)
+            x += width
+
+    def stream(self) -> bytes:
+        return zlib.compress(b"\n".join(self.ops), 6)
+
+
+def _label(p: _Page, x: float, y: float, lab: dict) -> None:
+    pad, w = 8, LABEL_W - 16
+    top = y + LABEL_H - pad
+    p.text(x + pad, top - 9, lab.get("name"), 9, bold=True, width=w)
+    p.text(x + pad, top - 19, " · ".join(str(v) for v in lab.get("sub", []) if v), 7, width=w)
+    code = lab.get("code") or ""
+    if code:
+        p.barcode(x + pad - 3, y + pad + 18, code, 32, w + 6)
+        p.text(x + pad, y + pad + 9, code, 8)
+    if lab.get("serial"):
+        p.text(x + pad, y + pad, "S/N " + lab["serial"], 7, width=w)
+
+
+def render_labels(labels: List[dict]) -> List[bytes]:
+    """Etiketter på ark med 3 × 8 – én komprimert innholdsstrøm pr side."""
+    pages = []
+    for start in range(0, len(labels), PER_PAGE):
+        p = _Page()
+        for i, lab in enumerate(labels[start:start + PER_PAGE]):
+            col, row = i % LABEL_COLS, i // LABEL_COLS
+            _label(p, col * LABEL_W, PAGE_H - (row + 1) * LABEL_H, lab)
+        pages.append(p.stream())
+    return pages
+
+
+def render_picklist(doc: dict) -> List[bytes]:
+    """Plukkliste gruppert pr lokasjon (i gangrekkefølge)."""
+    left, right, bottom = 40, PAGE_W - 40, 50
+    cols = [(left + 18, "SKU"), (left + 120, "Vare"), (right - 170, "Bestilt"), (right - 120, "Reservert"),
+            (right - 70, "Levert"), (right - 25, "Plukk")]
+    pages: List[bytes] = []
+    state = {"p": None, "y": 0.0, "n": 0}
+
+    def new_page() -> None:
+        if state["p"] is not None:
+            pages.append(state["p"].stream())
+        state["n"] += 1
+        p = state["p"] = _Page()
+        y = PAGE_H - 50
+        p.text(left, y, f"Plukkliste {doc['code']}", 16, bold=True)
+        p.text(right - 130, y, f"Side {state['n']}", 9)
+        y -= 16
+        p.text(left, y, " · ".join(v for v in (doc.get("customer"), doc.get("created")) if v), 9)
+        if doc.get("notes"):
+            y -= 12
+            p.text(left, y, "Notat: " + doc["notes"], 8, width=right - left)
+        p.barcode(right - 180, PAGE_H - 80, doc["code"], 24, 180)
+        state["y"] = y - 24
+
+    def need(h: float) -> None:
+        if state["p"] is None or state["y"] - h < bottom:
+            new_page()
+
+    for group in doc["groups"]:
+        need(40)
+        p = state["p"]
+        p.text(left, state["y"], group["location"], 11, bold=True)
+        state["y"] -= 4
+        p.line(left, state["y"], right, state["y"])
+        state["y"] -= 12
+        for x, title in cols:
+            p.text(x, state["y"], title, 7, bold=True)
+        state["y"] -= 14
+        for ln in group["lines"]:
+            codes = ln.get("codes") or []
+            code_rows = (len(codes) + 3) // 4
+            need(16 + 10 * code_rows)
+            p, y = state["p"], state["y"]
+            p.rect(left, y - 2, 9, 9, fill=False)  # avkrysning
+            p.text(cols[0][0], y, ln["sku"], 9, width=100)
+            p.text(cols[1][0], y, ln["name"], 9, width=cols[2][0] - cols[1][0] - 8)
+            for (x, _), v in zip(cols[2:], (ln["ordered"], ln["reserved"], ln["fulfilled"])):
+                p.text(x, y, v, 9)
+            p.text(cols[5][0], y, ln["pick"], 10, bold=True)
+            y -= 11
+            for r in range(code_rows):
+                p.text(cols[0][0], y, "   ".join(codes[r * 4:r * 4 + 4]), 7)
+                y -= 10
+            state["y"] = y - 5
+    if state["p"] is None:
+        new_page()
+        state["p"].text(left, state["y"], "Ingen linjer å plukke.", 10)
+    pages.append(state["p"].stream())
+    return pages
+
+
+_RENDERERS = {"labels": render_labels, "picklist": render_picklist}
+
+
+def _render(kind: str, part) -> List[bytes]:
+    return _RENDERERS[kind](part)
+
+
+def _parts(kind: str, data) -> list:
+    if kind == "labels":
+        step = CHUNK_PAGES * PER_PAGE
+        return [data[i:i + step] for i in range(0, len(data), step)] or [[]]
+    return [data]
+
+
+# ------------------------------------------------------------
+# Data (i web-prosessen) – rene dict/lister, så de kan sendes til poolen og hashes
+# ------------------------------------------------------------
+def unit_labels(units: List[ItemUnit]) -> List[dict]:
+    out = []
+    for u in units:
+        item = u.item
+        qty = u.qty or 1
+        out.append({
+            "name": item.name if item else "",
+            "sub": [item.sku if item else "", u.po.code if u.po else "", f"{qty} stk" if qty > 1 else ""],
+            "code": u.barcode or code_for(u.id),
+            "serial": u.serial or "",
+        })
+    return out
+
+
+def item_labels(items: List[Item]) -> List[dict]:
+    locs = refdata.locations().by_id
+    return [{
+        "name": it.name,
+        "sub": [locs[it.location_id].name if it.location_id in locs else ""],
+        "code": it.sku,
+        "serial": "",
+    } for it in items]
+
+
+NO_LOCATION = "Uten lokasjon"
+
+
+def picklist(db: Session, co: CustomerOrder) -> dict:
+    """Linjene i ordren gruppert pr lokasjon (alfabetisk, uten lokasjon sist), med reserverte enheter.
+
+    `co` hentes med queries-profilen "export" (kunde og linjer med vare).
+    """
+    codes: Dict[int, List[str]] = {}
+    for item_id, uid, barcode, serial, qty in db.execute(
+        select(ItemUnit.item_id, ItemUnit.id, ItemUnit.barcode, ItemUnit.serial, ItemUnit.qty)
+        .where(ItemUnit.reserved_co_id == co.id, ItemUnit.status == "reserved")
+        .order_by(ItemUnit.id)
+    ):
+        code = barcode or code_for(uid)
+        if serial:
+            code += f" ({serial})"
+        if (qty or 1) > 1:
+            code += f" ×{qty}"
+        codes.setdefault(item_id, []).append(code)
+
+    locs = refdata.locations().by_id
+    groups: Dict[str, List[dict]] = {}
+    for ln in co.lines:
+        item = ln.item
+        loc = locs.get(item.location_id) if item is not None else None
+        reserved, fulfilled = ln.qty_reserved or 0, ln.qty_fulfilled or 0
+        groups.setdefault(loc.name if loc else NO_LOCATION, []).append({
+            "sku": item.sku if item else "",
+            "name": item.name if item else "(slettet vare)",
+            "ordered": ln.qty or 0,
+            "reserved": reserved,
+            "fulfilled": fulfilled,
+            "pick": reserved if reserved > 0 else max(0, (ln.qty or 0) - fulfilled),
+            "codes": codes.get(item.id, []) if item else [],
+        })
+    order = sorted(groups, key=lambda n: (n == NO_LOCATION, n.lower()))
+    return {
+        "code": co.code,
+        "customer": co.customer.name if co.customer else "",
+        "created": co.created_at.strftime("%d.%m.%Y") if co.created_at else "",
+        "notes": co.notes or "",
+        "groups": [{"location": n, "lines": sorted(groups[n], key=lambda r: r["sku"])} for n in order],
+    }
+
+
+# ------------------------------------------------------------
+# PDF-fil
+# ------------------------------------------------------------
+class _Writer:
+    """Skriver objekter fortløpende og husker posisjonene til xref-tabellen.
+
+    1 = katalog, 2 = sidetre, 3/4 = fonter; sidene får nummer fra 5 og oppover
+    (sidetreet skrives til slutt, når alle sidene er kjent).
+    """
+
+    def __init__(self):
+        self.pos = 0
+        self.offsets: Dict[int, int] = {}
+        self.kids: List[int] = []
+        self.next = 5
+
+    def _obj(self, num: int, body: bytes) -> bytes:
+        self.offsets[num] = self.pos
+        out = b"%d 0 obj\n" % num + body + b"\nendobj\n"
+        self.pos += len(out)
+        return out
+
+    def header(self) -> bytes:
+        out = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+        self.pos += len(out)
+        return out
+
+    def page(self, stream: bytes) -> bytes:
+        content, page = self.next, self.next + 1
+        self.next += 2
+        self.kids.append(page)
+        return (
+            self._obj(content, b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream) + stream + b"\nendstream")
+            + self._obj(page, b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.2f %.2f] "
+                              b"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>" % (PAGE_W, PAGE_H, content))
+        )
+
+    def finish(self) -> bytes:
+        font = b"<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>"
+        out = (
+            self._obj(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+            + self._obj(2, b"<< /Type /Pages /Count %d /Kids [%s] >>" % (len(self.kids), b" ".join(b"%d 0 R" % k for k in self.kids)))
+            + self._obj(3, font % b"Helvetica")
+            + self._obj(4, font % b"Helvetica-Bold")
+        )
+        xref_at = self.pos + len(out)
+        size = self.next
+        out += b"xref\n0 %d\n0000000000 65535 f \n" % size
+        out += b"".join(b"%010d 00000 n \n" % self.offsets[n] for n in range(1, size))
+        out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref_at)
+        return out
+
+
+# ------------------------------------------------------------
+# Pool, cache og respons
+# ------------------------------------------------------------
+_pool: Optional[Executor] = None
+
+
+def _executor() -> Optional[Executor]:
+    global _pool
+    if _pool is None and WORKERS > 0:
+        # spawn: arbeiderne skal ikke arve tråder/forbindelser fra web-prosessen
+        _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def _submit(kind: str, part):
+    pool = _executor()
+    if pool is None:
+        return await run_in_threadpool(_render, kind, part)
+    return await asyncio.wrap_future(pool.submit(_render, kind, part))
+
+
+def cache_key(kind: str, data) -> str:
+    blob = json.dumps({"kind": kind, "layout": LAYOUT, "data": data}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _prune() -> None:
+    try:
+        files = [os.path.join(CACHE_DIR, n) for n in os.listdir(CACHE_DIR) if n.endswith(".pdf")]
+        stats = sorted(((os.stat(f).st_mtime, os.stat(f).st_size, f) for f in files), reverse=True)
+    except OSError:
+        return
+    used, limit = 0, CACHE_MB * 1024 * 1024
+    for _, size, path in stats:
+        used += size
+        if used > limit:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+async def generate(kind: str, data, path: Optional[str] = None) -> AsyncIterator[bytes]:
+    """PDF-bytene etter hvert som sidene blir ferdige; skrives også til `path` (cache) når alt er med."""
+    w = _Writer()
+    parts = deque(_parts(kind, data))
+    running: deque = deque()
+    tmp = f"{path}.{os.getpid()}.{id(w)}.tmp" if path else None
+    f = open(tmp, "wb") if tmp else None
+    done = False
+    try:
+        head = w.header()
+        if f:
+            f.write(head)
+        yield head
+        while parts or running:
+            while parts and len(running) < AHEAD:
+                running.append(asyncio.ensure_future(_submit(kind, parts.popleft())))
+            for stream in await running.popleft():
+                blob = w.page(stream)
+                if f:
+                    f.write(blob)
+                yield blob
+        tail = w.finish()
+        if f:
+            f.write(tail)
+        yield tail
+        done = True
+    finally:
+        for fut in running:
+            fut.cancel()
+        if f:
+            f.close()
+            if done:
+                os.replace(tmp, path)
+                _prune()
+            else:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+
+
+def response(kind: str, data, filename: str):
+    """Ferdig fil fra cachen, ellers strømmet mens den lages."""
+    key = cache_key(kind, data)
+    path = os.path.join(CACHE_DIR, key + ".pdf")
+    headers = {"Content-Disposition": f'inline; filename="{filename}"', "ETag": f'"{key[:32]}"'}
+    if os.path.exists(path):
+        os.utime(path)  # brukt nylig – ryddes sist
+        return FileResponse(path, media_type="application/pdf", headers=headers)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return StreamingResponse(generate(kind, data, path), media_type="application/pdf", headers=headers)
@@ -0,0 +1,106 @@
+# app/profile_startup.py
+"""Profilerer kaldstart: importtid pr modul og tid pr oppstartsfase.
+
+    python -m app.profile_startup [--top 20] [--target-ms 1500] [--db sti]
+
+1) Kjører `python -X importtime -c "import app.main"` i en ren prosess og
+   viser de tyngste modulene (kumulativt og egen tid) og sum pr pakke.
+2) Importerer appen i denne prosessen og kjører lifespan (migreringer,
+   maler, bakgrunnsvarming) med fasetidene fra app.startup.
+
+Returnerer exit-kode 1 hvis tiden til "klar" overstiger --target-ms, slik at
+den kan brukes som sjekk før utrulling.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def importtime(env: dict) -> list:
+    """[(egen_us, kumulativ_us, nivå, modul)] fra -X importtime."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        sys.exit(f"Import av app.main feilet:\n{proc.stderr[-2000:]}")
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cum_us, name = line[len("import time:"):].split("|")
+        level = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(self_us), int(cum_us), level, name.strip()))
+    return rows
+
+
+def report_imports(rows: list, top: int) -> None:
+    total = sum(r[0] for r in rows)
+    print(f"Import (ren prosess): {total / 1000:.0f} ms, {len(rows)} moduler")
+
+    print(f"\nTyngste moduler, kumulativt (topp {top}):")
+    for self_us, cum_us, _, name in sorted(rows, key=lambda r: -r[1])[:top]:
+        print(f"  {cum_us / 1000:8.1f} ms  {name}")
+
+    print(f"\nTyngste moduler, egen tid (topp {top}):")
+    for self_us, _, _, name in sorted(rows, key=lambda r: -r[0])[:top]:
+        print(f"  {self_us / 1000:8.1f} ms  {name}")
+
+    per_pkg = defaultdict(int)
+    for self_us, _, _, name in rows:
+        per_pkg[name.split(".")[0]] += self_us
+    print("\nPr pakke (egen tid):")
+    for pkg, us in sorted(per_pkg.items(), key=lambda kv: -kv[1])[:top]:
+        print(f"  {us / 1000:8.1f} ms  {pkg}")
+
+
+async def run_lifespan():
+    from . import startup
+    t = time.perf_counter()
+    from .main import app
+    import_ms = (time.perf_counter() - t) * 1000
+    async with app.router.lifespan_context(app):
+        warm = getattr(app.state, "warm", None)
+        if warm is not None:
+            await warm
+    return startup, import_ms
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--top", type=int, default=20)
+    ap.add_argument("--target-ms", type=float, default=None, help="maks tid til appen er klar")
+    ap.add_argument("--db", default=None, help="SQLite-fil (default: INV_DB)")
+    ap.add_argument("--skip-importtime", action="store_true")
+    args = ap.parse_args(argv)
+
+    if args.db:
+        os.environ["INV_DB"] = args.db
+    env = dict(os.environ)
+
+    if not args.skip_importtime:
+        report_imports(importtime(env), args.top)
+
+    startup, import_ms = asyncio.run(run_lifespan())
+    print("\nOppstartsfaser (denne prosessen):")
+    print(f"  {import_ms:8.1f} ms  import app.main (inkl. avhengigheter)")
+    for name, ms in startup.phases.items():
+        if name != "import app.main":
+            print(f"  {ms:8.1f} ms  {name}")
+    ready = startup.ready_ms()
+    print(f"\nKlar til trafikk etter {ready:.0f} ms")
+
+    if args.target_ms is not None and ready > args.target_ms:
+        print(f"❌ Over målet på {args.target_ms:.0f} ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+# app/queries.py
+"""Spørringer med faste lasteprofiler for vare, enhet, CO og PO.
+
+Relasjonene i models.py lastes lat (lazy="select"). Sidene henter radene
+sine via profilene her i stedet, som sier hvilke relasjoner siden bruker og
+hvordan de hentes: joinedload for mange-til-én (kunde, vare, PO) og
+selectinload for linjelister. Alt som ikke står i profilen får raiseload –
+en mal som bruker en ny relasjon gir feil med en gang i stedet for én
+stille ekstra spørring pr rad (N+1). Dermed er antall spørringer pr side
+fast uansett hvor mange rader som vises (se q/req i bench).
+
+Profiler:
+- list   – tabeller og oversikter
+- detail – én side med alt den viser (også /orders, som viser hele ordrene)
+- export – PDF-er og eksport
+
+raiseload er sql_only: relasjoner som kan løses uten SQL (FK er NULL eller
+raden finnes i sesjonen) er fortsatt lov.
+"""
+from typing import Dict, Tuple
+
+from sqlalchemy import Select, select
+from sqlalchemy.orm import Session, joinedload, raiseload, selectinload
+
+from .models import CustomerOrder, CustomerOrderLine, Item, ItemUnit, PurchaseOrder, PurchaseOrderLine
+
+PROFILE_NAMES = ("list", "detail", "export")
+
+
+def _strict(*opts) -> tuple:
+    return opts + (raiseload("*", sql_only=True),)
+
+
+def _lines_with_item(rel, item_rel):
+    # Linjene (én ekstra spørring) med varen joinet – og ingenting mer under dem
+    return selectinload(rel).options(
+        joinedload(item_rel).raiseload("*", sql_only=True),
+        raiseload("*", sql_only=True),
+    )
+
+
+_ITEM_REFS = (joinedload(Item.category_obj), joinedload(Item.location_obj))
+
+PROFILES: Dict[type, Dict[str, tuple]] = {
+    Item: {
+        "list": _strict(*_ITEM_REFS),
+        "detail": _strict(*_ITEM_REFS),
+        "export": _strict(),  # eksporten slår opp kategori/lokasjon i refdata
+    },
+    ItemUnit: {
+        # Enhetslisten for én vare – varen er kjent fra før
+        "list": _strict(joinedload(ItemUnit.po), joinedload(ItemUnit.reserved_co)),
+        "detail": _strict(joinedload(ItemUnit.item), joinedload(ItemUnit.po), joinedload(ItemUnit.reserved_co)),
+        "export": _strict(joinedload(ItemUnit.item), joinedload(ItemUnit.po)),
+    },
+    CustomerOrder: {
+        "list": _strict(joinedload(CustomerOrder.customer)),
+        "detail": _strict(joinedload(CustomerOrder.customer), _lines_with_item(CustomerOrder.lines, CustomerOrderLine.item)),
+        "export": _strict(joinedload(CustomerOrder.customer), _lines_with_item(CustomerOrder.lines, CustomerOrderLine.item)),
+    },
+    CustomerOrderLine: {
+        "list": _strict(joinedload(CustomerOrderLine.item)),
+        "detail": _strict(joinedload(CustomerOrderLine.item), joinedload(CustomerOrderLine.co)),
+        "export": _strict(joinedload(CustomerOrderLine.item)),
+    },
+    PurchaseOrder: {
+        "list": _strict(_lines_with_item(PurchaseOrder.lines, PurchaseOrderLine.item)),
+        "detail": _strict(_lines_with_item(PurchaseOrder.lines, PurchaseOrderLine.item)),
+        "export": _strict(),
+    },
+    PurchaseOrderLine: {
+        "list": _strict(joinedload(PurchaseOrderLine.item)),
+        "detail": _strict(joinedload(PurchaseOrderLine.item), joinedload(PurchaseOrderLine.po)),
+        "export": _strict(joinedload(PurchaseOrderLine.item)),
+    },
+}
+
+
+def options(model: type, profile: str) -> Tuple:
+    try:
+        return PROFILES[model][profile]
+    except KeyError:
+        raise ValueError(f"Ukjent lasteprofil {model.__name__}/{profile}") from None
+
+
+def rows(model: type, profile: str = "list") -> Select:
+    """select(model) med profilens lasteregler – legg på where/order_by som vanlig."""
+    return select(model).options(*options(model, profile))
+
+
+def get(db: Session, model: type, ident, profile: str = "detail"):
+    return db.get(model, ident, options=options(model, profile))
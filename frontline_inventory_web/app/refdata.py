@@ -0,0 +1,96 @@
+# app/refdata.py
+"""Referansedata i minnet: kategorier, lokasjoner og kunder.
+
+Listene er små og leses på nesten hver side (filtre, dropdowns), men endres
+sjelden. Hvert sett lastes med en egen sesjon og caches på versjonsnummeret
+til tabellen fra changes.py – en commit som endrer tabellen gjør cachen
+ugyldig, og neste kall laster på nytt. Radene er uforanderlige NamedTuples,
+så de kan deles mellom tråder og sendes rett til templatene.
+"""
+import threading
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select
+
+from . import changes
+from .db import SessionLocal
+from .models import Category, Customer, Location
+
+
+class Ref(NamedTuple):
+    id: int
+    name: str
+    email: str = ""
+
+    def as_dict(self) -> dict:
+        return {"id": self.id, "name": self.name, "email": self.email}
+
+
+class RefSet(NamedTuple):
+    version: int
+    rows: Tuple[Ref, ...]  # sortert på navn
+    by_id: Dict[int, Ref]
+    by_name: Dict[str, Ref]
+
+    @property
+    def names(self) -> list:
+        return [r.name for r in self.rows]
+
+    def as_list(self) -> list:
+        return [r.as_dict() for r in self.rows]
+
+
+_MODELS = {"categories": Category, "locations": Location, "customers": Customer}
+_lock = threading.Lock()
+_cache: Dict[str, RefSet] = {}
+
+
+def _load(table: str, version: int) -> RefSet:
+    model = _MODELS[table]
+    cols = [model.id, model.name] + ([model.email] if model is Customer else [])
+    db = SessionLocal()
+    try:
+        rows = db.execute(select(*cols).order_by(model.name, model.id)).all()
+    finally:
+        db.close()
+    refs = tuple(Ref(int(r[0]), r[1] or "", (r[2] or "") if len(r) > 2 else "") for r in rows)
+    return RefSet(version, refs, {r.id: r for r in refs}, {r.name: r for r in refs})
+
+
+def get(table: str) -> RefSet:
+    v = changes.version(table)
+    rs = _cache.get(table)
+    if rs is not None and rs.version == v:
+        return rs
+    with _lock:
+        rs = _cache.get(table)
+        if rs is None or rs.version != v:
+            # Lagres under versjonen vi leste før lasting; endres tabellen underveis, lastes den på nytt neste gang
+            rs = _load(table, v)
+            _cache[table] = rs
+        return rs
+
+
+def categories() -> RefSet:
+    return get("categories")
+
+
+def locations() -> RefSet:
+    return get("locations")
+
+
+def customers() -> RefSet:
+    return get("customers")
+
+
+def version_tag(*tables: str) -> str:
+    return "-".join(f"{t}{changes.version(t)}" for t in tables)
+
+
+def id_by_name(table: str, name: Optional[str]) -> Optional[int]:
+    r = get(table).by_name.get(name) if name else None
+    return r.id if r else None
+
+
+def warm() -> int:
+    return sum(len(get(t).rows) for t in _MODELS)
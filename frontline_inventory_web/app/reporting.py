@@ -0,0 +1,147 @@
+# app/reporting.py
+"""Egen lesevei for tunge rapportsider (/orders, /po/archive, /tx, eksport, rapporter).
+
+Rapportene bruker `ReportSession` i stedet for hovedpoolen, så de aldri tar
+plass fra mottak/uttak eller holder skrivelåsen:
+
+- INV_REPORT_SNAPSHOT_S = 0 (default): en egen pool med read-only
+  forbindelser mot den levende databasen. I WAL-modus blokkerer lesere aldri
+  skrivere, og dataene er ferske.
+- INV_REPORT_SNAPSHOT_S > 0: rapportene leser en kopi laget med SQLites
+  backup-API, som fornyes når den er eldre enn så mange sekunder. Kopien
+  åpnes `immutable`, så lesing tar ingen låser i det hele tatt.
+
+Hver kopi får et nytt filnavn (`report-<tid>.db`); forbindelser til en eldre
+kopi kastes ved neste checkout, og gamle filer ryddes når de ikke er i bruk.
+"""
+import os
+import sqlite3
+import time
+from datetime import datetime
+from typing import Optional, Tuple
+from urllib.request import pathname2url
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import DisconnectionError
+from sqlalchemy.orm import sessionmaker
+
+from . import archive
+from .db import DB_PATH
+
+SNAPSHOT_S = float(os.environ.get("INV_REPORT_SNAPSHOT_S", "0"))
+SNAPSHOT_DIR = os.environ.get("INV_REPORT_DIR") or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "report_snapshots")
+KEEP = 2
+
+_cached: Tuple[int, Optional[str]] = (-1, None)
+
+
+def _uri(path: str, immutable: bool = False) -> str:
+    return "file:" + pathname2url(os.path.abspath(path)) + "?mode=ro" + ("&immutable=1" if immutable else "")
+
+
+# ------------------------------------------------------------
+# Kopier
+# ------------------------------------------------------------
+def snapshots() -> list:
+    """Kopifiler, nyeste først."""
+    try:
+        names = [n for n in os.listdir(SNAPSHOT_DIR) if n.startswith("report-") and n.endswith(".db")]
+    except FileNotFoundError:
+        return []
+    return [os.path.join(SNAPSHOT_DIR, n) for n in sorted(names, reverse=True)]
+
+
+def current() -> Optional[str]:
+    global _cached
+    try:
+        gen = os.stat(SNAPSHOT_DIR).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if _cached[0] != gen:
+        files = snapshots()
+        _cached = (gen, files[0] if files else None)
+    return _cached[1]
+
+
+def taken_at(path: Optional[str]) -> Optional[datetime]:
+    if not path:
+        return None
+    try:
+        return datetime.utcfromtimestamp(int(os.path.basename(path)[7:-3]) / 1e9)
+    except ValueError:
+        return None
+
+
+def age_s() -> Optional[float]:
+    t = taken_at(current())
+    return (datetime.utcnow() - t).total_seconds() if t else None
+
+
+def refresh() -> str:
+    """Lager en ny kopi med backup-API-et (én lesetransaksjon – skrivere i WAL venter ikke)."""
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    final = os.path.join(SNAPSHOT_DIR, f"report-{time.time_ns()}.db")
+    tmp = final + ".tmp"
+    src = sqlite3.connect(DB_PATH, timeout=30)
+    dst = sqlite3.connect(tmp)
+    try:
+        src.backup(dst)
+        dst.execute("PRAGMA journal_mode=DELETE")  # kopien skal kunne åpnes immutable uten -wal/-shm
+    finally:
+        dst.close()
+        src.close()
+    os.replace(tmp, final)
+    _cleanup()
+    return final
+
+
+def refresh_if_stale() -> Optional[str]:
+    # Flere prosesser kan dele katalogen; den som først ser en gammel kopi lager ny
+    age = age_s()
+    if SNAPSHOT_S <= 0 or (age is not None and age < SNAPSHOT_S * 0.9):
+        return None
+    return refresh()
+
+
+def _cleanup() -> None:
+    # Eldre kopier kan fortsatt være åpne en stund (på Windows kan de da ikke slettes) – prøv igjen neste gang
+    for path in snapshots()[KEEP:]:
+        t = taken_at(path)
+        if t and (datetime.utcnow() - t).total_seconds() < SNAPSHOT_S * 2 + 60:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# ------------------------------------------------------------
+# Motor
+# ------------------------------------------------------------
+def _connect():
+    if SNAPSHOT_S > 0:
+        path = current() or refresh()
+        return sqlite3.connect(_uri(path, immutable=True), uri=True, check_same_thread=False)
+    return sqlite3.connect(_uri(DB_PATH), uri=True, check_same_thread=False, timeout=5)
+
+
+# URL-en brukes bare til dialekt/pool-valg; forbindelsene lages av _connect
+read_engine = create_engine(f"sqlite:///{DB_PATH}", creator=_connect, pool_size=5, max_overflow=5, future=True)
+
+
+@event.listens_for(read_engine, "connect")
+def _remember_source(dbapi_conn, record):
+    record.info["report_src"] = current() if SNAPSHOT_S > 0 else DB_PATH
+
+
+@event.listens_for(read_engine, "checkout")
+def _drop_stale(dbapi_conn, record, proxy):
+    # Ny kopi siden forbindelsen ble åpnet: la poolen åpne en ny
+    if SNAPSHOT_S > 0 and record.info.get("report_src") != current():
+        raise DisconnectionError()
+
+
+archive.install(read_engine)
+
+
+ReportSession = sessionmaker(bind=read_engine, autoflush=False, future=True)
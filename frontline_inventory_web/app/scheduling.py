@@ -0,0 +1,182 @@
+# app/scheduling.py
+"""Opptak av requester pr ruteklasse, så skanning ikke venter på eksport.
+
+Hver prosess har SLOTS plasser for requester som er i gang. Rutene deles i klasser:
+
+- scan    – /receive, /po/scan, oppslag og /api/ops fra skannerne. Har RESERVED
+            plasser som bare de kan bruke, og slippes først til når noe blir ledig.
+- heavy   – eksport, rapporter, PDF-er, /api/changes og import. Maks HEAVY samtidig;
+            resten står i kø (maks HEAVY_QUEUE) og får 429 + Retry-After når køen er
+            full eller de har ventet WAIT_S sekunder.
+- default – alt annet (vanlige sider og skjema).
+
+SSE (/stream/) og statiske filer går utenom. Plassen holdes til hele svaret er
+sendt, så en strømmet eksport teller til den er ferdig. `stats()` gir aktive,
+ventende og avviste pr klasse (/api/scheduler og /metrics).
+"""
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+SLOTS = int(os.environ.get("INV_SCHED_SLOTS", "32"))
+RESERVED = int(os.environ.get("INV_SCHED_SCAN_RESERVED", "8"))
+HEAVY = int(os.environ.get("INV_SCHED_HEAVY", "2"))
+HEAVY_QUEUE = int(os.environ.get("INV_SCHED_HEAVY_QUEUE", "8"))
+WAIT_S = float(os.environ.get("INV_SCHED_WAIT_S", "15"))
+
+# (metode eller None = alle, prefiks, klasse eller None = utenom køen); første treff gjelder
+ROUTES = [
+    (None, "/stream/", None),
+    (None, "/static/", None),
+    (None, "/sw.js", None),
+    (None, "/receive", "scan"),
+    (None, "/po/scan", "scan"),
+    (None, "/api/item/by_sku", "scan"),  # også by_skus
+    (None, "/api/ops", "scan"),
+    (None, "/api/scan/", "scan"),
+    (None, "/api/units/", "scan"),
+    (None, "/export.", "heavy"),
+    (None, "/reports/", "heavy"),
+    (None, "/api/changes", "heavy"),
+    (None, "/api/stock/as_of", "heavy"),
+    ("POST", "/import", "heavy"),
+]
+PRIORITY = ("scan", "default", "heavy")
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    if path.endswith(".pdf"):
+        return "heavy"
+    for m, prefix, cls in ROUTES:
+        if (m is None or m == method) and path.startswith(prefix):
+            return cls
+    return "default"
+
+
+@dataclass
+class _Class:
+    name: str
+    limit: int
+    queue_max: int
+    active: int = 0
+    waiting: Deque[asyncio.Future] = field(default_factory=deque)
+    admitted: int = 0
+    queued: int = 0
+    rejected: int = 0
+    wait_s: float = 0.0
+
+
+class Scheduler:
+    def __init__(self, slots: int = SLOTS, reserved: int = RESERVED, heavy: int = HEAVY,
+                 heavy_queue: int = HEAVY_QUEUE, wait_s: float = WAIT_S) -> None:
+        self.slots = slots
+        self.reserved = min(reserved, slots - 1)
+        self.wait_timeout = wait_s
+        self.classes: Dict[str, _Class] = {
+            "scan": _Class("scan", slots, queue_max=4 * slots),
+            "default": _Class("default", slots, queue_max=4 * slots),
+            "heavy": _Class("heavy", max(1, heavy), queue_max=heavy_queue),
+        }
+
+    def _can_start(self, c: _Class) -> bool:
+        if c.active >= c.limit:
+            return False
+        free = self.slots - sum(x.active for x in self.classes.values())
+        if c.name != "scan":
+            free -= max(0, self.reserved - self.classes["scan"].active)
+        return free > 0
+
+    def _wake(self) -> None:
+        for name in PRIORITY:
+            c = self.classes[name]
+            while c.waiting and self._can_start(c):
+                fut = c.waiting.popleft()
+                c.active += 1
+                fut.set_result(None)
+
+    async def acquire(self, name: str) -> bool:
+        """True når requesten har plass; False betyr 429 (kø full eller ventet for lenge)."""
+        c = self.classes[name]
+        if not c.waiting and self._can_start(c):
+            c.active += 1
+            c.admitted += 1
+            return True
+        if len(c.waiting) >= c.queue_max:
+            c.rejected += 1
+            return False
+        fut = asyncio.get_running_loop().create_future()
+        c.waiting.append(fut)
+        c.queued += 1
+        t = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), self.wait_timeout)
+        except asyncio.TimeoutError:
+            pass
+        except BaseException:
+            # Klienten koblet fra mens den ventet: gi fra oss plassen hvis vi rakk å få den
+            if fut.done() and not fut.cancelled():
+                self.release(name)
+            else:
+                self._drop(c, fut)
+            raise
+        finally:
+            c.wait_s += time.perf_counter() - t
+        if fut.done() and not fut.cancelled():
+            c.admitted += 1
+            return True
+        self._drop(c, fut)
+        c.rejected += 1
+        return False
+
+    @staticmethod
+    def _drop(c: _Class, fut: asyncio.Future) -> None:
+        fut.cancel()
+        try:
+            c.waiting.remove(fut)
+        except ValueError:
+            pass
+
+    def release(self, name: str) -> None:
+        self.classes[name].active -= 1
+        self._wake()
+
+    def stats(self) -> Dict[str, dict]:
+        return {name: {
+            "active": c.active, "waiting": len(c.waiting), "limit": c.limit,
+            "admitted": c.admitted, "queued": c.queued, "rejected": c.rejected, "wait_seconds": round(c.wait_s, 3),
+        } for name, c in self.classes.items()}
+
+
+scheduler = Scheduler()
+
+
+class SchedulerMiddleware:
+    def __init__(self, app: ASGIApp, sched: Scheduler = scheduler) -> None:
+        self.app = app
+        self.sched = sched
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        name = classify(scope.get("method", "GET"), scope.get("path", "")) if scope["type"] == "http" else None
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+        if not await self.sched.acquire(name):
+            body = json.dumps({"detail": "Serveren er opptatt med tunge forespørsler – prøv igjen om litt"},
+                              ensure_ascii=False).encode()
+            retry = str(max(1, int(self.sched.wait_timeout // 3)))
+            await send({"type": "http.response.start", "status": 429, "headers": [
+                (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                (b"retry-after", retry.encode()),
+            ]})
+            await send({"type": "http.response.body", "body": body})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.sched.release(name)
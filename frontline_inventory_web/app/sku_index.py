@@ -0,0 +1,178 @@
+# app/sku_index.py
+"""Prosess-global oppslagsindeks for varer (SKU/navn).
+
+- eksakt SKU -> vare (dict)
+- prefiks-autocomplete via sortert liste + bisect (SKU, navn og hvert ord i navnet)
+- fuzzy-treff med difflib for feilskann/skrivefeil
+
+Indeksen varmes ved oppstart og holdes oppdatert via endringsvarsler fra
+sesjonen (se changes.py). Ved bulk-endringer lastes den på nytt ved neste bruk.
+"""
+import threading
+from bisect import bisect_left, insort
+from difflib import get_close_matches
+from typing import Dict, List, NamedTuple, Optional
+
+from sqlalchemy import select
+
+from . import changes
+from .db import SessionLocal
+from .models import Item
+
+
+class Entry(NamedTuple):
+    id: int
+    sku: str
+    name: str
+
+    def as_dict(self) -> dict:
+        return {"id": self.id, "sku": self.sku, "name": self.name}
+
+
+def _keys(e: Entry) -> set:
+    keys = {e.sku.lower(), (e.name or "").lower()}
+    keys.update(w for w in (e.name or "").lower().split() if len(w) > 1)
+    keys.discard("")
+    return keys
+
+
+class SkuIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._by_sku: Dict[str, Entry] = {}
+        self._by_id: Dict[int, Entry] = {}
+        self._prefix: List[tuple] = []  # sortert (nøkkel, id)
+        self._ready = False
+
+    # ---------- vedlikehold ----------
+    def warm(self) -> int:
+        seen_version = changes.version("items")
+        db = SessionLocal()
+        try:
+            rows = db.execute(select(Item.id, Item.sku, Item.name)).all()
+        finally:
+            db.close()
+        by_sku, by_id, prefix = {}, {}, []
+        for r in rows:
+            e = Entry(int(r.id), r.sku or "", r.name or "")
+            by_sku[e.sku] = e
+            by_id[e.id] = e
+            prefix.extend((k, e.id) for k in _keys(e))
+        prefix.sort()
+        with self._lock:
+            self._by_sku, self._by_id, self._prefix = by_sku, by_id, prefix
+            # Endret noe mens vi leste? Da kan vi ha gått glipp av det – last på nytt neste gang
+            self._ready = changes.version("items") == seen_version
+        return len(by_id)
+
+    def _ensure(self):
+        if not self._ready:
+            self.warm()
+
+    def invalidate(self):
+        with self._lock:
+            self._ready = False
+
+    def _remove(self, item_id: int):
+        e = self._by_id.pop(item_id, None)
+        if not e:
+            return
+        if self._by_sku.get(e.sku) is e:
+            del self._by_sku[e.sku]
+        for k in _keys(e):
+            i = bisect_left(self._prefix, (k, e.id))
+            if i < len(self._prefix) and self._prefix[i] == (k, e.id):
+                del self._prefix[i]
+
+    def _put(self, e: Entry):
+        self._remove(e.id)
+        self._by_sku[e.sku] = e
+        self._by_id[e.id] = e
+        for k in _keys(e):
+            insort(self._prefix, (k, e.id))
+
+    def apply(self, cs: "changes.ChangeSet"):
+        if cs.bulk:
+            self.invalidate()
+            return
+        with self._lock:
+            if not self._ready:
+                return
+            for row in cs.rows:
+                item_id = row.get("id")
+                if item_id is None:
+                    continue
+                if row["op"] == "delete":
+                    self._remove(int(item_id))
+                    continue
+                old = self._by_id.get(int(item_id))
+                sku = row.get("sku", old.sku if old else None)
+                name = row.get("name", old.name if old else "")
+                if sku is None:
+                    # Vi vet ikke nok om raden – last alt på nytt ved neste bruk
+                    self._ready = False
+                    return
+                e = Entry(int(item_id), sku, name or "")
+                if e != old:  # mottak/justering endrer qty/pris, ikke SKU/navn
+                    self._put(e)
+
+    # ---------- oppslag ----------
+    def get(self, sku: str) -> Optional[Entry]:
+        self._ensure()
+        return self._by_sku.get((sku or "").strip())
+
+    def prefix(self, q: str, limit: int = 20) -> List[Entry]:
+        self._ensure()
+        q = (q or "").strip().lower()
+        if not q:
+            return []
+        out, seen = [], set()
+        with self._lock:
+            i = bisect_left(self._prefix, (q,))
+            while i < len(self._prefix) and len(out) < limit:
+                key, item_id = self._prefix[i]
+                if not key.startswith(q):
+                    break
+                if item_id not in seen:
+                    seen.add(item_id)
+                    out.append(self._by_id[item_id])
+                i += 1
+        return out
+
+    def fuzzy(self, q: str, limit: int = 10, cutoff: float = 0.6) -> List[Entry]:
+        self._ensure()
+        q = (q or "").strip().lower()
+        if len(q) < 3:
+            return []
+        with self._lock:
+            candidates: Dict[str, int] = {}
+            for key, item_id in self._prefix:
+                candidates.setdefault(key, item_id)
+        out, seen = [], set()
+        for key in get_close_matches(q, candidates.keys(), n=limit * 3, cutoff=cutoff):
+            item_id = candidates[key]
+            if item_id not in seen and item_id in self._by_id:
+                seen.add(item_id)
+                out.append(self._by_id[item_id])
+            if len(out) >= limit:
+                break
+        return out
+
+    def suggest(self, q: str, limit: int = 20) -> List[Entry]:
+        """Eksakt SKU først, så prefiks-treff, og fuzzy hvis det er plass igjen."""
+        out: List[Entry] = []
+        exact = self.get(q)
+        if exact:
+            out.append(exact)
+        for e in self.prefix(q, limit):
+            if e not in out:
+                out.append(e)
+        if len(out) < limit:
+            for e in self.fuzzy(q, limit - len(out)):
+                if e not in out:
+                    out.append(e)
+        return out[:limit]
+
+
+index = SkuIndex()
+changes.on_change("items", index.apply)
@@ -0,0 +1,206 @@
+# app/snapshots.py
+"""Historisk lagerbeholdning ("beholdning per dato").
+
+Et daglig snapshot lagrer pr vare antall (items.qty), ledige/reserverte/brukte
+enheter og lagerverdi. Beholdningen på et tidspunkt er nærmeste snapshot
+± summen av Tx.delta mellom snapshotet og tidspunktet. Kostnaden avhenger
+derfor av avstanden til nærmeste snapshot, ikke av hele historikken. Nåtilstanden
+regnes som et snapshot når den ligger nærmest.
+
+Ledig/reservert/brukt er tallene fra selve snapshotet (reservasjoner har
+delta 0); antall og verdi justeres med Tx. Etter KEEP_DAILY_DAYS beholdes
+bare første snapshot i hver måned.
+"""
+from datetime import date, datetime, time as dtime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from sqlalchemy import case, delete, func, insert, literal, select
+from sqlalchemy.orm import Session
+
+from .archive import tx_all
+from .db import SessionLocal
+from .models import Item, ItemUnit, StockSnapshot
+
+KEEP_DAILY_DAYS = 90
+
+_AVAILABLE = ("available", "ledig")
+_RESERVED = ("reserved", "reservert")
+_USED = ("used", "brukt")
+
+
+class AsOf(NamedTuple):
+    item_id: int
+    qty: int
+    available: int
+    reserved: int
+    used: int
+    value: float
+
+
+def _live_select(day: Optional[date] = None, taken_at: Optional[datetime] = None):
+    """Nåtilstand pr vare i én spørring (samme kolonner som stock_snapshots)."""
+    cols = [
+        Item.id.label("item_id"),
+        func.coalesce(Item.qty, 0).label("qty"),
+        func.coalesce(func.sum(case((ItemUnit.status.in_(_AVAILABLE), ItemUnit.qty), else_=0)), 0).label("qty_available"),
+        func.coalesce(func.sum(case((ItemUnit.status.in_(_RESERVED), ItemUnit.qty), else_=0)), 0).label("qty_reserved"),
+        func.coalesce(func.sum(case((ItemUnit.status.in_(_USED), ItemUnit.qty), else_=0)), 0).label("qty_used"),
+        func.coalesce(func.sum(case((ItemUnit.status.in_(_AVAILABLE + _RESERVED), ItemUnit.purchase_price * ItemUnit.qty), else_=0)), 0).label("value"),
+    ]
+    if day is not None:
+        cols = [literal(day).label("day"), literal(taken_at).label("taken_at")] + cols
+    return select(*cols).select_from(Item).outerjoin(ItemUnit, ItemUnit.item_id == Item.id).group_by(Item.id)
+
+
+# ------------------------------------------------------------
+# Skriving
+# ------------------------------------------------------------
+def take_snapshot(db: Session, day: Optional[date] = None) -> int:
+    """Tar (eller tar på nytt) snapshot for `day` (default i dag, UTC). Returnerer antall varer."""
+    taken_at = datetime.utcnow()
+    day = day or taken_at.date()
+    db.execute(delete(StockSnapshot).where(StockSnapshot.day == day))
+    cols = ["day", "taken_at", "item_id", "qty", "qty_available", "qty_reserved", "qty_used", "value"]
+    res = db.execute(insert(StockSnapshot).from_select(cols, _live_select(day, taken_at)))
+    db.commit()
+    return res.rowcount or 0
+
+
+def prune(db: Session, keep_daily_days: int = KEEP_DAILY_DAYS) -> int:
+    cutoff = datetime.utcnow().date() - timedelta(days=keep_daily_days)
+    first_in_month = select(func.min(StockSnapshot.day)).group_by(func.strftime("%Y-%m", StockSnapshot.day))
+    res = db.execute(delete(StockSnapshot).where(StockSnapshot.day < cutoff, StockSnapshot.day.not_in(first_in_month)))
+    db.commit()
+    return res.rowcount or 0
+
+
+def run_daily() -> int:
+    """Tar dagens snapshot hvis det mangler. Trygt å kalle ofte."""
+    db = SessionLocal()
+    try:
+        today = datetime.utcnow().date()
+        if db.execute(select(StockSnapshot.id).where(StockSnapshot.day == today).limit(1)).first():
+            return 0
+        n = take_snapshot(db, today)
+        prune(db)
+        return n
+    finally:
+        db.close()
+
+
+# ------------------------------------------------------------
+# Lesing
+# ------------------------------------------------------------
+def end_of_day(d: date) -> datetime:
+    """Beholdning "per dato" = ved dagens slutt (UTC)."""
+    return datetime.combine(d + timedelta(days=1), dtime.min)
+
+
+def _deltas(db: Session, lo: datetime, hi: datetime, item_ids: Optional[Iterable[int]]) -> Dict[int, int]:
+    stmt = (
+        select(tx_all.c.item_id, func.sum(tx_all.c.delta))
+        .where(tx_all.c.ts > lo, tx_all.c.ts <= hi, tx_all.c.item_id.is_not(None))
+        .group_by(tx_all.c.item_id)
+    )
+    if item_ids is not None:
+        stmt = stmt.where(tx_all.c.item_id.in_(list(item_ids)))
+    return {int(i): int(d or 0) for i, d in db.execute(stmt).all()}
+
+
+def nearest_base(db: Session, at: datetime) -> tuple:
+    """('snapshot' | 'live', taken_at) nærmest `at` – snapshot før, snapshot etter eller nå."""
+    now = datetime.utcnow()
+    before = db.execute(select(func.max(StockSnapshot.taken_at)).where(StockSnapshot.taken_at <= at)).scalar()
+    after = db.execute(select(func.min(StockSnapshot.taken_at)).where(StockSnapshot.taken_at > at)).scalar()
+    options = [("live", now, abs(now - at))]
+    if before is not None:
+        options.append(("snapshot", before, at - before))
+    if after is not None:
+        options.append(("snapshot", after, after - at))
+    kind, ts, _ = min(options, key=lambda o: o[2])
+    return kind, ts
+
+
+def stock_as_of(db: Session, at: datetime, item_ids: Optional[Iterable[int]] = None) -> Dict[int, AsOf]:
+    """Beholdning pr vare på tidspunktet `at` (UTC)."""
+    if item_ids is not None:
+        item_ids = list(item_ids)
+    kind, base_ts = nearest_base(db, at)
+    if kind == "live":
+        stmt = _live_select()
+        if item_ids is not None:
+            stmt = stmt.where(Item.id.in_(item_ids))
+    else:
+        stmt = select(StockSnapshot.item_id, StockSnapshot.qty, StockSnapshot.qty_available,
+                      StockSnapshot.qty_reserved, StockSnapshot.qty_used, StockSnapshot.value
+                      ).where(StockSnapshot.taken_at == base_ts)
+        if item_ids is not None:
+            stmt = stmt.where(StockSnapshot.item_id.in_(item_ids))
+    base = {int(r[0]): r for r in db.execute(stmt).all()}
+
+    # Fremover fra et eldre utgangspunkt, bakover fra et nyere
+    if base_ts <= at:
+        sign, deltas = 1, _deltas(db, base_ts, at, item_ids)
+    else:
+        sign, deltas = -1, _deltas(db, at, base_ts, item_ids)
+
+    out: Dict[int, AsOf] = {}
+    for item_id in set(base) | set(deltas):
+        r = base.get(item_id)
+        b_qty, avail, res, used, b_value = (int(r[1] or 0), int(r[2] or 0), int(r[3] or 0), int(r[4] or 0), float(r[5] or 0)) if r else (0, 0, 0, 0, 0.0)
+        d = sign * deltas.get(item_id, 0)
+        unit_value = (b_value / b_qty) if b_qty else 0.0
+        out[item_id] = AsOf(item_id, max(0, b_qty + d), avail, res, used, round(max(0.0, b_value + d * unit_value), 2))
+    return out
+
+
+def period_report(db: Session, start: date, end: date) -> List[dict]:
+    """Periodeoversikt pr vare: inngående, mottatt, uttak og utgående beholdning (begge datoer inklusive)."""
+    lo, hi = datetime.combine(start, dtime.min), end_of_day(end)
+    opening = stock_as_of(db, lo)
+    closing = stock_as_of(db, hi)
+    moves = {
+        int(i): (int(inn or 0), int(ut or 0))
+        for i, inn, ut in db.execute(
+            select(
+                tx_all.c.item_id,
+                func.sum(case((tx_all.c.delta > 0, tx_all.c.delta), else_=0)),
+                func.sum(case((tx_all.c.delta < 0, -tx_all.c.delta), else_=0)),
+            )
+            .where(tx_all.c.ts > lo, tx_all.c.ts <= hi, tx_all.c.item_id.is_not(None))
+            .group_by(tx_all.c.item_id)
+        ).all()
+    }
+    items = {r.id: r for r in db.execute(select(Item.id, Item.sku, Item.name)).all()}
+    rows = []
+    for item_id in sorted(set(opening) | set(closing) | set(moves)):
+        it = items.get(item_id)
+        o, c = opening.get(item_id), closing.get(item_id)
+        inn, ut = moves.get(item_id, (0, 0))
+        rows.append({
+            "item_id": item_id,
+            "sku": it.sku if it else "",
+            "name": it.name if it else "(slettet vare)",
+            "opening": o.qty if o else 0,
+            "received": inn,
+            "issued": ut,
+            "closing": c.qty if c else 0,
+            "closing_value": c.value if c else 0.0,
+        })
+    return rows
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Lagersnapshots.")
+    ap.add_argument("cmd", choices=("take", "prune"))
+    args = ap.parse_args()
+    db = SessionLocal()
+    try:
+        if args.cmd == "take":
+            print(f"✅ Snapshot tatt for {take_snapshot(db)} varer")
+        else:
+            print(f"✅ {prune(db)} gamle snapshot-rader fjernet")
+    finally:
+        db.close()
@@ -0,0 +1,70 @@
+# app/startup.py
+"""Oppstartsfaser og tidsmåling.
+
+Importeres først i main.py, slik at `T0` ligger rett før resten av appen
+lastes. main.py registrerer fasene i lifespan; `python -m app.profile_startup`
+leser dem ut.
+"""
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+T0 = time.perf_counter()
+phases: Dict[str, float] = {}  # fase -> ms, i den rekkefølgen de kjørte
+_ready_start: Optional[float] = None
+_ready_ms: Optional[float] = None
+
+
+def _ms(since: float) -> float:
+    return (time.perf_counter() - since) * 1000
+
+
+@contextmanager
+def phase(name: str):
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[name] = _ms(t)
+
+
+def mark_imported() -> None:
+    phases["import app.main"] = _ms(T0)
+
+
+def mark_ready_start() -> None:
+    global _ready_start
+    _ready_start = time.perf_counter()
+
+
+def mark_ready() -> None:
+    global _ready_ms
+    _ready_ms = phases.get("import app.main", 0.0) + (_ms(_ready_start) if _ready_start else 0.0)
+
+
+def ready_ms() -> float:
+    """Tid fra import startet til lifespan var klar til å ta imot trafikk."""
+    return _ready_ms or 0.0
+
+
+def precompile_templates(*envs) -> int:
+    """Kompilerer alle maler på forhånd, så første request slipper å gjøre det.
+
+    Bytecode caches på disk (jinja2 sin standardmappe under tmp), slik at en
+    omstart bare trenger å laste ferdig kompilerte maler.
+    """
+    from jinja2 import FileSystemBytecodeCache
+
+    n = 0
+    for env in envs:
+        if env.bytecode_cache is None:
+            env.bytecode_cache = FileSystemBytecodeCache()
+        for name in env.list_templates(extensions=["html"]):
+            env.get_template(name)
+            n += 1
+    return n
+
+
+def summary() -> str:
+    parts = ", ".join(f"{k} {v:.0f} ms" for k, v in phases.items())
+    return f"klar på {ready_ms():.0f} ms ({parts})"
@@ -0,0 +1,58 @@
+// Fremdrift for bakgrunnsjobber: oppdaterer elementer med data-job-id fra SSE (/stream/tx, type 'job').
+// Bruk: <div data-job-id="12"> med [data-f=status|message|bar|count|result] og knapper [data-act=cancel|retry]
+(function () {
+  const LABEL = { queued: 'I kø', running: 'Kjører', done: 'Ferdig', failed: 'Feilet', cancelled: 'Avbrutt' };
+  const COLOR = { queued: 'text-zinc-600', running: 'text-sky-700', done: 'text-emerald-700', failed: 'text-rose-700', cancelled: 'text-amber-700' };
+
+  function render(el, job) {
+    const f = (name) => el.querySelector(`[data-f="${name}"]`);
+    const pct = job.total ? Math.min(100, Math.round(100 * job.progress / job.total)) : (job.status === 'done' ? 100 : 0);
+    if (f('status')) { f('status').textContent = LABEL[job.status] || job.status; f('status').className = 'font-medium ' + (COLOR[job.status] || ''); }
+    if (f('message')) f('message').textContent = job.message || '';
+    if (f('bar')) f('bar').style.width = pct + '%';
+    if (f('count')) f('count').textContent = job.total ? `${job.progress} / ${job.total}` : '';
+    if (f('result')) f('result').textContent = job.status === 'failed' ? (job.error || '').trim().split('\n').pop() : ((job.result && job.result.message) || '');
+    el.querySelectorAll('[data-act="cancel"]').forEach(b => b.hidden = !(job.status === 'queued' || job.status === 'running') || job.cancel_requested);
+    el.querySelectorAll('[data-act="retry"]').forEach(b => b.hidden = !(job.status === 'failed' || job.status === 'cancelled'));
+  }
+
+  async function act(el, action) {
+    try {
+      const r = await fetch(`/api/jobs/${el.dataset.jobId}/${action}`, { method: 'POST', credentials: 'same-origin' });
+      if (r.ok) render(el, await r.json());
+    } catch (e) {}
+  }
+
+  function wire(el) {
+    if (el.dataset.wired) return;
+    el.dataset.wired = '1';
+    el.querySelectorAll('[data-act]').forEach(b => b.addEventListener('click', (e) => { e.preventDefault(); act(el, b.dataset.act); }));
+  }
+
+  let source = null;
+  function listen() {
+    if (source) return;
+    source = new EventSource('/stream/tx');
+    source.onmessage = (e) => {
+      try {
+        const d = JSON.parse(e.data);
+        if (d.type !== 'job') return;
+        document.querySelectorAll(`[data-job-id="${d.id}"]`).forEach(el => render(el, d));
+        document.dispatchEvent(new CustomEvent('job', { detail: d }));
+      } catch (err) {}
+    };
+  }
+
+  // Henter gjeldende status først, så vi ikke går glipp av hendelser før strømmen var oppe
+  async function watch(el) {
+    wire(el);
+    listen();
+    try {
+      const r = await fetch(`/api/jobs/${el.dataset.jobId}`, { credentials: 'same-origin' });
+      if (r.ok) render(el, await r.json());
+    } catch (e) {}
+  }
+
+  window.Jobs = { watch, render };
+  document.querySelectorAll('[data-job-id]').forEach(el => { wire(el); listen(); });
+})();
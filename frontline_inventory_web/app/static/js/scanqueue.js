@@ -0,0 +1,124 @@
+// Offline-kø for skann: operasjoner lagres i IndexedDB og sendes samlet (gzip) til /api/ops.
+// Hver operasjon har en klient-generert op_id, så serveren kan trygt få samme operasjon flere ganger.
+// Fila brukes både fra sidene og fra service workeren (sw.js).
+(function (global) {
+  const DB_NAME = 'frontline-scanqueue';
+  const STORE = 'ops';
+  const BATCH = 500;
+  const listeners = [];
+  let flushing = false;
+  let retryDelay = 0;
+  let timer = null;
+  let lastError = null;
+
+  function openDb() {
+    return new Promise((resolve, reject) => {
+      const req = indexedDB.open(DB_NAME, 1);
+      req.onupgradeneeded = () => req.result.createObjectStore(STORE, { keyPath: 'seq', autoIncrement: true });
+      req.onsuccess = () => resolve(req.result);
+      req.onerror = () => reject(req.error);
+    });
+  }
+
+  async function withStore(mode, fn) {
+    const db = await openDb();
+    return new Promise((resolve, reject) => {
+      const t = db.transaction(STORE, mode);
+      const out = fn(t.objectStore(STORE));
+      t.oncomplete = () => { db.close(); resolve(out && 'result' in out ? out.result : out); };
+      t.onerror = () => { db.close(); reject(t.error); };
+    });
+  }
+
+  function uuid() {
+    if (global.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return 'op-' + Date.now().toString(36) + '-' + Math.random().toString(36).slice(2, 12);
+  }
+
+  function peek(limit) {
+    return withStore('readonly', s => s.getAll(null, limit));
+  }
+
+  function count() {
+    return withStore('readonly', s => s.count());
+  }
+
+  function remove(seqs) {
+    return withStore('readwrite', s => { seqs.forEach(k => s.delete(k)); });
+  }
+
+  async function emit(extra) {
+    const state = Object.assign({ pending: await count(), online: global.navigator ? navigator.onLine : true, error: lastError }, extra || {});
+    listeners.forEach(fn => { try { fn(state); } catch (e) {} });
+  }
+
+  async function gzip(text) {
+    if (typeof CompressionStream === 'undefined') return null;
+    const stream = new Blob([text]).stream().pipeThrough(new CompressionStream('gzip'));
+    return await new Response(stream).arrayBuffer();
+  }
+
+  function schedule(ms) {
+    clearTimeout(timer);
+    timer = setTimeout(flush, ms);
+  }
+
+  async function enqueue(kind, payload) {
+    const op = { op_id: uuid(), kind, payload, ts: Date.now() };
+    await withStore('readwrite', s => s.add(op));
+    await emit();
+    if (global.navigator && global.navigator.serviceWorker && global.navigator.serviceWorker.ready) {
+      navigator.serviceWorker.ready.then(r => r.sync && r.sync.register('scanqueue')).catch(() => {});
+    }
+    schedule(0);
+    return op.op_id;
+  }
+
+  async function flush() {
+    if (flushing) return;
+    flushing = true;
+    try {
+      for (;;) {
+        const ops = await peek(BATCH);
+        if (!ops.length) break;
+        const json = JSON.stringify({ ops: ops.map(o => ({ op_id: o.op_id, kind: o.kind, payload: o.payload })) });
+        const body = await gzip(json);
+        const headers = { 'Content-Type': 'application/json' };
+        if (body) headers['Content-Encoding'] = 'gzip';
+        const res = await fetch('/api/ops', { method: 'POST', credentials: 'same-origin', redirect: 'manual', headers, body: body || json });
+        if (res.type === 'opaqueredirect' || res.status === 303) throw new Error('Ikke innlogget');
+        if (!res.ok) throw new Error('HTTP ' + res.status);
+        const j = await res.json();
+        // Alle sendte operasjoner er nå behandlet (brukt, duplikat eller permanent feil)
+        await remove(ops.map(o => o.seq));
+        lastError = null;
+        retryDelay = 0;
+        await emit({ results: j.results || [] });
+      }
+    } catch (e) {
+      lastError = String(e && e.message || e);
+      // Eksponentiell backoff med jitter, så 30 nettbrett som kommer tilbake samtidig sprer seg utover
+      retryDelay = Math.min(60000, Math.max(2000, retryDelay * 2));
+      schedule(retryDelay * (0.5 + Math.random()));
+      await emit();
+    } finally {
+      flushing = false;
+    }
+  }
+
+  function on(fn) {
+    listeners.push(fn);
+    emit();
+  }
+
+  global.ScanQueue = { enqueue, flush, count, on };
+
+  if (typeof window !== 'undefined') {
+    window.addEventListener('online', () => schedule(Math.random() * 5000));
+    window.addEventListener('offline', () => emit());
+    if ('serviceWorker' in navigator) {
+      navigator.serviceWorker.register('/sw.js').catch(() => {});
+    }
+    schedule(1000);
+  }
+})(self);
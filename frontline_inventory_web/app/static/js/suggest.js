@@ -0,0 +1,33 @@
+// Autocomplete for SKU-felter via /api/items/suggest (erstatter datalister rendret på serveren).
+// Bruk: <input name="sku" list="items_skus"> + <datalist id="items_skus"></datalist>
+(function () {
+  function attach(input) {
+    const list = document.getElementById(input.getAttribute('list'));
+    if (!list) return;
+    let timer = null;
+    let last = '';
+    input.addEventListener('input', () => {
+      clearTimeout(timer);
+      timer = setTimeout(async () => {
+        const q = input.value.trim();
+        if (!q || q === last) return;
+        last = q;
+        try {
+          const r = await fetch(`/api/items/suggest?q=${encodeURIComponent(q)}&limit=20`, { credentials: 'same-origin' });
+          if (!r.ok) return;
+          const rows = await r.json();
+          list.innerHTML = '';
+          for (const it of rows) {
+            const opt = document.createElement('option');
+            opt.value = it.sku;
+            opt.label = it.name;
+            list.appendChild(opt);
+          }
+        } catch (e) {}
+      }, 150);
+    });
+  }
+  document.querySelectorAll('input[list]').forEach(inp => {
+    if (inp.dataset.suggest !== undefined) attach(inp);
+  });
+})();
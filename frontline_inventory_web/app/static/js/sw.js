@@ -0,0 +1,60 @@
+// Service worker for skannesidene: sidene og skriptene caches slik at /receive og /po/scan
+// åpner uten nett, og køen i scanqueue.js tømmes via Background Sync når nettet er tilbake.
+importScripts('/static/js/scanqueue.js');
+
+const CACHE = 'frontline-scan-v1';
+const PAGES = ['/receive', '/po/scan'];
+
+self.addEventListener('install', () => self.skipWaiting());
+
+self.addEventListener('activate', event => {
+  event.waitUntil((async () => {
+    for (const key of await caches.keys()) {
+      if (key !== CACHE) await caches.delete(key);
+    }
+    await self.clients.claim();
+  })());
+});
+
+async function networkFirst(request) {
+  const cache = await caches.open(CACHE);
+  try {
+    const res = await fetch(request);
+    // Ikke cache innloggingssiden under /receive
+    if (res.ok && !res.redirected) cache.put(request, res.clone());
+    return res;
+  } catch (e) {
+    const hit = await cache.match(request, { ignoreSearch: true });
+    if (hit) return hit;
+    throw e;
+  }
+}
+
+async function cacheFirst(request) {
+  const cache = await caches.open(CACHE);
+  const hit = await cache.match(request);
+  if (hit) return hit;
+  const res = await fetch(request);
+  if (res.ok || res.type === 'opaque') cache.put(request, res.clone());
+  return res;
+}
+
+self.addEventListener('fetch', event => {
+  const req = event.request;
+  if (req.method !== 'GET') return;
+  const url = new URL(req.url);
+  if (url.origin === self.location.origin) {
+    if (req.mode === 'navigate' && PAGES.includes(url.pathname)) {
+      event.respondWith(networkFirst(req));
+    } else if (url.pathname.startsWith('/static/')) {
+      event.respondWith(cacheFirst(req));
+    }
+  } else if (req.destination === 'script' || req.destination === 'style') {
+    // Tailwind/htmx/ZXing fra CDN
+    event.respondWith(cacheFirst(req));
+  }
+});
+
+self.addEventListener('sync', event => {
+  if (event.tag === 'scanqueue') event.waitUntil(self.ScanQueue.flush());
+});
@@ -0,0 +1,153 @@
+# app/unitcodes.py
+"""Identitet for enkeltenheter: strekkode og serienummer.
+
+Hver rad i item_units får en strekkode ved mottak (`U` + id med 8 siffer).
+Den står på etiketten (`/item/{id}/labels`) og er det skannerne leser.
+Serienummer er valgfritt og oppgis ved mottak, ett pr enhet. Begge
+kolonnene har unik indeks, så en skannet kode slås opp med ett indeksoppslag
+som også henter vare, PO og CO. `resolve()` tar hundrevis av koder med én
+spørring pr CHUNK.
+"""
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import func, literal, or_, select, update
+from sqlalchemy.orm import Session
+
+from .models import CustomerOrder, Item, ItemUnit, PurchaseOrder
+
+PREFIX = "U"
+CHUNK = 400  # to IN-lister pr spørring
+MAX_CODES = 2000
+
+
+def code_for(unit_id: int) -> str:
+    return f"{PREFIX}{unit_id:08d}"
+
+
+def label_new(db: Session, item_ids: Iterable[int]) -> None:
+    """Gir nye rader (uten strekkode) for varene en kode – kalles etter mottak."""
+    ids = sorted({i for i in item_ids if i is not None})
+    if not ids:
+        return
+    db.flush()
+    db.execute(
+        update(ItemUnit)
+        .where(ItemUnit.item_id.in_(ids), ItemUnit.barcode.is_(None))
+        .values(barcode=literal(PREFIX) + func.printf("%08d", ItemUnit.id))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def clean_serials(raw) -> List[str]:
+    """Serienumre fra skjema (én pr linje / kommaseparert) eller JSON-liste."""
+    if raw is None:
+        return []
+    if isinstance(raw, str):
+        raw = raw.replace(",", "\n").splitlines()
+    if not isinstance(raw, (list, tuple)):
+        raise ValueError("'serials' må være en liste")
+    return [s for s in (str(x).strip() for x in raw) if s]
+
+
+def taken_serials(db: Session, serials: Iterable[str]) -> List[str]:
+    """Serienumre som allerede er brukt (i databasen eller to ganger i `serials`)."""
+    seen, dup = set(), set()
+    for s in serials:
+        (dup if s in seen else seen).add(s)
+    wanted = sorted(seen)
+    for i in range(0, len(wanted), CHUNK * 2):
+        dup.update(db.execute(select(ItemUnit.serial).where(ItemUnit.serial.in_(wanted[i:i + CHUNK * 2]))).scalars())
+    return sorted(dup)
+
+
+# ------------------------------------------------------------
+# Oppslag
+# ------------------------------------------------------------
+_COLS = (
+    ItemUnit.id, ItemUnit.barcode, ItemUnit.serial, ItemUnit.status, ItemUnit.qty, ItemUnit.purchase_price,
+    ItemUnit.created_at, ItemUnit.used_at,
+    Item.id.label("item_id"), Item.sku, Item.name,
+    PurchaseOrder.id.label("po_id"), PurchaseOrder.code.label("po_code"),
+    CustomerOrder.id.label("co_id"), CustomerOrder.code.label("co_code"),
+)
+
+
+def _as_dict(code: str, r) -> dict:
+    return {
+        "code": code, "found": True,
+        "unit": {"id": r.id, "barcode": r.barcode, "serial": r.serial, "status": r.status, "qty": r.qty or 1,
+                 "purchase_price": r.purchase_price,
+                 "created_at": r.created_at.isoformat() if r.created_at else None,
+                 "used_at": r.used_at.isoformat() if r.used_at else None},
+        "item": {"id": r.item_id, "sku": r.sku, "name": r.name} if r.item_id else None,
+        "po": {"id": r.po_id, "code": r.po_code} if r.po_id else None,
+        "co": {"id": r.co_id, "code": r.co_code} if r.co_id else None,
+    }
+
+
+def resolve(db: Session, codes: Iterable[str]) -> Dict[str, dict]:
+    """Kode -> enhet med vare/PO/CO. Strekkode går foran serienummer; ukjente koder gir found=False."""
+    wanted = sorted({str(c).strip() for c in codes} - {""})
+    by_barcode: Dict[str, dict] = {}
+    by_serial: Dict[str, dict] = {}
+    for i in range(0, len(wanted), CHUNK):
+        chunk = wanted[i:i + CHUNK]
+        rows = db.execute(
+            select(*_COLS)
+            .select_from(ItemUnit)
+            .outerjoin(Item, Item.id == ItemUnit.item_id)
+            .outerjoin(PurchaseOrder, PurchaseOrder.id == ItemUnit.po_id)
+            .outerjoin(CustomerOrder, CustomerOrder.id == ItemUnit.reserved_co_id)
+            .where(or_(ItemUnit.barcode.in_(chunk), ItemUnit.serial.in_(chunk)))
+        ).all()
+        for r in rows:
+            if r.barcode:
+                by_barcode[r.barcode] = r
+            if r.serial:
+                by_serial[r.serial] = r
+    out: Dict[str, dict] = {}
+    for code in wanted:
+        r = by_barcode.get(code) or by_serial.get(code)
+        out[code] = _as_dict(code, r) if r is not None else {"code": code, "found": False}
+    return out
+
+
+def resolve_one(db: Session, code: str) -> Optional[dict]:
+    hit = resolve(db, [code]).get((code or "").strip())
+    return hit if hit and hit["found"] else None
+
+
+# ------------------------------------------------------------
+# Etiketter (Code 128, tegnsett B)
+# ------------------------------------------------------------
+_C128 = (
+    "212222 222122 222221 121223 121322 131222 122213 122312 132212 221213 221312 231212 112232 122132 122231 113222 "
+    "123122 123221 223211 221132 221231 213212 223112 312131 311222 321122 321221 312212 322112 322211 212123 212321 "
+    "232121 111323 131123 131321 112313 132113 132311 211313 231113 231311 112133 112331 132131 113123 113321 133121 "
+    "313121 211331 231131 213113 213311 213131 311123 311321 331121 312113 312311 332111 314111 221411 431111 111224 "
+    "111422 121124 121421 141122 141221 112214 112412 122114 122411 142112 142211 241211 221114 413111 241112 134111 "
+    "111242 121142 121241 114212 124112 124211 411212 421112 421211 212141 214121 412121 111143 111341 131141 114113 "
+    "114311 411113 411311 113141 114131 311141 411131 211412 211214 211232 2331112"
+).split()
+_START_B, _STOP = 104, 106
+
+
+def code128_pattern(text: str) -> str:
+    """Modulbredder (strek, mellomrom, strek …) for `text` (ASCII 32–126), med start, kontrollsiffer og stopp."""
+    values = [_START_B] + [ord(ch) - 32 for ch in text if 32 <= ord(ch) <= 126]
+    check = (values[0] + sum(i * v for i, v in enumerate(values[1:], start=1))) % 103
+    return "".join(_C128[v] for v in values + [check, _STOP])
+
+
+def code128_svg(text: str, height: int = 40, module: float = 1.5) -> str:
+    """Strekkode som inline SVG."""
+    pattern = code128_pattern(text)
+    x, bars = 10 * module, []  # stille sone på 10 moduler hver side
+    for i, w in enumerate(pattern):
+        width = int(w) * module
+        if i % 2 == 0:
+            bars.append(f'<rect x="{x:g}" y="0" width="{width:g}" height="{height}"/>')
+        x += width
+    total = x + 10 * module
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {total:g} {height}" width="{total:g}" height="{height}" '
+            f'role="img" aria-label="{text}">{"".join(bars)}</svg>')
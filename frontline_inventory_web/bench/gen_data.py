@@ -0,0 +1,214 @@
+# bench/gen_data.py
+"""Syntetisk lagerdatasett for benchmarks.
+
+Skriver varer, enheter, innkjøps-/kundeordrer, kunder og transaksjoner rett
+inn i en SQLite-fil (samme skjema som appen, via app.migrations). Fordelingen
+er skjev slik som et ekte lager: noen få varer står for mesteparten av
+aktiviteten, de fleste ordrer er avsluttet og eldre PO-er er arkivert.
+
+    python -m bench.gen_data --db bench.db --items 5000 --units 50000 --txs 200000
+
+Samme --seed gir samme datasett. Innlogging for benchmark: bench@bench / bench.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+BENCH_EMAIL = "bench@bench"
+BENCH_PASSWORD = "bench"
+
+CHUNK = 10000
+
+WORDS = (
+    "skrue mutter bolt skive plugg kabel kontakt sikring rele bryter lampe driver "
+    "sensor vifte filter pakning slange kobling ventil pumpe motor rem lager hylse "
+    "brakett profil plate rør klemme strips tape lim olje fett batteri lader adapter"
+).split()
+SIZES = ("M3", "M4", "M5", "M6", "M8", "M10", "6mm", "10mm", "16A", "24V", "230V", "1m", "5m", "XL", "S")
+SUPPLIERS = ("Ahlsell", "Elektroskandia", "Würth", "Biltema", "Brødrene Dahl", "RS Components", "Farnell", "Onninen")
+
+
+def _ts(dt: datetime) -> str:
+    # Samme tekstformat som SQLAlchemy bruker for DateTime på SQLite
+    return dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def _zipf_cum(n: int, s: float = 1.1) -> list:
+    return list(accumulate(1.0 / (k ** s) for k in range(1, n + 1)))
+
+
+def _insert(conn, table: str, cols: tuple, rows) -> int:
+    sql = f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' for _ in cols)})"
+    n, buf = 0, []
+    for r in rows:
+        buf.append(r)
+        if len(buf) >= CHUNK:
+            conn.executemany(sql, buf)
+            n += len(buf)
+            buf.clear()
+    if buf:
+        conn.executemany(sql, buf)
+        n += len(buf)
+    return n
+
+
+def generate(db_path: str, items: int, units: int, pos: int, cos: int, customers: int,
+             txs: int, seed: int = 1, now: datetime | None = None) -> dict:
+    if os.path.exists(db_path):
+        raise SystemExit(f"{db_path} finnes allerede – velg en ny fil")
+    os.environ["INV_DB"] = db_path
+    from app.migrations import run_migrations  # leser INV_DB ved import
+    from app.auth import hash_password
+    from app import ledger, unitcodes
+
+    run_migrations(progress=lambda msg: None)
+
+    rnd = random.Random(seed)
+    now = now or datetime(2025, 6, 1, 12, 0, 0)
+    span = timedelta(days=730)
+
+    def when() -> datetime:
+        # Mer aktivitet nylig: trekk mot slutten av perioden
+        return now - span * (rnd.random() ** 2)
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("BEGIN")
+    counts = {}
+
+    counts["users"] = _insert(conn, "users", ("name", "email", "password_hash", "role", "created_at"),
+                              [("Bench", BENCH_EMAIL, hash_password(BENCH_PASSWORD), "admin", _ts(now - span))])
+
+    n_cat, n_loc = 20, 60
+    counts["categories"] = _insert(conn, "categories", ("name",), ((f"Kategori {i:02d}",) for i in range(1, n_cat + 1)))
+    counts["locations"] = _insert(conn, "locations", ("name",),
+                                  ((f"{chr(65 + i // 10)}{i % 10 + 1}",) for i in range(n_loc)))
+
+    def item_rows():
+        for i in range(1, items + 1):
+            name = f"{rnd.choice(WORDS).capitalize()} {rnd.choice(WORDS)} {rnd.choice(SIZES)}"
+            yield (name, f"SKU-{i:06d}", 0, rnd.choice((0, 0, 2, 5, 10)), round(rnd.lognormvariate(3.5, 1.2), 2),
+                   "NOK", "", "", rnd.randint(1, n_cat), rnd.randint(1, n_loc), _ts(when()), "unit")
+    counts["items"] = _insert(conn, "items", ("name", "sku", "qty", "min_qty", "price", "currency", "notes",
+                                               "image_path", "category_id", "location_id", "last_updated", "tracking"),
+                              item_rows())
+
+    counts["customers"] = _insert(conn, "customers", ("name", "email", "phone", "notes", "created_at"), (
+        (f"Kunde {i:04d} AS", f"post{i}@kunde.no", f"9{rnd.randint(1000000, 9999999)}", "", _ts(when()))
+        for i in range(1, customers + 1)))
+
+    # Innkjøpsordrer: eldste ~70 % arkivert
+    po_dates = sorted(when() for _ in range(pos))
+    counts["purchase_orders"] = _insert(conn, "purchase_orders", ("code", "supplier", "pdf_path", "archived", "created_at"), (
+        (f"PO-{d.year}-{i:05d}", rnd.choice(SUPPLIERS), "", int(i <= pos * 0.7), _ts(d))
+        for i, d in enumerate(po_dates, start=1)))
+
+    # Kundeordrer: 30 % åpne (de nyeste), ellers lukket/kansellert
+    co_dates = sorted(when() for _ in range(cos))
+    co_status = {}
+    def co_rows():
+        for i, d in enumerate(co_dates, start=1):
+            status = "open" if i > cos * 0.7 else ("cancelled" if rnd.random() < 0.12 else "closed")
+            co_status[i] = status
+            yield (f"CO-{d.year}-{i:05d}", rnd.randint(1, customers) if customers else None, status, "", _ts(d))
+    counts["customer_orders"] = _insert(conn, "customer_orders", ("code", "customer_id", "status", "notes", "created_at"), co_rows())
+    open_cos = [i for i, s in co_status.items() if s == "open"]
+
+    item_cum = _zipf_cum(items)
+    item_ids = range(1, items + 1)
+    pick_items = lambda k: rnd.choices(item_ids, cum_weights=item_cum, k=k)  # noqa: E731
+
+    counts["purchase_order_lines"] = _insert(conn, "purchase_order_lines", ("po_id", "item_id", "qty_ordered", "qty_received"), (
+        (po, item, q, q if po <= pos * 0.9 or rnd.random() < 0.5 else rnd.randint(0, q))
+        for po in range(1, pos + 1)
+        for item in set(pick_items(rnd.randint(1, 8)))
+        for q in (rnd.randint(1, 50),)))
+
+    counts["customer_order_lines"] = _insert(conn, "customer_order_lines",
+                                             ("co_id", "item_id", "qty_ordered", "qty_reserved", "qty_fulfilled", "notes", "created_at"), (
+        (co, item, q, 0, q if co_status[co] == "closed" else 0, "", _ts(co_dates[co - 1]))
+        for co in range(1, cos + 1)
+        for item in set(pick_items(rnd.randint(1, 5)))
+        for q in (rnd.randint(1, 10),)))
+
+    # Enheter: ~55 % ledige, ~15 % reservert på åpne CO-er, ~30 % brukt
+    def unit_rows():
+        for item in pick_items(units):
+            created = when()
+            r = rnd.random()
+            if r < 0.15 and open_cos:
+                status, co, used = "reserved", rnd.choice(open_cos), None
+            elif r < 0.45:
+                status, co, used = "used", None, _ts(min(now, created + timedelta(days=rnd.randint(1, 120))))
+            else:
+                status, co, used = "available", None, None
+            yield (item, rnd.randint(1, pos) if pos else None, co, status, round(rnd.uniform(5, 500), 2), _ts(created), used, 1)
+    counts["item_units"] = _insert(conn, "item_units",
+                                   ("item_id", "po_id", "reserved_co_id", "status", "purchase_price", "created_at", "used_at", "qty"),
+                                   unit_rows())
+    # Som migrering 008: intern strekkode pr rad
+    conn.execute("UPDATE item_units SET barcode = ? || printf('%08d', id) WHERE barcode IS NULL", (unitcodes.PREFIX,))
+    conn.execute("""
+        UPDATE customer_order_lines SET qty_reserved = MIN(qty_ordered, (
+            SELECT COUNT(*) FROM item_units u
+            WHERE u.item_id = customer_order_lines.item_id AND u.reserved_co_id = customer_order_lines.co_id))
+    """)
+
+    names = dict(conn.execute("SELECT id, name FROM items"))
+    def tx_rows():
+        for item in pick_items(txs):
+            r = rnd.random()
+            if r < 0.55:
+                delta, note, po, co = rnd.randint(1, 20), "Mottak", rnd.randint(1, pos) if pos else None, None
+            elif r < 0.85:
+                delta, note, po, co = -rnd.randint(1, 5), "Uttak", None, rnd.randint(1, cos) if cos else None
+            elif r < 0.95:
+                delta, note, po, co = 0, "Reservert", None, rnd.choice(open_cos) if open_cos else None
+            else:
+                delta, note, po, co = rnd.choice((-1, 1)), "Justering", None, None
+            yield (item, f"SKU-{item:06d}", names[item], delta, note, _ts(when()), 1, "Bench", po, co, ledger.LEGACY, 0)
+    # Historikk fra før lagerboka (som rader migrering 009 fant): tallene står i åpningsbalansen under
+    counts["transactions"] = _insert(conn, "transactions",
+                                     ("item_id", "sku", "name", "delta", "note", "ts", "user_id", "user_name", "po_id", "co_id",
+                                      "kind", "qty"), tx_rows())
+
+    # Lagerbeholdning = enheter som ikke er brukt (ledige + reserverte)
+    conn.execute("""
+        UPDATE items SET qty = (SELECT COUNT(*) FROM item_units u WHERE u.item_id = items.id AND u.status != 'used')
+    """)
+    # Lagerboka: åpningsbalanse fra varene/enhetene over og projeksjonene (item_stock, CO-linjer) fra den
+    ledger.open_balance(conn.execute)
+    ledger.rebuild(conn.execute)
+    conn.execute("COMMIT")
+    conn.execute("ANALYZE")
+    conn.close()
+    return counts
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Lag et syntetisk lagerdatasett for benchmarks.")
+    ap.add_argument("--db", required=True, help="ny SQLite-fil som skal lages")
+    ap.add_argument("--items", type=int, default=2000)
+    ap.add_argument("--units", type=int, default=20000)
+    ap.add_argument("--pos", type=int, default=300)
+    ap.add_argument("--cos", type=int, default=300)
+    ap.add_argument("--customers", type=int, default=200)
+    ap.add_argument("--txs", type=int, default=50000)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args(argv)
+
+    t = time.perf_counter()
+    counts = generate(args.db, args.items, args.units, args.pos, args.cos, args.customers, args.txs, args.seed)
+    for table, n in counts.items():
+        print(f"  {table:<22} {n:>9}")
+    print(f"✅ {args.db} laget på {time.perf_counter() - t:.1f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,347 @@
+# bench/loadtest.py
+"""Lasttest: samtidige lagerarbeidere mot en lokal uvicorn.
+
+    python -m bench.gen_data --db bench.db
+    python -m bench.loadtest --db bench.db --workers 1 2 4 8 16 32 --duration 20 --out last.json [--plot last.png]
+
+Hver arbeider er en innlogget bruker (egen session-cookie) som kjører
+realistiske flyter med tenketid mellom: skann-mottak mot en PO, reservasjon
+til en CO, uttak av enheter og blaing i dashboardet. I tillegg holder
+--watchers klienter `/stream/tx` åpen og teller hendelser. Med
+--bulk-import N kjører det importjobber på N rader etter hverandre gjennom
+hele trinnet, så man ser om skann-flytene holder p99 mens en bulkjobb har
+skrivelåsen.
+
+For hvert trinn (antall arbeidere) måles gjennomstrømning, feilrate pr type
+(særlig `database is locked`, som appen svarer med 503) og halelatens pr flyt,
+slik at man ser hvor systemet metter. 4xx-svar (f.eks. tomt for ledige enheter)
+telles som `rejected`, ikke som feil. Uten --url startes uvicorn selv mot en
+kopi av databasen.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from .gen_data import BENCH_EMAIL, BENCH_PASSWORD
+from .run import Fixtures, git_commit, percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FlowError(Exception):
+    def __init__(self, kind: str):
+        super().__init__(kind)
+        self.kind = kind
+
+
+def _check(resp) -> None:
+    if resp.status_code == 503 or b"database is locked" in resp.content:
+        raise FlowError("locked")
+    if resp.status_code >= 500:
+        raise FlowError("5xx")
+    if resp.status_code >= 400:
+        # f.eks. "for få ledige enheter" når en annen arbeider rakk det først – ikke en systemfeil
+        raise FlowError("rejected")
+
+
+# ---------- Flyter ----------
+async def flow_scan_receive(c, fx, r):
+    po = r.choice(fx.po_codes)
+    _check(await c.get("/po/scan"))
+    lines = [{"sku": r.choice(fx.skus), "qty": r.randint(1, 4)} for _ in range(r.randint(1, 12))]
+    _check(await c.post("/api/scan/batch", json={"po_code": po, "lines": lines, "auto_create": False}))
+
+
+async def flow_reserve(c, fx, r):
+    co_id, _ = r.choice(fx.open_cos)
+    _check(await c.get(f"/co/{co_id}"))
+    item_id = fx.item_with_stock()
+    if item_id is None:
+        return
+    _check(await c.post(f"/co/{co_id}/reserve", data={"item_id": str(item_id), "qty": str(r.randint(1, 2))}))
+
+
+async def flow_issue(c, fx, r):
+    unit_id, item_id = fx.available_unit()
+    if unit_id is None:
+        return
+    _check(await c.get(f"/item/{item_id}/units"))
+    _, co_code = r.choice(fx.open_cos)
+    _check(await c.post(f"/item/{item_id}/units/issue", data={"unit_ids": str(unit_id), "co_code": co_code}))
+
+
+async def flow_browse(c, fx, r):
+    sort = r.choice(("name", "qty", "sku", "value"))
+    _check(await c.get(f"/?page={r.randint(1, 10)}&sort={sort}"))
+    if r.random() < 0.5:
+        _check(await c.get(f"/?q={r.choice(fx.words)}"))
+
+
+FLOWS = {
+    "scan_receive": (flow_scan_receive, 3),
+    "reserve": (flow_reserve, 2),
+    "issue": (flow_issue, 2),
+    "browse": (flow_browse, 4),
+}
+
+
+# ---------- Kjøring ----------
+class Stats:
+    def __init__(self):
+        self.lat = defaultdict(list)
+        self.ok = Counter()
+        self.errors = defaultdict(Counter)
+        self.events = 0
+        self.imports = 0
+
+    def summary(self, seconds: float) -> dict:
+        flows = {}
+        for name in FLOWS:
+            lat = sorted(self.lat[name])
+            n_err = sum(n for kind, n in self.errors[name].items() if kind != "rejected")
+            total = self.ok[name] + sum(self.errors[name].values())
+            flows[name] = {
+                "ok": self.ok[name],
+                "errors": dict(self.errors[name]),
+                "error_rate": round(n_err / total, 4) if total else 0.0,
+                "throughput_per_s": round(self.ok[name] / seconds, 2),
+                "p50_ms": round(percentile(lat, 50), 1),
+                "p95_ms": round(percentile(lat, 95), 1),
+                "p99_ms": round(percentile(lat, 99), 1),
+            }
+        ok = sum(self.ok.values())
+        errs = sum(n for c in self.errors.values() for kind, n in c.items() if kind != "rejected")
+        rejected = sum(c["rejected"] for c in self.errors.values())
+        locked = sum(c["locked"] for c in self.errors.values())
+        return {
+            "throughput_per_s": round(ok / seconds, 2),
+            "error_rate": round(errs / (ok + errs + rejected), 4) if ok + errs + rejected else 0.0,
+            "rejected": rejected,
+            "locked_errors": locked,
+            "sse_events": self.events,
+            "bulk_imports": self.imports,
+            "flows": flows,
+        }
+
+
+async def login(client) -> None:
+    resp = await client.post("/auth/login", data={"email": BENCH_EMAIL, "password": BENCH_PASSWORD})
+    if resp.status_code != 303:
+        raise SystemExit(f"Innlogging feilet ({resp.status_code}) – er databasen laget med bench.gen_data?")
+
+
+async def worker(client, fx, r, stop_at: float, think_ms: float, stats: Stats):
+    names = list(FLOWS)
+    weights = [FLOWS[n][1] for n in names]
+    while time.monotonic() < stop_at:
+        name = r.choices(names, weights)[0]
+        t = time.perf_counter()
+        try:
+            await FLOWS[name][0](client, fx, r)
+        except FlowError as e:
+            stats.errors[name][e.kind] += 1
+        except Exception as e:  # timeout, brutt forbindelse …
+            stats.errors[name][type(e).__name__] += 1
+        else:
+            stats.ok[name] += 1
+            stats.lat[name].append((time.perf_counter() - t) * 1000)
+        if think_ms:
+            await asyncio.sleep(r.expovariate(1000.0 / think_ms))
+
+
+async def watcher(client, stop_at: float, stats: Stats):
+    try:
+        async with client.stream("GET", "/stream/tx", timeout=None) as resp:
+            async for line in resp.aiter_lines():
+                if line.startswith("data:"):
+                    stats.events += 1
+                if time.monotonic() >= stop_at:
+                    break
+    except Exception:
+        pass
+
+
+async def bulk_importer(client, fx, rows: int, stop_at: float, stats: Stats):
+    # Én importjobb om gangen; den som går når trinnet er slutt, avbrytes så neste trinn starter rent
+    data = fx.import_csv(rows)
+    while time.monotonic() < stop_at:
+        resp = await client.post("/import", files={"file": ("bulk.csv", data)}, headers={"Accept": "application/json"})
+        if resp.status_code != 202:
+            await asyncio.sleep(1)
+            continue
+        job_id = resp.json()["id"]
+        status = "queued"
+        while status in ("queued", "running") and time.monotonic() < stop_at:
+            await asyncio.sleep(0.25)
+            status = (await client.get(f"/api/jobs/{job_id}")).json()["status"]
+        if status in ("queued", "running"):
+            await client.post(f"/api/jobs/{job_id}/cancel")
+        else:
+            stats.imports += 1
+
+
+async def run_stage(base_url: str, fx: Fixtures, n_workers: int, n_watchers: int,
+                    duration: float, think_ms: float, seed: int, bulk_rows: int = 0) -> dict:
+    import httpx
+    stats = Stats()
+    limits = httpx.Limits(max_connections=4)
+    n_bulk = 1 if bulk_rows > 0 else 0
+    clients = [httpx.AsyncClient(base_url=base_url, timeout=30, limits=limits)
+               for _ in range(n_workers + n_watchers + n_bulk)]
+    try:
+        await asyncio.gather(*(login(c) for c in clients))
+        stop_at = time.monotonic() + duration
+        background = [asyncio.create_task(watcher(c, stop_at, stats)) for c in clients[n_workers:n_workers + n_watchers]]
+        if n_bulk:
+            background.append(asyncio.create_task(bulk_importer(clients[-1], fx, bulk_rows, stop_at, stats)))
+        t = time.perf_counter()
+        await asyncio.gather(*(
+            worker(c, fx, random.Random(seed * 1000 + i), stop_at, think_ms, stats)
+            for i, c in enumerate(clients[:n_workers])
+        ))
+        seconds = time.perf_counter() - t
+        for w in background[:n_watchers]:
+            w.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+    finally:
+        await asyncio.gather(*(c.aclose() for c in clients), return_exceptions=True)
+    return {"workers": n_workers, "seconds": round(seconds, 1), **stats.summary(seconds)}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(db_path: str, server_workers: int) -> tuple:
+    port = _free_port()
+    env = dict(os.environ, INV_DB=db_path, WEB_CONCURRENCY=str(server_workers))
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(server_workers), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    import httpx
+    for _ in range(200):
+        if proc.poll() is not None:
+            raise SystemExit("uvicorn avsluttet under oppstart")
+        try:
+            if httpx.get(url + "/auth/login", timeout=1).status_code == 200:
+                return proc, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    proc.terminate()
+    raise SystemExit("uvicorn svarte ikke innen 20 s")
+
+
+def print_table(stages: list) -> None:
+    print(f"\n{'arbeidere':>9} {'req/s':>8} {'feil%':>7} {'låst':>6} {'import':>6} " +
+          " ".join(f"{n + ' p99':>17}" for n in FLOWS), file=sys.stderr)
+    for s in stages:
+        print(f"{s['workers']:>9} {s['throughput_per_s']:>8.1f} {s['error_rate'] * 100:>6.1f}% {s['locked_errors']:>6} "
+              f"{s['bulk_imports']:>6} " +
+              " ".join(f"{s['flows'][n]['p99_ms']:>14.0f} ms" for n in FLOWS), file=sys.stderr)
+
+
+def plot(stages: list, path: str) -> None:
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib er ikke installert – hopper over plott", file=sys.stderr)
+        return
+    x = [s["workers"] for s in stages]
+    fig, (ax1, ax2, ax3) = plt.subplots(1, 3, figsize=(15, 4.5))
+    ax1.plot(x, [s["throughput_per_s"] for s in stages], marker="o")
+    ax1.set(title="Gjennomstrømning", xlabel="arbeidere", ylabel="flyter/s")
+    for name in FLOWS:
+        ax2.plot(x, [s["flows"][name]["p99_ms"] for s in stages], marker="o", label=name)
+    ax2.set(title="p99 pr flyt", xlabel="arbeidere", ylabel="ms")
+    ax2.legend()
+    ax3.plot(x, [s["error_rate"] * 100 for s in stages], marker="o", label="alle feil")
+    ax3.plot(x, [s["locked_errors"] for s in stages], marker="x", label="database is locked (antall)")
+    ax3.set(title="Feil", xlabel="arbeidere")
+    ax3.legend()
+    for ax in (ax1, ax2, ax3):
+        ax.set_xscale("log", base=2)
+        ax.grid(alpha=0.3)
+    fig.tight_layout()
+    fig.savefig(path, dpi=120)
+    print(f"📈 Plott skrevet til {path}", file=sys.stderr)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Lasttest med samtidige lagerarbeidere.")
+    ap.add_argument("--db", required=True, help="datasett laget med bench.gen_data (brukes også for gyldige id-er)")
+    ap.add_argument("--url", default=None, help="kjørende server (default: start uvicorn mot en kopi av --db)")
+    ap.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    ap.add_argument("--watchers", type=int, default=2, help="klienter som lytter på /stream/tx")
+    ap.add_argument("--duration", type=float, default=20, help="sekunder pr trinn")
+    ap.add_argument("--think-ms", type=float, default=200, help="snitt tenketid mellom flyter")
+    ap.add_argument("--server-workers", type=int, default=1, help="uvicorn --workers")
+    ap.add_argument("--bulk-import", type=int, default=0, metavar="N",
+                    help="kjør importjobber på N rader i bakgrunnen under hvert trinn (0 = av)")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", default=None)
+    ap.add_argument("--plot", default=None, help="PNG med metningskurver (krever matplotlib)")
+    args = ap.parse_args(argv)
+
+    tmpdir, proc, db_path, url = None, None, os.path.abspath(args.db), args.url
+    if not url:
+        tmpdir = tempfile.mkdtemp(prefix="inv-load-")
+        copy = os.path.join(tmpdir, "load.db")
+        src, dst = sqlite3.connect(db_path), sqlite3.connect(copy)
+        src.backup(dst)
+        src.close(); dst.close()
+        db_path = copy
+        proc, url = start_server(db_path, args.server_workers)
+
+    stages = []
+    try:
+        fx = Fixtures(db_path, args.seed)
+        for n in args.workers:
+            print(f"▶ {n} arbeidere i {args.duration:.0f} s …", file=sys.stderr)
+            stages.append(asyncio.run(run_stage(url, fx, n, args.watchers, args.duration, args.think_ms, args.seed,
+                                                args.bulk_import)))
+        fx.conn.close()
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait(timeout=10)
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    print_table(stages)
+    out = {
+        "meta": {"commit": git_commit(), "url": args.url or "uvicorn (lokal)", "server_workers": args.server_workers,
+                 "duration_s": args.duration, "think_ms": args.think_ms, "watchers": args.watchers, "seed": args.seed,
+                 "bulk_import_rows": args.bulk_import},
+        "stages": stages,
+    }
+    text = json.dumps(out, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.plot:
+        plot(stages, args.plot)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
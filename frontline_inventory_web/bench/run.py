@@ -0,0 +1,311 @@
+# bench/run.py
+"""Kjører benchmark-scenarier mot appen i prosess (ASGI, ingen server).
+
+    python -m bench.gen_data --db bench.db
+    python -m bench.run --db bench.db --out resultat.json [--baseline forrige.json]
+
+Databasen kopieres til en midlertidig fil først (med mindre --in-place), så
+mutasjonene (mottak, reservasjon, uttak, import) ikke endrer datasettet og
+flere kjøringer blir sammenlignbare. Resultatet er JSON med latens-persentiler,
+antall SQL-spørringer pr request og maks RSS.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from .gen_data import BENCH_EMAIL, BENCH_PASSWORD
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(sorted_vals: list, p: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    k = max(0, min(len(sorted_vals) - 1, round(p / 100 * (len(sorted_vals) - 1))))
+    return sorted_vals[k]
+
+
+def peak_rss_mb() -> float | None:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, timeout=5).stdout.strip()
+    except Exception:
+        return ""
+
+
+class Fixtures:
+    """Tilfeldige, gyldige id-er/koder fra datasettet (lest med sqlite3, utenfor målingen)."""
+
+    def __init__(self, db_path: str, seed: int):
+        self.rnd = random.Random(seed)
+        self.conn = sqlite3.connect(db_path)
+        q = lambda sql: [r[0] for r in self.conn.execute(sql)]  # noqa: E731
+        self.skus = q("SELECT sku FROM items")
+        self.categories = q("SELECT name FROM categories")
+        self.locations = q("SELECT name FROM locations")
+        self.po_codes = q("SELECT code FROM purchase_orders WHERE archived = 0") or ["PO-BENCH"]
+        self.cos = q("SELECT id FROM customer_orders")
+        self.open_cos = self.conn.execute("SELECT id, code FROM customer_orders WHERE status = 'open'").fetchall()
+        self.words = sorted({w for (n,) in self.conn.execute("SELECT name FROM items LIMIT 500") for w in n.split()[:1]})
+
+    def available_unit(self):
+        row = self.conn.execute(
+            "SELECT id, item_id FROM item_units WHERE status = 'available' AND item_id IS NOT NULL "
+            "ORDER BY random() LIMIT 1").fetchone()
+        return row or (None, None)
+
+    def busy_item(self):
+        # Varene med flest enhetsrader – der en N+1 i enhetstabellen slår hardest ut
+        if not hasattr(self, "_busy"):
+            self._busy = [r[0] for r in self.conn.execute(
+                "SELECT item_id FROM item_units WHERE item_id IS NOT NULL "
+                "GROUP BY item_id ORDER BY COUNT(*) DESC LIMIT 20")] or [None]
+        return self.rnd.choice(self._busy)
+
+    def item_with_stock(self):
+        row = self.conn.execute(
+            "SELECT item_id FROM item_units WHERE status = 'available' AND item_id IS NOT NULL "
+            "GROUP BY item_id ORDER BY random() LIMIT 1").fetchone()
+        return row[0] if row else None
+
+    def import_csv(self, n: int = 200) -> bytes:
+        lines = ["sku,name,category,location,price"]
+        for sku in self.rnd.sample(self.skus, min(n, len(self.skus))):
+            lines.append(f"{sku},Importert {sku},{self.rnd.choice(self.categories)},"
+                         f"{self.rnd.choice(self.locations)},{self.rnd.randint(10, 900)}")
+        for i in range(n // 10):
+            lines.append(f"IMP-{self.rnd.randint(0, 10**9):09d},Ny vare {i},{self.rnd.choice(self.categories)},,0")
+        return "\n".join(lines).encode()
+
+
+def scenarios(fx: Fixtures):
+    """(navn, antall-faktor, fabrikk) – fabrikken gir (metode, url, kwargs) for ett kall."""
+    r = fx.rnd
+    get = lambda url: ("GET", url, {})  # noqa: E731
+
+    def receive():
+        return "POST", "/receive", {"data": {"sku": r.choice(fx.skus), "qty": str(r.randint(1, 3)),
+                                             "po_code": r.choice(fx.po_codes), "price": "12.5"}}
+
+    def reserve():
+        co_id, _ = r.choice(fx.open_cos)
+        return "POST", f"/co/{co_id}/reserve", {"data": {"item_id": str(fx.item_with_stock()), "qty": "1"}}
+
+    def issue():
+        unit_id, item_id = fx.available_unit()
+        _, co_code = r.choice(fx.open_cos)
+        return "POST", f"/item/{item_id}/units/issue", {"data": {"unit_ids": str(unit_id), "co_code": co_code}}
+
+    def do_import():
+        return "POST", "/import", {"files": {"file": ("bench.csv", fx.import_csv(), "text/csv")}, "data": {"mode": "merge"}}
+
+    return [
+        ("dashboard", 1, lambda: get("/")),
+        ("dashboard_page", 1, lambda: get(f"/?page={r.randint(2, 20)}")),
+        ("dashboard_sort_qty", 1, lambda: get("/?sort=qty")),
+        ("dashboard_sort_value_100", 1, lambda: get("/?sort=value&per_page=100")),
+        ("dashboard_search", 1, lambda: get(f"/?q={r.choice(fx.words)}")),
+        ("dashboard_category", 1, lambda: get(f"/?category={r.choice(fx.categories)}&sort=sku")),
+        ("dashboard_location", 1, lambda: get(f"/?location={r.choice(fx.locations)}")),
+        ("orders", 1, lambda: get("/orders")),
+        ("po_list", 1, lambda: get("/po")),
+        ("co_detail", 1, lambda: get(f"/co/{r.choice(fx.cos)}")),
+        ("item_detail", 1, lambda: get(f"/item/{fx.busy_item()}")),
+        ("item_units", 1, lambda: get(f"/item/{fx.busy_item()}/units")),
+        ("tx", 1, lambda: get("/tx")),
+        ("receive", 1, receive),
+        ("reserve", 1, reserve),
+        ("issue", 1, issue),
+        ("import_csv_200", 0.2, do_import),
+        ("export_json", 0.2, lambda: get("/export.json")),
+        ("export_csv", 0.2, lambda: get("/export.csv")),
+    ]
+
+
+# Maks SQL-spørringer pr request (median) for sidene som viser lister. Tallet skal ikke
+# vokse med antall rader: en relasjon som lastes lazy i en mal (N+1) gir fort 10-100x,
+# og `bench.run` avslutter da med exit-kode 1.
+QUERY_BUDGET = {
+    "dashboard": 6, "dashboard_page": 6, "dashboard_sort_qty": 6, "dashboard_sort_value_100": 6,
+    "dashboard_search": 7, "dashboard_category": 7, "dashboard_location": 7,
+    "orders": 3, "po_list": 5, "co_detail": 5, "item_detail": 6, "item_units": 6, "tx": 3,
+}
+
+
+def over_budget(results: dict) -> list:
+    return [(name, res["queries_p50"], QUERY_BUDGET[name]) for name, res in results.items()
+            if name in QUERY_BUDGET and res["queries_p50"] > QUERY_BUDGET[name]]
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.n = 0
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args, **kw):
+        self.n += 1
+
+
+async def run(db_path: str, iterations: int, warmup: int, seed: int, only: list | None) -> dict:
+    import httpx
+    os.environ["INV_DB"] = db_path
+    from app.main import app
+    from app.db import engine
+
+    counter = QueryCounter(engine)
+    fx = Fixtures(db_path, seed)
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        warm = getattr(app.state, "warm", None)
+        if warm is not None:
+            await warm
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            resp = await client.post("/auth/login", data={"email": BENCH_EMAIL, "password": BENCH_PASSWORD})
+            if resp.status_code != 303:
+                raise SystemExit(f"Innlogging feilet ({resp.status_code}) – er databasen laget med bench.gen_data?")
+
+            for name, factor, make in scenarios(fx):
+                if only and name not in only:
+                    continue
+                n = max(3, int(iterations * factor))
+                lat, queries, errors, sizes = [], [], 0, []
+                for i in range(warmup + n):
+                    method, url, kw = make()
+                    q0 = counter.n
+                    t = time.perf_counter()
+                    resp = await client.request(method, url, **kw)
+                    ms = (time.perf_counter() - t) * 1000
+                    if i < warmup:
+                        continue
+                    if resp.status_code >= 400:
+                        errors += 1
+                    lat.append(ms)
+                    queries.append(counter.n - q0)
+                    sizes.append(len(resp.content))
+                lat.sort()
+                results[name] = {
+                    "n": n,
+                    "errors": errors,
+                    "p50_ms": round(percentile(lat, 50), 2),
+                    "p90_ms": round(percentile(lat, 90), 2),
+                    "p99_ms": round(percentile(lat, 99), 2),
+                    "max_ms": round(lat[-1], 2),
+                    "mean_ms": round(sum(lat) / len(lat), 2),
+                    "queries_per_req": round(sum(queries) / len(queries), 1),
+                    "queries_p50": percentile(sorted(queries), 50),
+                    "bytes_per_req": int(sum(sizes) / len(sizes)),
+                }
+                print(f"  {name:<26} p50 {results[name]['p50_ms']:8.1f} ms  p90 {results[name]['p90_ms']:8.1f} ms"
+                      f"  {results[name]['queries_per_req']:7.1f} q/req" + (f"  ({errors} feil)" if errors else ""),
+                      file=sys.stderr)
+    fx.conn.close()
+    return results
+
+
+def dataset_counts(db_path: str) -> dict:
+    conn = sqlite3.connect(db_path)
+    try:
+        return {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in (
+            "items", "item_units", "purchase_orders", "customer_orders", "customers", "transactions")}
+    finally:
+        conn.close()
+
+
+def compare(current: dict, baseline: dict) -> None:
+    print(f"\n{'scenario':<26} {'p50':>18} {'p90':>18} {'q/req':>14}", file=sys.stderr)
+    for name, cur in current["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+
+        def delta(key):
+            b, c = base[key], cur[key]
+            pct = (c - b) / b * 100 if b else 0.0
+            return f"{c:8.1f} ({pct:+5.0f}%)"
+        print(f"{name:<26} {delta('p50_ms'):>18} {delta('p90_ms'):>18} {delta('queries_per_req'):>14}", file=sys.stderr)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark appen mot et syntetisk datasett.")
+    ap.add_argument("--db", required=True, help="datasett laget med bench.gen_data")
+    ap.add_argument("--out", default=None, help="JSON-fil for resultatet (default: stdout)")
+    ap.add_argument("--iterations", type=int, default=30)
+    ap.add_argument("--warmup", type=int, default=2)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--only", nargs="*", help="kjør bare disse scenariene")
+    ap.add_argument("--in-place", action="store_true", help="ikke kopier databasen først")
+    ap.add_argument("--baseline", default=None, help="tidligere resultat å sammenligne med")
+    args = ap.parse_args(argv)
+
+    db_path = os.path.abspath(args.db)
+    tmpdir = None
+    if not args.in_place:
+        tmpdir = tempfile.mkdtemp(prefix="inv-bench-")
+        src = sqlite3.connect(db_path)
+        db_path = os.path.join(tmpdir, "bench.db")
+        dst = sqlite3.connect(db_path)
+        src.backup(dst)  # tar med eventuell WAL-innhold
+        src.close(); dst.close()
+
+    try:
+        t = time.perf_counter()
+        scen = asyncio.run(run(db_path, args.iterations, args.warmup, args.seed, args.only))
+        out = {
+            "meta": {
+                "commit": git_commit(),
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "platform": platform.platform(),
+                "iterations": args.iterations,
+                "seed": args.seed,
+                "wall_s": round(time.perf_counter() - t, 2),
+            },
+            "dataset": dataset_counts(db_path),
+            "scenarios": scen,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    text = json.dumps(out, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"✅ Resultat skrevet til {args.out} (maks RSS {out['peak_rss_mb']} MB)", file=sys.stderr)
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(out, json.load(f))
+    failed = over_budget(scen)
+    for name, n, budget in failed:
+        print(f"❌ {name}: {n} spørringer pr request (maks {budget}) – N+1? Se lasteprofilene i app/queries.py",
+              file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
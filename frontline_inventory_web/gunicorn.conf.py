@@ -0,0 +1,26 @@
+# gunicorn.conf.py
+# Flere prosesser (Linux/macOS):  gunicorn -c gunicorn.conf.py app.main:app
+# Antall workers: WEB_CONCURRENCY (default antall kjerner, maks 8). På Windows: Start-workers.bat.
+import multiprocessing
+import os
+
+workers = int(os.environ.get("WEB_CONCURRENCY") or min(multiprocessing.cpu_count(), 8))
+# Workerne arver miljøet: appen slår på prosessbussen (SSE mellom prosesser) når WEB_CONCURRENCY > 1
+os.environ["WEB_CONCURRENCY"] = str(workers)
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = os.environ.get("INV_BIND", "0.0.0.0:8000")
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+
+def on_starting(server):
+    # Én gang i master før workerne startes: migreringer og felles session-nøkkel.
+    # Workerne finner da databasen oppdatert (én SELECT), leser samme nøkkelfil og
+    # ferdigbygde statiske filer.
+    from app.migrations import run_migrations
+    from app.auth import session_secret
+    from app import assets
+    run_migrations()
+    session_secret()
+    assets.build()